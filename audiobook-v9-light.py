@@ -2,17 +2,27 @@ import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
-import asyncio
-import edge_tts
-import pdfplumber
-from bs4 import BeautifulSoup
-from ebooklib import epub
+import itertools
+from tts_engine import SynthesisEngine, SynthesisError, DEFAULT_CONCURRENCY, split_text_into_chunks
+from chunk_planner import DEFAULT_MAX_BYTES, ChunkStream
+from chunk_cache import ChunkCache
+from mp3_tools import concatenate, load_frame_index
+from metrics import RunMetrics, Throughput, format_eta
+from progress_bus import ProgressBus, ProgressPanel
+from ffmpeg_pool import FFmpegEncoder, read_ffmpeg_config, write_ffmpeg_config
+from job_queue import JobQueue, launch_workers
+from text_cache import TextCache
+from text_processing import RunningHeaderFilter, iter_book_text, iter_source_pieces, preload_extractors
+from voice_catalog import VoiceCatalog, voices_by_locale
 
 class AudiobookApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Audiobook Creator")
-        self.root.geometry("600x600")
+        self.root.geometry("600x880")
+        # i thread di lavoro aggiornano la GUI solo attraverso il bus
+        self.bus = ProgressBus(root)
+        self.bus.start()
 
         self.file_label = ttk.Label(root, text="Seleziona i file:")
         self.file_label.pack(pady=5)
@@ -46,6 +56,12 @@ class AudiobookApp:
         self.speed_combo.current(2)
         self.speed_combo.pack(pady=5)
 
+        self.concurrency_label = ttk.Label(root, text="Richieste parallele:")
+        self.concurrency_label.pack(pady=5)
+        self.concurrency_var = tk.IntVar(value=DEFAULT_CONCURRENCY)
+        self.concurrency_spin = ttk.Spinbox(root, from_=1, to=32, textvariable=self.concurrency_var, width=5)
+        self.concurrency_spin.pack(pady=5)
+
         self.delete_parts_var = tk.BooleanVar()
         self.delete_parts_checkbox = ttk.Checkbutton(
             root, text="Elimina i file partX.mp3 dopo l'unione",
@@ -53,12 +69,61 @@ class AudiobookApp:
         )
         self.delete_parts_checkbox.pack(pady=5)
 
+        self.direct_var = tk.BooleanVar()
+        self.direct_checkbox = ttk.Checkbutton(
+            root, text="Scrivi direttamente il file finale (senza file partX.mp3)",
+            variable=self.direct_var
+        )
+        self.direct_checkbox.pack(pady=5)
+
+        self.compress_frame = ttk.Frame(root)
+        self.compress_frame.pack(pady=5)
+        self.compress_var = tk.BooleanVar()
+        self.compress_checkbox = ttk.Checkbutton(
+            self.compress_frame, text="Comprimi con ffmpeg durante la sintesi a (kbps):",
+            variable=self.compress_var
+        )
+        self.compress_checkbox.pack(side=tk.LEFT)
+        self.bitrate_var = tk.StringVar(value="32")
+        self.bitrate_entry = ttk.Entry(self.compress_frame, textvariable=self.bitrate_var, width=5)
+        self.bitrate_entry.pack(side=tk.LEFT, padx=5)
+
+        self.use_cache_var = tk.BooleanVar(value=True)
+        self.use_cache_checkbox = ttk.Checkbutton(
+            root, text="Riusa i testi già letti e le parti già sintetizzate (cache)",
+            variable=self.use_cache_var
+        )
+        self.use_cache_checkbox.pack(pady=5)
+
+        self.cache = ChunkCache()
+        # testi estratti da PDF, EPUB e DOCX, condivisi con la pulizia e la pipeline
+        self.text_cache = TextCache()
+        self.engine = SynthesisEngine(cache=self.cache)
         self.voices = []
-        threading.Thread(target=self.fetch_voices, daemon=True).start()
+        # le voci salvate rendono subito usabili le combo; la rete serve solo se sono vecchie
+        self.voice_catalog = VoiceCatalog()
+        if self.voice_catalog.load():
+            self.voices = self.voice_catalog.voices
+            self.update_voice_combo()
+        if self.voice_catalog.stale:
+            threading.Thread(target=self.fetch_voices, daemon=True).start()
 
         self.create_button = ttk.Button(root, text="Crea Audiobooks", command=self.create_audiobooks)
         self.create_button.pack(pady=10)
 
+        # in alternativa: coda persistente elaborata da processi separati (job_queue.py)
+        self.queue_frame = ttk.Frame(root)
+        self.queue_frame.pack(pady=5)
+        self.queue_button = ttk.Button(self.queue_frame, text="Metti in coda", command=self.enqueue_books)
+        self.queue_button.pack(side=tk.LEFT)
+        ttk.Label(self.queue_frame, text="priorità:").pack(side=tk.LEFT, padx=5)
+        self.priority_var = tk.IntVar(value=0)
+        self.priority_spin = ttk.Spinbox(self.queue_frame, from_=-10, to=10, textvariable=self.priority_var, width=4)
+        self.priority_spin.pack(side=tk.LEFT)
+
+        self.progress = ProgressPanel(root, length=500)
+        self.progress.pack(pady=2)
+
         self.status_label = ttk.Label(root, text="")
         self.status_label.pack(pady=5)
 
@@ -67,6 +132,7 @@ class AudiobookApp:
         self.file_listbox.delete(0, tk.END)
         for file_path in file_paths:
             self.file_listbox.insert(tk.END, file_path)
+        preload_extractors(file_paths)
 
     def browse_output_folder(self):
         output_dir = filedialog.askdirectory(title="Seleziona la cartella di destinazione")
@@ -74,94 +140,218 @@ class AudiobookApp:
         self.output_entry.insert(0, output_dir)
 
     def extract_text_from_pdf(self, pdf_path):
-        text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() + "\n"
-        return text
+        return "\n".join(iter_source_pieces(pdf_path, cache=self.text_cache, stream=False)) + "\n"
 
     def extract_text_from_epub(self, epub_path):
-        book = epub.read_epub(epub_path)
-        text = ""
-        for item in book.items:
-            if item.get_type() == 9:
-                soup = BeautifulSoup(item.content, 'html.parser')
-                text += soup.get_text() + "\n"
-        return text
+        return "\n".join(iter_source_pieces(epub_path, cache=self.text_cache)) + "\n"
 
     def text_to_speech_edge_tts(self, text, output_path, voice, speed):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        communicate = edge_tts.Communicate(text, voice)
-        communicate.rate = float(speed)
-        loop.run_until_complete(communicate.save(output_path))
-
-    def split_text_into_chunks(self, text, chunk_size=5000):
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            if end >= len(text):
-                chunks.append(text[start:])
-                break
-            else:
-                last_period = text.rfind('.', start, end)
-                if last_period != -1:
-                    end = last_period + 1
-                chunks.append(text[start:end])
-                start = end
-        return chunks
+        self.engine.synthesize([text], [output_path], voice, speed)
 
-    def create_audiobooks(self):
-        file_paths = self.file_listbox.get(0, tk.END)
-        output_dir = self.output_entry.get()
-        voice = self.voice_combo.get()
-        speed = self.speed_combo.get()
-        delete_parts = self.delete_parts_var.get()
+    def split_text_into_chunks(self, text):
+        return split_text_into_chunks(text)
+
+    def read_settings(self):
+        """Impostazioni del form; None (dopo aver avvisato l'utente) se non sono valide."""
+        settings = {
+            "file_paths": self.file_listbox.get(0, tk.END),
+            "output_dir": self.output_entry.get(),
+            "voice": self.voice_combo.get(),
+            "speed": self.speed_combo.get(),
+            "delete_parts": self.delete_parts_var.get(),
+            "direct": self.direct_var.get(),
+            "compress": self.compress_var.get(),
+            "ffmpeg_path": None,
+            "bitrate": None,
+        }
+        try:
+            settings["concurrency"] = int(self.concurrency_var.get())
+            if settings["concurrency"] < 1:
+                raise ValueError
+        except (ValueError, tk.TclError):
+            messagebox.showwarning("Attenzione", "Inserisci un numero valido di richieste parallele.")
+            return None
 
-        if not file_paths or not output_dir or not voice:
+        if not settings["file_paths"] or not settings["output_dir"] or not settings["voice"]:
             messagebox.showwarning("Attenzione", "Completa tutti i campi obbligatori.")
+            return None
+
+        if settings["compress"]:
+            try:
+                settings["bitrate"] = int(self.bitrate_var.get())
+                if settings["bitrate"] < 32:
+                    raise ValueError
+            except ValueError:
+                messagebox.showwarning("Attenzione", "Inserisci un bitrate valido (>=32).")
+                return None
+            settings["ffmpeg_path"] = self.get_ffmpeg_path()
+            if not settings["ffmpeg_path"]:
+                return None
+        return settings
+
+    def enqueue_books(self):
+        settings = self.read_settings()
+        if settings is None:
+            return
+        try:
+            priority = int(self.priority_var.get())
+        except (ValueError, tk.TclError):
+            priority = 0
+        queue = JobQueue()
+        try:
+            for file_path in settings["file_paths"]:
+                queue.add(file_path, settings["output_dir"], settings["voice"], settings["speed"], priority,
+                          settings["bitrate"], settings["ffmpeg_path"], settings["delete_parts"])
+            # il budget è condiviso da tutti i processi della coda
+            queue.budget = settings["concurrency"]
+            # sempre: un processo ancora registrato potrebbe stare per uscire (coda vuota) o essere
+            # caduto senza rilasciare il lease; quelli in più trovano la coda vuota ed escono subito
+            launch_workers(use_cache=self.use_cache_var.get())
+        except Exception as e:
+            messagebox.showerror("Errore", f"Impossibile mettere in coda i libri: {str(e)}")
+            return
+        finally:
+            queue.close()
+        self.status_label.config(text=f"{len(settings['file_paths'])} libri in coda: l'elaborazione continua "
+                                      f"anche chiudendo la finestra (stato: python job_queue.py list)")
+
+    def create_audiobooks(self):
+        settings = self.read_settings()
+        if settings is None:
             return
+        file_paths = settings["file_paths"]
+        output_dir = settings["output_dir"]
+        voice = settings["voice"]
+        speed = settings["speed"]
+        delete_parts = settings["delete_parts"]
+        direct = settings["direct"]
+        compress = settings["compress"]
+        concurrency = settings["concurrency"]
+        ffmpeg_path = settings["ffmpeg_path"]
+        bitrate = settings["bitrate"]
+        self.engine.concurrency = concurrency
+        self.engine.cache = self.cache if self.use_cache_var.get() else None
+        text_cache = self.text_cache if self.use_cache_var.get() else None
+        metrics = RunMetrics("audiobook", {
+            "voice": voice, "speed": speed, "concurrency": concurrency, "max_bytes": DEFAULT_MAX_BYTES,
+            "cache": self.engine.cache is not None, "bitrate": bitrate,
+            "mode": "compress" if compress else "direct" if direct else "parts",
+        })
+        self.engine.metrics = metrics
 
         self.create_button.config(state=tk.DISABLED)
+        self.progress.reset()
 
         def generate():
             try:
                 os.makedirs(output_dir, exist_ok=True)
-                for file_path in file_paths:
-                    try:
-                        if file_path.endswith(".pdf"):
-                            text = self.extract_text_from_pdf(file_path)
-                        elif file_path.endswith(".epub"):
-                            text = self.extract_text_from_epub(file_path)
-                        else:
-                            with open(file_path, "r", encoding="utf-8") as f:
-                                text = f.read()
-                    except Exception as e:
-                        messagebox.showerror("Errore", f"Errore nella lettura di {file_path}: {str(e)}")
-                        continue
-
+                for n, file_path in enumerate(file_paths, 1):
                     base_name = os.path.splitext(os.path.basename(file_path))[0]
-                    chunks = self.split_text_into_chunks(text)
-                    part_files = []
-                    for i, chunk in enumerate(chunks):
-                        part_path = os.path.join(output_dir, f"{base_name}_part{i}.mp3")
+                    # il libro viene letto a pezzi mentre la sintesi procede: in memoria restano
+                    # solo le pagine in lettura e i chunk in lavorazione
+                    headers = RunningHeaderFilter()
+                    chunks = ChunkStream(iter_book_text(file_path, header_filter=headers, cache=text_cache))
+                    chunk_sizes = {}
+
+                    def sized_chunks(chunks=chunks, chunk_sizes=chunk_sizes):
+                        for i, chunk in enumerate(chunks):
+                            chunk_sizes[i] = len(chunk)
+                            yield chunk
+
+                    def part_path(i, base_name=base_name):
+                        return os.path.join(output_dir, f"{base_name}_part{i}.mp3")
+
+                    # l'ETA si basa sui caratteri sintetizzati, non sul numero di chunk; il totale
+                    # (caratteri dei chunk puliti, non byte del file) è noto solo a lettura finita
+                    throughput = Throughput(None)
+
+                    def on_progress(index, completed, total, n=n, base_name=base_name, chunks=chunks,
+                                    chunk_sizes=chunk_sizes, throughput=throughput):
+                        if chunks.finished:
+                            throughput.total = chunks.chars
+                        throughput.update(throughput.done + chunk_sizes.pop(index))
+                        stats = self.engine.stats()
+                        self.bus.post("progress", self.progress.show, throughput.fraction,
+                                      f"Libro {n}/{len(file_paths)}: parte {completed}/{total or '?'} per {base_name}\n"
+                                      f"{throughput.rate:.0f} car/s, ETA {format_eta(throughput.eta)}, "
+                                      f"richieste in parallelo: {stats['concurrency']}, "
+                                      f"errori: {stats['error_rate']:.0%}, ritentate: {stats['retries']}")
+
+                    if direct or compress:
+                        final_path = os.path.join(output_dir, f"{base_name}.mp3")
                         try:
-                            self.text_to_speech_edge_tts(chunk, part_path, voice, speed)
-                            part_files.append(part_path)
-                            self.status_label.config(text=f"Creata parte {i+1}/{len(chunks)} per {base_name}")
+                            # comprende estrazione e chunking, che procedono insieme alla sintesi; in
+                            # modalità compressione anche la codifica ffmpeg
+                            with metrics.stage("sintesi", file=base_name, compress=compress) as stage:
+                                try:
+                                    if compress:
+                                        # l'audio sintetizzato va direttamente nello stdin di ffmpeg
+                                        with FFmpegEncoder(ffmpeg_path, final_path, bitrate) as encoder:
+                                            seconds = self.engine.synthesize_to_stream(sized_chunks(), encoder, voice,
+                                                                                       speed, progress=on_progress)
+                                        load_frame_index(final_path)
+                                    else:
+                                        self.engine.synthesize_to_file(sized_chunks(), final_path, voice, speed,
+                                                                       progress=on_progress)
+                                        seconds = load_frame_index(final_path).duration
+                                finally:
+                                    chunks.close()
+                                    stage.update(chars=chunks.chars, requests=chunks.request_count,
+                                                 fill=round(chunks.fill_ratio, 3), header_chars=headers.removed_chars)
+                                stage["audio_seconds"] = round(seconds, 2)
+                                metrics.add_audio(seconds)
+                            self.set_status(f"Creato: {final_path} ({chunks.summary()})"
+                                            + (f"\n{headers.summary()}" if headers.removed_lines else ""))
+                        except SynthesisError as e:
+                            self.show_error(f"Errore nella parte {e.index+1} per {base_name} "
+                                            f"dopo {self.engine.retry.max_attempts} tentativi: {str(e.error)}")
                         except Exception as e:
-                            messagebox.showerror("Errore", f"Errore nella parte {i+1} per {base_name}: {str(e)}")
-                            break
+                            if e is chunks.error:
+                                if not chunks.request_count and os.path.exists(final_path):
+                                    # nessun testo letto: non resta un file vuoto
+                                    os.remove(final_path)
+                                self.show_error(f"Errore nella lettura di {file_path}: {str(e)}")
+                            else:
+                                self.show_error(f"Errore nella scrittura per {base_name}: {str(e)}")
+                        continue
 
-                    # Concatenazione binaria MP3
+                    try:
+                        with metrics.stage("sintesi", file=base_name) as stage:
+                            try:
+                                part_files = self.engine.synthesize(sized_chunks(), map(part_path, itertools.count()),
+                                                                    voice, speed, progress=on_progress)
+                            finally:
+                                chunks.close()
+                                stage.update(chars=chunks.chars, requests=chunks.request_count,
+                                             fill=round(chunks.fill_ratio, 3), header_chars=headers.removed_chars)
+                    except SynthesisError as e:
+                        # le altre parti sono comunque state create (e sono in cache): rilanciando
+                        # vengono risintetizzate solo quelle fallite
+                        self.show_error(f"{len(e.failures)} parti non create per {base_name} "
+                                        f"(la prima è la {e.index+1}): {str(e.error)}")
+                        # come prima, si uniscono solo le parti consecutive create prima dell'errore
+                        part_files = []
+                        for i in itertools.count():
+                            if i not in e.completed:
+                                break
+                            part_files.append(part_path(i))
+                    except Exception as e:
+                        if e is chunks.error:
+                            self.show_error(f"Errore nella lettura di {file_path}: {str(e)}")
+                        else:
+                            self.show_error(f"Errore nella sintesi per {base_name}: {str(e)}")
+                        continue
+
+                    # Concatenazione MP3 a livello di frame
                     if part_files:
                         try:
                             final_path = os.path.join(output_dir, f"{base_name}.mp3")
-                            with open(final_path, "wb") as outfile:
-                                for pf in part_files:
-                                    with open(pf, "rb") as infile:
-                                        outfile.write(infile.read())
+                            with metrics.stage("unione", file=base_name, parts=len(part_files)) as stage:
+                                spans = concatenate(part_files, final_path, index=True,
+                                                    chapters=[f"Parte {i+1}" for i in range(len(part_files))])
+                                seconds = sum(span.seconds for span in spans)
+                                stage.update(bytes=os.path.getsize(final_path), audio_seconds=round(seconds, 2))
+                            metrics.add_audio(seconds)
 
                             if os.path.exists(final_path) and delete_parts:
                                 for pf in part_files:
@@ -170,37 +360,66 @@ class AudiobookApp:
                                     except Exception as e:
                                         print(f"Errore nell'eliminazione {pf}: {str(e)}")
 
-                            self.status_label.config(text=f"Creato: {final_path}")
+                            self.set_status(f"Creato: {final_path}")
                         except Exception as e:
-                            messagebox.showerror("Errore", f"Errore nell'unione per {base_name}: {str(e)}")
+                            self.show_error(f"Errore nell'unione per {base_name}: {str(e)}")
 
-                messagebox.showinfo("Successo", "Audiobooks creati con successo!")
+                self.bus.call(messagebox.showinfo, "Successo", "Audiobooks creati con successo!")
             finally:
-                self.create_button.config(state=tk.NORMAL)
+                self.engine.metrics = None
+                metrics.close(engine=self.engine.stats())
+                if self.engine.cache is not None:
+                    self.engine.cache.prune()
+                if text_cache is not None:
+                    text_cache.prune()
+                self.bus.call(self.create_button.config, state=tk.NORMAL)
 
         threading.Thread(target=generate, daemon=True).start()
 
+    def set_status(self, text):
+        """Dai thread di lavoro: testo sotto la barra di avanzamento."""
+        self.bus.post("status", self.status_label.config, text=text)
+
+    def show_error(self, message):
+        """Dai thread di lavoro: finestra di errore, senza fermare il lavoro in corso."""
+        self.bus.call(messagebox.showerror, "Errore", message)
+
+    def get_ffmpeg_path(self):
+        path = read_ffmpeg_config()
+        if path:
+            return path
+        path = filedialog.askopenfilename(title="Seleziona ffmpeg.exe", filetypes=[("ffmpeg.exe", "ffmpeg.exe")])
+        if not path:
+            messagebox.showerror("Errore", "È necessario selezionare ffmpeg.exe per comprimere.")
+            return None
+        write_ffmpeg_config(path)
+        return path
+
     def fetch_voices(self):
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            voices = loop.run_until_complete(edge_tts.list_voices())
-            self.voices = voices
-            self.root.after(0, self.update_voice_combo)
+            voices = self.voice_catalog.refresh(self.engine.run)
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Errore", f"Impossibile caricare le voci: {str(e)}"))
+            # offline: se ci sono voci salvate si continua a usare quelle
+            if not self.voices:
+                self.show_error(f"Impossibile caricare le voci: {str(e)}")
+            return
+        self.voices = voices
+        self.bus.call(self.update_voice_combo)
 
     def update_voice_combo(self):
-        self.voice_by_locale = {}
-        for v in self.voices:
-            locale = v['Locale']
-            if locale not in self.voice_by_locale:
-                self.voice_by_locale[locale] = []
-            self.voice_by_locale[locale].append(v['ShortName'])
+        previous_locale = self.locale_combo.get()
+        previous_voice = self.voice_combo.get()
+        self.voice_by_locale = voices_by_locale(self.voices)
 
         locales = sorted(self.voice_by_locale.keys())
         self.locale_combo['values'] = locales
-        if locales:
+        if previous_locale in self.voice_by_locale:
+            # aggiornamento in background: si mantiene la scelta dell'utente
+            self.locale_combo.set(previous_locale)
+            self.update_voice_combo_filtered()
+            if previous_voice in self.voice_by_locale[previous_locale]:
+                self.voice_combo.set(previous_voice)
+        elif locales:
             self.locale_combo.current(0)
             self.update_voice_combo_filtered()
 
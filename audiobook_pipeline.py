@@ -0,0 +1,291 @@
+import argparse
+import os
+import queue
+import shutil
+import threading
+import time
+
+from book_splitter import split_file_into_parts
+from chunk_cache import ChunkCache
+from ffmpeg_pool import FFmpegJob, FFmpegPool, read_ffmpeg_config
+from metrics import RunMetrics, Throughput, format_eta
+from mp3_tools import concatenate, load_frame_index, scan_mp3
+from shard_coordinator import speech_rate
+from text_cache import TextCache
+from text_processing import DocumentProcessor, RunningHeaderFilter, TextCleaner
+from chunk_planner import DEFAULT_MAX_BYTES, plan_chunks
+from tts_engine import SynthesisEngine, SynthesisError, DEFAULT_CONCURRENCY
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.epub', '.docx', '.txt')
+DEFAULT_VOICE = "it-IT-GiuseppeMultilingualNeural"
+# libri in attesa tra un passo e il successivo
+STAGE_QUEUE_SIZE = 2
+
+
+def find_books(paths):
+    books = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full = os.path.join(path, name)
+                if os.path.isfile(full) and os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                    books.append(full)
+        else:
+            books.append(path)
+    return books
+
+
+class BookJob:
+    def __init__(self, source_path, output_dir):
+        self.source_path = source_path
+        self.name = os.path.splitext(os.path.basename(source_path))[0]
+        self.work_dir = os.path.join(output_dir, self.name)
+        self.cleaned_path = None
+        self.text_parts = []
+        self.audio_parts = []
+        self.merged_path = None
+        self.final_path = None
+        self.error = None
+        self.timings = {}
+
+
+class AudiobookPipeline:
+    """Esegue i passi del README (pulizia, divisione, sintesi, unione, compressione) su più libri.
+
+    Ogni passo gira in un proprio thread collegato al successivo da una coda: mentre un
+    libro è in sintesi il successivo viene già pulito e il precedente compresso.
+    """
+
+    def __init__(self, output_dir, voice=DEFAULT_VOICE, speed="1.0", parts=1,
+                 concurrency=DEFAULT_CONCURRENCY, bitrate=32, ffmpeg_path=None,
+                 clean=True, use_cache=True, keep_parts=False, metrics_dir=None, log=print):
+        self.output_dir = output_dir
+        self.voice = voice
+        self.speed = speed
+        self.parts = parts
+        self.bitrate = bitrate
+        self.ffmpeg_path = ffmpeg_path
+        self.compress = bool(bitrate and ffmpeg_path)
+        self.clean = clean
+        self.keep_parts = keep_parts
+        self.metrics_dir = metrics_dir
+        self.metrics = None
+        self.log = log
+        self.processor = DocumentProcessor(cache=TextCache() if use_cache else None)
+        self.cleaner = TextCleaner()
+        self.engine = SynthesisEngine(concurrency, cache=ChunkCache() if use_cache else None)
+        self.stages = [
+            ("pulizia", self.clean_book),
+            ("divisione", self.split_book),
+            ("sintesi", self.synthesize_book),
+            ("unione", self.merge_book),
+        ]
+        if self.compress:
+            self.stages.append(("compressione", self.compress_book))
+
+    def run(self, paths):
+        """Elabora i libri e restituisce la lista dei BookJob (con error valorizzato se falliti)."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        jobs = [BookJob(path, self.output_dir) for path in paths]
+        self.metrics = RunMetrics("pipeline", {
+            "voice": self.voice, "speed": self.speed, "parts": self.parts,
+            "concurrency": self.engine.concurrency, "max_bytes": DEFAULT_MAX_BYTES,
+            "bitrate": self.bitrate if self.compress else None, "cache": self.engine.cache is not None,
+            "clean": self.clean, "books": len(jobs),
+        }, directory=self.metrics_dir)
+        self.engine.metrics = self.metrics
+        queues = [queue.Queue(maxsize=STAGE_QUEUE_SIZE) for _ in self.stages] + [queue.Queue()]
+        threads = [
+            threading.Thread(target=self._stage_worker, args=(name, func, queues[i], queues[i + 1]),
+                             name=f"stage-{name}", daemon=True)
+            for i, (name, func) in enumerate(self.stages)
+        ]
+        for t in threads:
+            t.start()
+        try:
+            for job in jobs:
+                queues[0].put(job)
+            queues[0].put(None)
+            for t in threads:
+                t.join()
+        finally:
+            self.engine.metrics = None
+            self.metrics.close(failed=sum(1 for job in jobs if job.error), engine=self.engine.stats())
+            if self.engine.cache is not None:
+                self.engine.cache.prune()
+            if self.processor.cache is not None:
+                self.processor.cache.prune()
+            self.engine.close()
+        return jobs
+
+    def _stage_worker(self, name, func, inbox, outbox):
+        while True:
+            job = inbox.get()
+            if job is None:
+                outbox.put(None)
+                return
+            if job.error is None:
+                start = time.perf_counter()
+                try:
+                    # ogni passo restituisce i suoi totali (caratteri, byte, secondi di audio...)
+                    with self.metrics.stage(name, book=job.name) as fields:
+                        fields.update(func(job) or {})
+                except Exception as e:
+                    job.error = f"{name}: {e}"
+                    self.log(f"[{job.name}] errore in {name}: {e}")
+                job.timings[name] = time.perf_counter() - start
+            outbox.put(job)
+
+    def clean_book(self, job):
+        os.makedirs(job.work_dir, exist_ok=True)
+        headers = RunningHeaderFilter()
+        if self.clean:
+            # un libro già pulito in un'esecuzione precedente (o dalla pulizia) arriva dalla cache
+            text, measures = self.processor.extract_clean_text(job.source_path, self.cleaner, headers)
+            self.metrics.record_stage("estrazione", measures["extraction_seconds"], book=job.name,
+                                      chars=measures["chars"], header_chars=headers.removed_chars,
+                                      header_seconds=round(headers.saved_seconds, 1), cached=measures["cached"])
+            self.metrics.record_stage("pulizia_testo", measures["cleaning_seconds"], book=job.name,
+                                      chars=measures["chars"], cached=measures["cached"])
+            cached = measures["cached"]
+        else:
+            with self.metrics.stage("estrazione", book=job.name) as fields:
+                text = self.processor.extract_text(job.source_path, headers)
+                fields.update(chars=len(text), header_chars=headers.removed_chars,
+                              header_seconds=round(headers.saved_seconds, 1))
+            cached = False
+        if headers.removed_lines:
+            self.log(f"[{job.name}] {headers.summary()}")
+        job.cleaned_path = os.path.join(job.work_dir, f"{job.name}-cleaned.txt")
+        with open(job.cleaned_path, "w", encoding="utf-8") as f:
+            f.write(text.strip())
+        self.log(f"[{job.name}] testo pulito: {len(text)} caratteri" + (" (dalla cache)" if cached else ""))
+        return {"chars": len(text)}
+
+    def split_book(self, job):
+        if self.parts > 1:
+            # parti di durata simile per la voce scelta, non solo di lunghezza simile
+            job.text_parts = split_file_into_parts(job.cleaned_path, self.parts, job.work_dir, job.name,
+                                                   speech_rate(self.voice, self.metrics_dir), self.speed)
+        else:
+            job.text_parts = [job.cleaned_path]
+        return {"parts": len(job.text_parts)}
+
+    def synthesize_book(self, job):
+        job.audio_parts = []
+        plans = []
+        for part_path in job.text_parts:
+            with open(part_path, "r", encoding="utf-8") as f:
+                plans.append(plan_chunks(f.read()))
+        total_chars = sum(len(plan.text) for plan in plans)
+        # ETA sull'intero libro, in caratteri
+        throughput = Throughput(total_chars)
+        audio_seconds = 0.0
+        for n, (part_path, plan) in enumerate(zip(job.text_parts, plans)):
+            self.log(f"[{job.name}] parte {n+1}/{len(job.text_parts)}: {plan.summary()}")
+            chunks = plan.chunks()
+            audio_path = os.path.splitext(part_path)[0] + ".mp3"
+
+            def on_progress(index, completed, total, n=n, chunks=chunks):
+                throughput.update(throughput.done + len(chunks[index]))
+                if completed == total or completed % 10 == 0:
+                    stats = self.engine.stats()
+                    self.log(f"[{job.name}] parte {n+1}/{len(job.text_parts)}: chunk {completed}/{total} "
+                             f"({throughput.rate:.0f} car/s, ETA {format_eta(throughput.eta)}, "
+                             f"in parallelo {stats['concurrency']}, errori {stats['error_rate']:.0%}, "
+                             f"ritentati {stats['retries']})")
+
+            try:
+                self.engine.synthesize_to_file(chunks, audio_path, self.voice, self.speed, progress=on_progress)
+            except SynthesisError as e:
+                raise RuntimeError(f"parte {n+1}, chunk {e.index+1}: {e.error}")
+            audio_seconds += scan_mp3(audio_path).seconds
+            job.audio_parts.append(audio_path)
+        self.metrics.add_audio(audio_seconds)
+        return {"chars": total_chars, "requests": sum(len(plan) for plan in plans),
+                "audio_seconds": round(audio_seconds, 2)}
+
+    def merge_book(self, job):
+        if self.compress:
+            job.merged_path = os.path.join(job.work_dir, f"{job.name}.mp3")
+        else:
+            job.merged_path = os.path.join(self.output_dir, f"{job.name}.mp3")
+        if len(job.audio_parts) == 1:
+            shutil.move(job.audio_parts[0], job.merged_path)
+            if not self.compress:
+                load_frame_index(job.merged_path)
+        else:
+            # un capitolo per parte; l'indice dei frame serve solo per il file finale
+            concatenate(job.audio_parts, job.merged_path, index=not self.compress,
+                        chapters=[f"Parte {i+1}" for i in range(len(job.audio_parts))])
+            if not self.keep_parts:
+                for part in job.audio_parts:
+                    os.remove(part)
+        job.final_path = job.merged_path
+        self.log(f"[{job.name}] audio unito: {job.merged_path}")
+        return {"bytes": os.path.getsize(job.merged_path)}
+
+    def compress_book(self, job):
+        final_path = os.path.join(self.output_dir, f"{job.name}.mp3")
+        ffmpeg_job = FFmpegJob(job.merged_path, final_path, self.bitrate)
+        failed = FFmpegPool(self.ffmpeg_path, 1).run([ffmpeg_job])
+        if failed:
+            raise RuntimeError(failed[0].error)
+        if not self.keep_parts:
+            os.remove(job.merged_path)
+        load_frame_index(final_path)
+        job.final_path = final_path
+        self.log(f"[{job.name}] creato: {final_path}")
+        return {"bytes": os.path.getsize(final_path), "audio_seconds": round(ffmpeg_job.duration or 0, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Crea audiolibri senza GUI: pulizia, divisione, sintesi, unione e compressione.")
+    parser.add_argument("inputs", nargs="+", help="file o cartelle di libri (pdf, epub, docx, txt)")
+    parser.add_argument("-o", "--output", required=True, help="cartella di output")
+    parser.add_argument("--voice", default=DEFAULT_VOICE)
+    parser.add_argument("--speed", default="1.0", help="velocità di lettura (es. 1.25)")
+    parser.add_argument("--parts", type=int, default=1, help="parti in cui dividere ogni libro")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="richieste TTS in parallelo per libro")
+    parser.add_argument("--bitrate", type=int, default=32, help="bitrate finale in kbps (0 = non comprimere)")
+    parser.add_argument("--ffmpeg", default=None, help="percorso di ffmpeg (default: config.txt o PATH)")
+    parser.add_argument("--no-clean", action="store_true", help="non pulire il testo (TXT già puliti)")
+    parser.add_argument("--no-cache", action="store_true", help="non usare la cache dei chunk")
+    parser.add_argument("--keep-parts", action="store_true", help="conserva gli mp3 intermedi")
+    parser.add_argument("--metrics-dir", default=None, help="cartella dei file .jsonl con le metriche")
+    args = parser.parse_args(argv)
+
+    if args.parts < 1 or args.concurrency < 1:
+        parser.error("--parts e --concurrency devono essere >= 1")
+    if args.bitrate and args.bitrate < 32:
+        parser.error("--bitrate deve essere >= 32 (o 0 per non comprimere)")
+    ffmpeg_path = None
+    if args.bitrate:
+        ffmpeg_path = args.ffmpeg or read_ffmpeg_config() or shutil.which("ffmpeg")
+        if not ffmpeg_path:
+            parser.error("ffmpeg non trovato: usa --ffmpeg oppure --bitrate 0")
+
+    books = find_books(args.inputs)
+    if not books:
+        parser.error("nessun libro trovato")
+
+    pipeline = AudiobookPipeline(
+        args.output, voice=args.voice, speed=args.speed, parts=args.parts,
+        concurrency=args.concurrency, bitrate=args.bitrate, ffmpeg_path=ffmpeg_path,
+        clean=not args.no_clean, use_cache=not args.no_cache, keep_parts=args.keep_parts,
+        metrics_dir=args.metrics_dir,
+    )
+    start = time.perf_counter()
+    jobs = pipeline.run(books)
+    failed = [job for job in jobs if job.error]
+    print(f"Completati {len(jobs) - len(failed)}/{len(jobs)} libri in {time.perf_counter() - start:.1f}s")
+    for job in failed:
+        print(f"  {job.name}: {job.error}")
+    print(f"Metriche: {pipeline.metrics.path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
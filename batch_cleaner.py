@@ -0,0 +1,219 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from text_cache import TextCache
+from text_processing import DocumentProcessor, RunningHeaderFilter, TextCleaner
+
+# secondi massimi per un documento: oltre, il processo che lo sta pulendo viene fermato
+FILE_TIMEOUT = 600
+# ogni quanto i thread del pool controllano annullamento e timeout
+POLL_INTERVAL = 0.2
+
+
+def cleaned_path(path):
+    return f"{os.path.splitext(path)[0]}-cleaned.txt"
+
+
+def clean_document(path, output_path=None, use_cache=True):
+    """Estrae e pulisce un documento e ne scrive il testo in output_path.
+
+    Con use_cache un documento già pulito (o già letto da un'altra app) viene ripreso dalla
+    TextCache. Restituisce solo le misure (non il testo), così dai processi del pool torna poco.
+    """
+    # i processi del pool non possono avviarne altri: le pagine dei PDF si leggono qui
+    processor = DocumentProcessor(pdf_workers=1, cache=TextCache() if use_cache else None)
+    headers = RunningHeaderFilter()
+    text, measures = processor.extract_clean_text(path, TextCleaner(), headers)
+    output_path = output_path or cleaned_path(path)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return {"output_path": output_path, "chars": measures["chars"], "cleaned_chars": len(text),
+            "extraction_seconds": measures["extraction_seconds"], "cleaning_seconds": measures["cleaning_seconds"],
+            "cached": measures["cached"],
+            "header_lines": headers.removed_lines, "header_chars": headers.removed_chars,
+            "header_seconds": headers.saved_seconds,
+            "header_summary": headers.summary() if headers.removed_lines else None}
+
+
+def _serve(conn):
+    """Ciclo di un processo del pool: riceve (input, output, use_cache) e risponde (ok, misure o errore)."""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        try:
+            conn.send((True, clean_document(*task)))
+        except Exception as e:
+            conn.send((False, str(e) or type(e).__name__))
+
+
+class CleanJob:
+    def __init__(self, input_path, output_path=None):
+        self.input_path = input_path
+        self.output_path = output_path or cleaned_path(input_path)
+        # misure restituite da clean_document
+        self.result = None
+        self.error = None
+        self.done = False
+        self.elapsed = None
+
+
+class CleanerPool:
+    """Pulisce i documenti su un numero limitato di processi in parallelo.
+
+    Ogni thread del pool guida un processo, che resta vivo da un documento all'altro. Se un
+    documento supera timeout secondi o il pool viene annullato, il processo viene fermato
+    e il documento successivo ne usa uno nuovo. on_done(job) viene chiamato dai thread
+    worker: chi aggiorna una GUI deve riportarlo sul thread di Tk.
+    """
+
+    def __init__(self, workers=None, timeout=FILE_TIMEOUT, on_done=None, use_cache=True):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.timeout = timeout
+        self.on_done = on_done
+        self.use_cache = use_cache
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            for process in self._running:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
+
+    def run(self, jobs):
+        """Esegue tutti i job e restituisce quelli falliti; un errore non ferma gli altri."""
+        jobs = list(jobs)
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+        threads = [threading.Thread(target=self._worker, args=(pending,), daemon=True)
+                   for _ in range(min(self.workers, len(jobs)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self.use_cache:
+            TextCache().prune()
+        if self._cancelled.is_set():
+            for job in jobs:
+                if not job.done and job.error is None:
+                    job.error = "annullato"
+        return [job for job in jobs if job.error is not None]
+
+    def _worker(self, pending):
+        worker = None
+        try:
+            while not self._cancelled.is_set():
+                try:
+                    job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                try:
+                    if worker is None:
+                        worker = self._start()
+                    reusable = self._run_job(job, *worker)
+                except Exception as e:
+                    job.error = str(e)
+                    reusable = False
+                if not reusable and worker is not None:
+                    self._stop(*worker, kill=True)
+                    worker = None
+                job.elapsed = time.perf_counter() - start
+                if self.on_done:
+                    self.on_done(job)
+        finally:
+            if worker is not None:
+                self._stop(*worker)
+
+    def _start(self):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_serve, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self._running.add(process)
+        if self._cancelled.is_set():
+            process.terminate()
+        return process, conn
+
+    def _stop(self, process, conn, kill=False):
+        with self._lock:
+            self._running.discard(process)
+        if not kill:
+            try:
+                conn.send(None)
+            except OSError:
+                kill = True
+        if kill:
+            process.terminate()
+        process.join()
+        conn.close()
+
+    def _run_job(self, job, process, conn):
+        """Pulisce job nel processo; False se il processo va fermato (timeout, annullamento, crash)."""
+        conn.send((job.input_path, job.output_path, self.use_cache))
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        while not conn.poll(POLL_INTERVAL):
+            if self._cancelled.is_set():
+                job.error = "annullato"
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                job.error = f"tempo scaduto dopo {self.timeout:.0f}s"
+                return False
+            if not process.is_alive():
+                job.error = f"processo terminato (exit code {process.exitcode})"
+                return False
+        try:
+            ok, value = conn.recv()
+        except EOFError:
+            job.error = "annullato" if self._cancelled.is_set() else f"processo terminato (exit code {process.exitcode})"
+            return False
+        if ok:
+            job.result = value
+            job.done = True
+        else:
+            job.error = value
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estrae e pulisce più documenti in parallelo (PDF, EPUB, DOCX, TXT).")
+    parser.add_argument("files", nargs="+", help="documenti da pulire; il testo va in <nome>-cleaned.txt")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processi in parallelo")
+    parser.add_argument("--timeout", type=float, default=FILE_TIMEOUT, help="secondi massimi per documento")
+    parser.add_argument("--no-cache", action="store_true", help="rilegge e ripulisce anche i documenti già puliti")
+    args = parser.parse_args(argv)
+
+    def on_done(job):
+        if job.done:
+            print(f"{os.path.basename(job.output_path)} ({job.result['cleaned_chars']} caratteri, {job.elapsed:.1f}s"
+                  + (", dalla cache)" if job.result["cached"] else ")"))
+        else:
+            print(f"ERRORE {os.path.basename(job.input_path)}: {job.error}")
+
+    start = time.perf_counter()
+    pool = CleanerPool(args.workers, args.timeout, on_done=on_done, use_cache=not args.no_cache)
+    failed = pool.run(CleanJob(path) for path in args.files)
+    print(f"{len(args.files) - len(failed)} documenti puliti, {len(failed)} con errori in "
+          f"{time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
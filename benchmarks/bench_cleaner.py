@@ -0,0 +1,87 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_processing import TextCleaner
+
+WORDS = ("il la di che e un una per non con si come più anche questo quella casa notte "
+         "vento strada sempre ancora tempo mondo libro parola storia città occhi mano giorno "
+         "improvvisamente lentamente silenzio finestra sorriso pensiero domanda risposta").split()
+
+
+def generate_pdf_text(size, seed=0, line_width=70, lines_per_page=40):
+    """Testo simile a un'estrazione da PDF: righe spezzate, sillabazione, numeri di pagina."""
+    rng = random.Random(seed)
+    pages = []
+    total = 0
+    page_number = 1
+    while total < size:
+        lines = []
+        line = ""
+        while len(lines) < lines_per_page:
+            word = rng.choice(WORDS)
+            if rng.random() < 0.08:
+                word += rng.choice(".,;:!?")
+            if len(line) + len(word) + 1 > line_width:
+                if len(word) > 6 and rng.random() < 0.3:
+                    cut = len(word) // 2
+                    lines.append(f"{line} {word[:cut]}-")
+                    line = word[cut:]
+                else:
+                    lines.append(line)
+                    line = word
+                if rng.random() < 0.05:
+                    lines.append("")
+            else:
+                line = f"{line} {word}" if line else word.capitalize()
+        lines.append(line)
+        page = "\n".join(lines) + f"\n\n{page_number}\n\n"
+        pages.append(page)
+        total += len(page)
+        page_number += 1
+    return "".join(pages)[:size]
+
+
+def bench(name, func, text, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - start)
+    mb = len(text.encode("utf-8")) / 1024 ** 2
+    print(f"{name:22s} {best * 1000:9.1f} ms  {mb / best:8.1f} MB/s")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di TextCleaner su testi estratti da PDF.")
+    parser.add_argument("--file", help="testo da usare (default: testo sintetico)")
+    parser.add_argument("--size-mb", type=float, default=5.0, help="dimensione del testo sintetico")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = generate_pdf_text(int(args.size_mb * 1024 ** 2))
+    print(f"Testo: {len(text.encode('utf-8')) / 1024 ** 2:.2f} MB, {text.count(chr(10)) + 1} righe")
+
+    cleaner = TextCleaner()
+    cleaned = bench("clean_text", cleaner.clean_text, text, args.repeat)
+    joined = bench("join_paragraphs", cleaner.join_paragraphs, cleaned, args.repeat)
+    bench("remove_page_numbers", cleaner.remove_page_numbers, joined, args.repeat)
+
+    def full_chain(t):
+        return cleaner.remove_page_numbers(cleaner.join_paragraphs(cleaner.clean_text(t)))
+
+    bench("catena completa", full_chain, text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
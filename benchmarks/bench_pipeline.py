@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_cleaner import generate_pdf_text
+from fake_edge_tts import FakeService
+
+DEFAULT_SIZES = "10K,1M,10M"
+VOICE = "it-IT-GiuseppeMultilingualNeural"
+SPEED = 1.0
+_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value):
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in _UNITS:
+        return int(float(value[:-1]) * _UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= _UNITS[unit]:
+            return f"{size / _UNITS[unit]:g}{unit}"
+    return str(size)
+
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo, None dove resource non esiste (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux in KB, macOS in byte
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_size(size, options):
+    """Esegue tutti i passi su un libro di size byte; gira in un processo a sé per misurarne il picco RSS."""
+    from metrics import RunMetrics
+    from mp3_tools import concatenate, scan_mp3
+    from text_processing import TextCleaner
+    from tts_engine import SynthesisEngine, split_text_into_chunks
+
+    results = []
+
+    def measure(stage, func, **fields):
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        fields.update(size=size, stage=stage, seconds=round(seconds, 4), rss_mb=peak_rss_mb())
+        results.append(fields)
+        return value, fields
+
+    text = generate_pdf_text(size, seed=options["seed"])
+    nbytes = len(text.encode("utf-8"))
+    cleaner = TextCleaner()
+    cleaned, fields = measure("pulizia", lambda: cleaner.remove_page_numbers(
+        cleaner.join_paragraphs(cleaner.clean_text(text))))
+    fields["mb_per_s"] = round(nbytes / 1024 ** 2 / fields["seconds"], 2)
+    chunks, fields = measure("chunking", lambda: split_text_into_chunks(cleaned))
+    fields["mb_per_s"] = round(len(cleaned.encode("utf-8")) / 1024 ** 2 / fields["seconds"], 2)
+    fields["requests"] = len(chunks)
+    chars = sum(len(c) for c in chunks)
+
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as work:
+        for mode in options["modes"]:
+            service = FakeService(options["latency"], options["jitter"], options["failure_rate"],
+                                  audio_scale=options["audio_scale"], seed=options["seed"])
+            metrics = RunMetrics("benchmark", settings=dict(options, size=size, mode=mode),
+                                 directory=os.path.join(work, "metriche"))
+            engine = SynthesisEngine(options["concurrency"], metrics=metrics,
+                                     communicate=service.communicate)
+            engine.retry.base_delay = options["retry_delay"]
+
+            def synthesize_stream():
+                with open(os.path.join(work, "stream.mp3"), "wb") as f:
+                    return engine.synthesize_to_stream(chunks, f, VOICE, SPEED)
+
+            def synthesize_parts():
+                engine.synthesize(chunks, paths, VOICE, SPEED)
+                return sum(scan_mp3(p).seconds for p in paths)
+
+            paths = [os.path.join(work, "parti", f"{i:06d}.mp3") for i in range(len(chunks))]
+            os.makedirs(os.path.join(work, "parti"), exist_ok=True)
+            try:
+                if mode == "stream":
+                    audio, fields = measure("sintesi_stream", synthesize_stream)
+                else:
+                    audio, fields = measure("sintesi_parti", synthesize_parts)
+                fields.update(engine.stats())
+                fields["latency"] = metrics.latency_percentiles()
+            finally:
+                engine.close()
+                metrics.close()
+            fields.update(chars=chars, chars_per_s=round(chars / fields["seconds"], 1),
+                          audio_per_wall=round(audio / fields["seconds"], 1),
+                          fake_requests=service.requests)
+            if mode == "parts":
+                _, fields = measure("unione", lambda: concatenate(paths, os.path.join(work, "libro.mp3")))
+                total = sum(os.path.getsize(p) for p in paths)
+                fields["mb_per_s"] = round(total / 1024 ** 2 / fields["seconds"], 2)
+    return results
+
+
+def print_results(results):
+    print(f"{'libro':>6s} {'passo':15s} {'secondi':>8s} {'MB/s':>8s} {'car/s':>9s} {'audio/s':>8s} "
+          f"{'RSS MB':>7s} {'p50':>6s} {'p90':>6s} {'p99':>6s} {'errori':>6s}")
+    for r in results:
+        latency = r.get("latency") or {}
+        cell = lambda key, fmt: format(r[key], fmt) if r.get(key) is not None else "-"
+        lat = lambda q: f"{latency[q]:.3f}" if q in latency else "-"
+        print(f"{format_size(r['size']):>6s} {r['stage']:15s} {r['seconds']:8.2f} {cell('mb_per_s', '8.1f'):>8s} "
+              f"{cell('chars_per_s', '9.0f'):>9s} {cell('audio_per_wall', '8.1f'):>8s} "
+              f"{cell('rss_mb', '7.0f'):>7s} {lat('p50'):>6s} {lat('p90'):>6s} {lat('p99'):>6s} "
+              f"{cell('failures', 'd'):>6s}")
+
+
+def compare(results, baseline, tolerance):
+    """Passi più lenti della baseline oltre la tolleranza (es. 0.2 = +20%)."""
+    previous = {(r["size"], r["stage"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r["size"], r["stage"]))
+        if old and old["seconds"] > 0 and r["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append((r, old))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark offline di pulizia, chunking, sintesi e unione con un finto edge_tts locale.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="dimensioni dei libri sintetici (es. 10K,1M,50M)")
+    parser.add_argument("--mode", choices=("parts", "stream", "both"), default="both",
+                        help="sintesi in file separati + unione, in un unico stream, o entrambe")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="secondi prima del primo byte")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="frazione di richieste che falliscono")
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="attesa base tra i tentativi")
+    parser.add_argument("--audio-scale", type=float, default=0.02,
+                        help="frazione della durata reale dell'audio generato (1 = durata reale)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--baseline", help="risultati JSON precedenti da confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="rallentamento ammesso rispetto alla baseline")
+    args = parser.parse_args(argv)
+
+    options = {
+        "modes": ["parts", "stream"] if args.mode == "both" else [args.mode],
+        "concurrency": args.concurrency,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "failure_rate": args.failure_rate,
+        "retry_delay": args.retry_delay,
+        "audio_scale": args.audio_scale,
+        "seed": args.seed,
+    }
+    results = []
+    for size in (parse_size(s) for s in args.sizes.split(",")):
+        # un processo per dimensione: il picco RSS di un libro non nasconde quello del successivo
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.extend(pool.submit(run_size, size, options).result())
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": options, "results": results}, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for r, old in regressions:
+            print(f"REGRESSIONE {format_size(r['size'])} {r['stage']}: "
+                  f"{old['seconds']:.2f}s -> {r['seconds']:.2f}s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
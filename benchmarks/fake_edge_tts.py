@@ -0,0 +1,106 @@
+import asyncio
+import random
+import re
+import sys
+import types
+
+# formato predefinito di edge_tts: MPEG-2 Layer III, 24 kHz, mono, 48 kbps
+FRAME_HEADER = bytes([0xFF, 0xF3, 0x64, 0xC4])
+FRAME_LENGTH = 144
+FRAME_SECONDS = 576 / 24000
+FRAME = FRAME_HEADER + bytes(FRAME_LENGTH - len(FRAME_HEADER))
+# dimensione dei messaggi audio inviati dal finto servizio
+MESSAGE_SIZE = 4096
+
+VOICES = [
+    {"Name": "Microsoft Server Speech Text to Speech Voice (it-IT, GiuseppeMultilingualNeural)",
+     "ShortName": "it-IT-GiuseppeMultilingualNeural", "Gender": "Male", "Locale": "it-IT"},
+    {"Name": "Microsoft Server Speech Text to Speech Voice (it-IT, ElsaNeural)",
+     "ShortName": "it-IT-ElsaNeural", "Gender": "Female", "Locale": "it-IT"},
+    {"Name": "Microsoft Server Speech Text to Speech Voice (en-US, AriaNeural)",
+     "ShortName": "en-US-AriaNeural", "Gender": "Female", "Locale": "en-US"},
+]
+
+_RATE_RE = re.compile(r'^([+-]\d+)%$')
+
+
+class FakeServiceError(Exception):
+    pass
+
+
+class FakeService:
+    """Finto servizio edge_tts locale per i benchmark: nessuna rete, audio MP3 valido ma muto.
+
+    Ogni richiesta attende latency ± jitter secondi prima del primo byte e fallisce con
+    probabilità failure_rate (metà delle volte a metà dello stream). La durata dell'audio è
+    quella di una lettura a chars_per_second caratteri al secondo, ridotta di audio_scale
+    per non riempire il disco con i libri più grandi.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, failure_rate=0.0, chars_per_second=15.0,
+                 audio_scale=0.02, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.chars_per_second = chars_per_second
+        self.audio_scale = audio_scale
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+
+    def communicate(self, text, voice, rate="+0%", **kwargs):
+        """Stessa firma di edge_tts.Communicate."""
+        return FakeCommunicate(self, text, voice, rate)
+
+    async def list_voices(self):
+        await asyncio.sleep(self.latency)
+        return [dict(voice) for voice in VOICES]
+
+    def frame_count(self, text, rate="+0%"):
+        match = _RATE_RE.match(rate)
+        speed = 1 + int(match.group(1)) / 100 if match else 1.0
+        seconds = len(text) / self.chars_per_second / max(speed, 0.01) * self.audio_scale
+        return max(1, round(seconds / FRAME_SECONDS))
+
+    def delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+
+class FakeCommunicate:
+    def __init__(self, service, text, voice, rate="+0%"):
+        self.service = service
+        self.text = text
+        self.voice = voice
+        self.rate = rate
+
+    async def stream(self):
+        service = self.service
+        service.requests += 1
+        fail = service.rng.random() < service.failure_rate
+        fail_at = service.rng.choice((0, 0.5)) if fail else None
+        await asyncio.sleep(service.delay())
+        data = FRAME * service.frame_count(self.text, self.rate)
+        stop = int(len(data) * fail_at) // FRAME_LENGTH * FRAME_LENGTH if fail else len(data)
+        for pos in range(0, stop, MESSAGE_SIZE):
+            yield {"type": "audio", "data": data[pos:min(pos + MESSAGE_SIZE, stop)]}
+            await asyncio.sleep(0)
+        if fail:
+            service.failures += 1
+            raise FakeServiceError(f"Simulated failure for {len(self.text)} chars")
+        yield {"type": "WordBoundary", "offset": 0, "duration": 0, "text": self.text[:20]}
+
+    async def save(self, audio_fname):
+        with open(audio_fname, "wb") as f:
+            async for message in self.stream():
+                if message["type"] == "audio":
+                    f.write(message["data"])
+
+
+def install(service):
+    """Registra service come modulo edge_tts, per il codice che importa edge_tts direttamente."""
+    module = types.ModuleType("edge_tts")
+    module.Communicate = service.communicate
+    module.list_voices = service.list_voices
+    module.service = service
+    sys.modules["edge_tts"] = module
+    return module
@@ -0,0 +1,167 @@
+import bisect
+import itertools
+import mmap
+import os
+import re
+from array import array
+
+from text_processing import SPEECH_CHARS_PER_SECOND
+
+# fine frase: punteggiatura seguita da spazi (come il vecchio re.split(r'(?<=[.!?])\s+'))
+_SENTENCE_END_RE = re.compile(rb'[.!?]\s+')
+_WHITESPACE = b' \t\n\r\x0b\x0c'
+_UTF8_BOM = b'\xef\xbb\xbf'
+# byte di continuazione UTF-8 (10xxxxxx): togliendoli resta un byte per carattere
+_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+# finestra usata per contare i caratteri delle frasi molto lunghe senza copiarle intere
+CHAR_COUNT_WINDOW = 1024 * 1024
+# pausa stimata alla fine di ogni frase, in secondi a velocità 1.0
+SENTENCE_PAUSE = 0.4
+
+
+def _count_chars(data, start, end):
+    count = 0
+    for pos in range(start, end, CHAR_COUNT_WINDOW):
+        block = data[pos:min(pos + CHAR_COUNT_WINDOW, end)]
+        count += len(block.translate(None, _CONTINUATION_BYTES))
+    return count
+
+
+def _content_bounds(data):
+    start = len(_UTF8_BOM) if data[:len(_UTF8_BOM)] == _UTF8_BOM else 0
+    end = len(data)
+    while start < end and data[start] in _WHITESPACE:
+        start += 1
+    while end > start and data[end - 1] in _WHITESPACE:
+        end -= 1
+    return start, end
+
+
+def build_sentence_index(data):
+    """Indice delle frasi di un testo UTF-8 (bytes o mmap) in un solo passaggio.
+
+    Restituisce (offsets, chars): la frase i va da offsets[i] a offsets[i + 1] (spazi
+    finali compresi) e contiene chars[i] caratteri.
+    """
+    start, end = _content_bounds(data)
+    offsets = array('q', [start])
+    chars = array('q')
+    sentence_start = start
+    for match in _SENTENCE_END_RE.finditer(data, start, end):
+        next_start = match.end()
+        chars.append(_count_chars(data, sentence_start, next_start))
+        sentence_start = next_start
+        offsets.append(next_start)
+    chars.append(_count_chars(data, sentence_start, end))
+    offsets.append(end)
+    return offsets, chars
+
+
+def estimate_seconds(chars, chars_per_second=SPEECH_CHARS_PER_SECOND, speed=1.0):
+    """Secondi di audio stimati per ogni frase, per una voce che a velocità 1.0 legge
+    chars_per_second caratteri al secondo (più una pausa a fine frase)."""
+    speed = float(speed)
+    rate = chars_per_second * speed
+    pause = SENTENCE_PAUSE / speed
+    return array('d', (count / rate + pause for count in chars))
+
+
+def plan_parts(offsets, weights, num_parts):
+    """Intervalli di byte (inizio, fine) delle parti, con circa lo stesso peso (es. durata stimata).
+
+    I tagli cadono tra le frasi, dove il peso cumulato è più vicino a 1/num_parts,
+    2/num_parts... del totale; se le frasi sono meno di num_parts le parti sono meno.
+    """
+    count = len(weights)
+    cumulative = array('d', itertools.accumulate(weights))
+    total = cumulative[-1] if cumulative else 0
+    cuts = [0]
+    for k in range(1, num_parts):
+        target = total * k / num_parts
+        i = bisect.bisect_left(cumulative, target)
+        # taglio dopo la frase i o prima, quello più vicino al peso cercato
+        before = cumulative[i - 1] if i else 0
+        boundary = i + 1 if i < count and cumulative[i] - target < target - before else i
+        # almeno una frase per ognuna delle parti che restano
+        boundary = max(min(boundary, count - (num_parts - k)), cuts[-1] + 1)
+        if boundary >= count:
+            break
+        cuts.append(boundary)
+    cuts.append(count)
+    return [(offsets[a], offsets[b]) for a, b in zip(cuts, cuts[1:])]
+
+
+def _trimmed(data, start, end):
+    while end > start and data[end - 1] in _WHITESPACE:
+        end -= 1
+    return start, end
+
+
+def split_text_into_parts(text, num_parts, chars_per_second=SPEECH_CHARS_PER_SECOND, speed=1.0):
+    data = text.encode('utf-8')
+    offsets, chars = build_sentence_index(data)
+    parts = []
+    for start, end in plan_parts(offsets, estimate_seconds(chars, chars_per_second, speed), num_parts):
+        start, end = _trimmed(data, start, end)
+        parts.append(data[start:end].decode('utf-8'))
+    return parts
+
+
+class TextShard:
+    """Una parte scritta da split_file_into_shards, con la durata stimata del suo audio."""
+
+    def __init__(self, path, chars, seconds):
+        self.path = path
+        self.chars = chars
+        self.seconds = seconds
+
+
+def split_file_into_shards(file_path, num_parts, output_dir, base_name=None,
+                           chars_per_second=SPEECH_CHARS_PER_SECOND, speed=1.0):
+    """Divide un file di testo UTF-8 in parti di durata simile, senza caricarlo in memoria.
+
+    La durata di ogni frase è stimata con estimate_seconds per la voce (chars_per_second)
+    e la velocità scelte. Il file viene mappato con mmap e ogni parte è scritta
+    direttamente dalla mappa. Restituisce i TextShard dei file creati (base_name_partN.txt).
+    """
+    if base_name is None:
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            ranges, view = [(0, 0)], memoryview(b'')
+            offsets, chars, seconds = array('q', [0, 0]), array('q', [0]), array('d', [0.0])
+            mm = None
+        else:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            offsets, chars = build_sentence_index(mm)
+            seconds = estimate_seconds(chars, chars_per_second, speed)
+            ranges = plan_parts(offsets, seconds, num_parts)
+        try:
+            sentence = 0
+            for i, (start, end) in enumerate(ranges):
+                part_chars = 0
+                part_seconds = 0.0
+                while sentence < len(seconds) and offsets[sentence] < end:
+                    part_chars += chars[sentence]
+                    part_seconds += seconds[sentence]
+                    sentence += 1
+                start, end = _trimmed(view, start, end)
+                output_path = os.path.join(output_dir, f"{base_name}_part{i+1}.txt")
+                with open(output_path, 'wb') as out:
+                    out.write(view[start:end])
+                shards.append(TextShard(output_path, part_chars, part_seconds))
+        finally:
+            view.release()
+            if mm is not None:
+                mm.close()
+    return shards
+
+
+def split_file_into_parts(file_path, num_parts, output_dir, base_name=None,
+                          chars_per_second=SPEECH_CHARS_PER_SECOND, speed=1.0):
+    """Come split_file_into_shards, ma restituisce solo i percorsi dei file creati."""
+    return [shard.path for shard in split_file_into_shards(file_path, num_parts, output_dir, base_name,
+                                                           chars_per_second, speed)]
@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def default_cache_root():
+    root = os.environ.get("AUDIOLIBRI_CACHE_DIR")
+    if root:
+        return root
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "audiolibri")
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _looks_like_mp3(path):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(3)
+    except OSError:
+        return False
+    return head == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+
+
+class CacheDirectory:
+    """Cartella di cache con una voce per file, divisa in sottocartelle per i primi due
+    caratteri della chiave.
+
+    La recency LRU è la mtime dei file: ogni hit la aggiorna, prune() elimina i più vecchi.
+    Le sottoclassi indicano SUFFIX (estensione delle voci) e NAME (sottocartella della cache).
+    """
+
+    SUFFIX = ""
+    NAME = ""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.path.join(default_cache_root(), self.NAME)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}{self.SUFFIX}")
+
+    def reserve(self, key):
+        """Restituisce un file temporaneo accanto alla voce, in cui scriverla prima di registrarla."""
+        shard = os.path.dirname(self.path_for(key))
+        os.makedirs(shard, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=shard, prefix=f"{key}.", suffix=".tmp")
+        os.close(fd)
+        return tmp_path
+
+    def entries(self):
+        """Elenco di (key, size, mtime) dal meno al più recentemente usato."""
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                st = entry.stat()
+                result.append((entry.name[:-len(self.SUFFIX)], st.st_size, st.st_mtime))
+        result.sort(key=lambda e: e[2])
+        return result
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "oldest": entries[0][2] if entries else None,
+            "newest": entries[-1][2] if entries else None,
+        }
+
+    def prune(self, max_bytes=None, max_age=None):
+        """Elimina le voci più vecchie finché la cache non sta in max_bytes.
+
+        Con max_age (secondi) elimina anche le voci non usate da più di max_age.
+        Restituisce (voci eliminate, byte liberati).
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - max_age if max_age is not None else None
+        removed = 0
+        freed = 0
+        for key, size, mtime in entries:
+            if total <= max_bytes and (cutoff is None or mtime >= cutoff):
+                break
+            if self._remove(self.path_for(key)):
+                total -= size
+                freed += size
+                removed += 1
+        self._remove_stale_tmp()
+        return removed, freed
+
+    def clear(self):
+        return self.prune(max_bytes=0)
+
+    def _remove_stale_tmp(self, older_than=24 * 3600):
+        cutoff = time.time() - older_than
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp") and entry.stat().st_mtime < cutoff:
+                    self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+class ChunkCache(CacheDirectory):
+    """Cache su disco dei chunk sintetizzati, indirizzata per hash di (testo, voce, rate)."""
+
+    SUFFIX = ".mp3"
+    NAME = "chunks"
+
+    @staticmethod
+    def key(text, voice, rate):
+        h = hashlib.sha256()
+        for field in (voice, rate, text):
+            h.update(field.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key):
+        path = self.path_for(key)
+        if not os.path.isfile(path):
+            return None
+        if os.path.getsize(path) == 0 or not _looks_like_mp3(path):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def commit(self, key, tmp_path):
+        """Registra il chunk scritto nel file restituito da reserve()."""
+        if os.path.getsize(tmp_path) == 0 or not _looks_like_mp3(tmp_path):
+            self._remove(tmp_path)
+            raise ValueError(f"Invalid audio for chunk {key}")
+        path = self.path_for(key)
+        os.replace(tmp_path, path)
+        return path
+
+    def discard(self, tmp_path):
+        self._remove(tmp_path)
+
+    def materialize(self, key, output_path):
+        """Rende disponibile il chunk in output_path (hard link se possibile, altrimenti copia)."""
+        path = self.path_for(key)
+        if os.path.abspath(path) == os.path.abspath(output_path):
+            return output_path
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        try:
+            os.link(path, output_path)
+        except OSError:
+            shutil.copyfile(path, output_path)
+        return output_path
+
+
+def cache_main(cache_class, description, argv=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Riga di comando stats/prune/clear per una CacheDirectory."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--dir", help="cartella della cache (default: %(default)s)",
+                        default=os.path.join(default_cache_root(), cache_class.NAME))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="mostra dimensione e numero di voci")
+    prune = sub.add_parser("prune", help="elimina le voci meno usate di recente")
+    prune.add_argument("--max-mb", type=float, default=max_bytes / 1024 ** 2)
+    prune.add_argument("--max-days", type=float, default=None)
+    sub.add_parser("clear", help="svuota la cache")
+    args = parser.parse_args(argv)
+
+    cache = cache_class(args.dir)
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"Cartella: {stats['directory']}")
+        print(f"Voci: {stats['entries']}")
+        print(f"Dimensione: {stats['bytes'] / 1024 ** 2:.1f} MB")
+        if stats["oldest"]:
+            print(f"Uso meno recente: {time.ctime(stats['oldest'])}")
+            print(f"Uso più recente: {time.ctime(stats['newest'])}")
+    elif args.command == "prune":
+        max_age = args.max_days * 86400 if args.max_days is not None else None
+        removed, freed = cache.prune(int(args.max_mb * 1024 ** 2), max_age)
+        print(f"Eliminate {removed} voci, liberati {freed / 1024 ** 2:.1f} MB")
+    else:
+        removed, freed = cache.clear()
+        print(f"Eliminate {removed} voci, liberati {freed / 1024 ** 2:.1f} MB")
+
+
+def main(argv=None):
+    cache_main(ChunkCache, "Ispeziona e pulisce la cache dei chunk sintetizzati.", argv)
+
+
+if __name__ == "__main__":
+    main()
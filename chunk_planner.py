@@ -0,0 +1,214 @@
+import argparse
+import re
+
+# edge_tts spezza in più richieste i testi oltre 4096 byte (UTF-8, dopo l'escape XML):
+# un chunk entro questo limite è esattamente una richiesta al servizio
+DEFAULT_MAX_BYTES = 4096
+# un taglio non viene anticipato oltre questa frazione del limite per cercare un confine migliore
+DEFAULT_MIN_FILL = 0.6
+
+# confini in ordine di preferenza: paragrafo, frase, inciso, parola
+_BOUNDARY_PATTERNS = [
+    re.compile(r'\n\s*'),
+    re.compile(r'[.!?…]+[»"”’)\]]*\s+'),
+    re.compile(r'[,;:)\]»”—–]\s+|\s+[—–]\s+'),
+    re.compile(r'\s+'),
+]
+_ESCAPE_EXTRA = (('&', 4), ('<', 3), ('>', 3))
+
+
+def escaped_size(text):
+    """Byte del testo in UTF-8 dopo l'escape XML (&amp; &lt; &gt;) fatto da edge_tts."""
+    size = len(text.encode('utf-8'))
+    for char, extra in _ESCAPE_EXTRA:
+        size += text.count(char) * extra
+    return size
+
+
+def _fitting_length(text, start, max_bytes):
+    """Numero massimo di caratteri da start che stanno in max_bytes."""
+    low, high = 0, min(len(text) - start, max_bytes)
+    if escaped_size(text[start:start + high]) <= max_bytes:
+        return high
+    # ogni carattere occupa almeno un byte: la ricerca resta dentro max_bytes caratteri
+    while low < high:
+        mid = (low + high + 1) // 2
+        if escaped_size(text[start:start + mid]) <= max_bytes:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class ChunkPlan:
+    """Suddivisione di un testo in chunk, ognuno una richiesta al servizio TTS.
+
+    spans contiene gli intervalli (inizio, fine) nel testo, sizes i byte inviati per chunk.
+    """
+
+    def __init__(self, text, spans, sizes, max_bytes):
+        self.text = text
+        self.spans = spans
+        self.sizes = sizes
+        self.max_bytes = max_bytes
+
+    @property
+    def request_count(self):
+        return len(self.spans)
+
+    @property
+    def total_bytes(self):
+        return sum(self.sizes)
+
+    @property
+    def fill_ratio(self):
+        return self.total_bytes / (self.request_count * self.max_bytes) if self.spans else 0.0
+
+    def chunks(self):
+        return [self.text[start:end] for start, end in self.spans]
+
+    def __len__(self):
+        return len(self.spans)
+
+    def summary(self):
+        return _summary(self.request_count, self.total_bytes, self.fill_ratio,
+                        min(self.sizes, default=0), max(self.sizes, default=0))
+
+
+def _summary(count, total_bytes, fill_ratio, smallest, largest):
+    if not count:
+        return "0 richieste"
+    return (f"{count} richieste, {total_bytes / 1024:.0f} KB, "
+            f"riempimento medio {fill_ratio:.0%} (min {smallest} B, max {largest} B)")
+
+
+def plan_chunks(text, max_bytes=DEFAULT_MAX_BYTES, min_fill=DEFAULT_MIN_FILL):
+    """Divide il testo in chunk il più possibile pieni, entro max_bytes dopo l'escape.
+
+    Ogni chunk termina sul confine migliore disponibile nell'ultima parte della finestra
+    (da min_fill * max_bytes in poi): fine paragrafo, poi fine frase, poi inciso, poi parola.
+    """
+    spans = [(start, end) for start, end, _ in _spans(text, max_bytes, min_fill)]
+    sizes = [escaped_size(text[start:end]) for start, end in spans]
+    return ChunkPlan(text, spans, sizes, max_bytes)
+
+
+def _spans(text, max_bytes, min_fill, final=True):
+    """(inizio, fine, taglio) di ogni chunk. Con final falso si ferma prima del testo che
+    potrebbe ancora cambiare taglio quando arriva il pezzo successivo."""
+    start = 0
+    length = len(text)
+    while True:
+        while start < length and text[start].isspace():
+            start += 1
+        if start >= length or (not final and length - start <= max_bytes):
+            return
+        window = _fitting_length(text, start, max_bytes)
+        if window == 0:
+            # un solo carattere oltre il limite (max_bytes troppo piccolo): lo si invia da solo
+            window = 1
+        cut = start + window
+        if cut < length:
+            cut = _best_cut(text, start, cut, start + int(window * min_fill)) or cut
+        end = cut
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        yield start, end, cut
+        start = cut
+
+
+class ChunkStream:
+    """Come plan_chunks, ma su un testo che arriva a pezzi (pagine, capitoli, blocchi).
+
+    Ogni chunk esce appena il testo letto basta a deciderne il taglio, quindi in memoria
+    restano solo l'ultimo pezzo e il testo non ancora diviso. I chunk sono gli stessi che
+    plan_chunks darebbe sul testo intero; i totali sono completi quando finished è vero.
+    """
+
+    def __init__(self, pieces, max_bytes=DEFAULT_MAX_BYTES, min_fill=DEFAULT_MIN_FILL):
+        self.pieces = pieces
+        self.max_bytes = max_bytes
+        self.min_fill = min_fill
+        self.chars = 0
+        self.request_count = 0
+        self.total_bytes = 0
+        self.smallest = 0
+        self.largest = 0
+        self.finished = False
+        # errore della lettura dei pezzi (es. PDF danneggiato), se c'è stato
+        self.error = None
+
+    @property
+    def fill_ratio(self):
+        return self.total_bytes / (self.request_count * self.max_bytes) if self.request_count else 0.0
+
+    def __iter__(self):
+        try:
+            yield from self._chunks()
+        except Exception as e:
+            self.error = e
+            raise
+
+    def _chunks(self):
+        buffer = ""
+        for piece in self.pieces:
+            if not piece:
+                continue
+            buffer += piece
+            self.chars += len(piece)
+            if len(buffer) > self.max_bytes:
+                buffer = buffer[(yield from self._emit(buffer, False)):]
+        yield from self._emit(buffer, True)
+        self.finished = True
+
+    def _emit(self, text, final):
+        rest = 0
+        for start, end, cut in _spans(text, self.max_bytes, self.min_fill, final):
+            chunk = text[start:end]
+            size = escaped_size(chunk)
+            self.request_count += 1
+            self.total_bytes += size
+            self.smallest = min(self.smallest, size) if self.request_count > 1 else size
+            self.largest = max(self.largest, size)
+            yield chunk
+            rest = cut
+        return rest
+
+    def close(self):
+        """Chiude la sorgente dei pezzi (es. i processi di estrazione) se non è stata letta tutta."""
+        close = getattr(self.pieces, "close", None)
+        if close is not None:
+            close()
+
+    def summary(self):
+        return _summary(self.request_count, self.total_bytes, self.fill_ratio, self.smallest, self.largest)
+
+
+def _best_cut(text, start, end, earliest):
+    for pattern in _BOUNDARY_PATTERNS:
+        cut = None
+        for match in pattern.finditer(text, max(start, earliest - 1), end):
+            cut = match.end()
+        if cut is not None and cut > start:
+            return cut
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mostra come un testo verrà diviso in richieste TTS.")
+    parser.add_argument("files", nargs="+", help="file di testo UTF-8")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--chunks", action="store_true", help="elenca anche i singoli chunk")
+    args = parser.parse_args(argv)
+
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = plan_chunks(f.read(), args.max_bytes)
+        print(f"{path}: {plan.summary()}")
+        if args.chunks:
+            for i, ((start, end), size) in enumerate(zip(plan.spans, plan.sizes)):
+                print(f"  {i + 1:5d}  caratteri {start}-{end}  {size} B")
+
+
+if __name__ == "__main__":
+    main()
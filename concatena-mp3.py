@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
+from mp3_tools import concatenate
 
 def select_mp3_files():
     files = filedialog.askopenfilenames(
@@ -34,11 +35,16 @@ def concatenate_mp3_files():
         messagebox.showwarning("Attenzione", "Specifica un percorso di output.")
         return
 
+    def on_progress(i, total):
+        status_label.config(text=f"Unione {i+1}/{total}...")
+        root.update_idletasks()
+
+    chapters = None
+    if chapters_var.get():
+        chapters = [os.path.splitext(os.path.basename(f))[0] for f in files]
+
     try:
-        with open(output_path, "wb") as outfile:
-            for mp3_file in files:
-                with open(mp3_file, "rb") as infile:
-                    outfile.write(infile.read())
+        concatenate(files, output_path, progress=on_progress, chapters=chapters, index=True)
         messagebox.showinfo("Successo", f"File creato con successo:\n{output_path}")
         status_label.config(text="Unione completata.")
     except Exception as e:
@@ -48,7 +54,7 @@ def concatenate_mp3_files():
 # Interfaccia grafica
 root = tk.Tk()
 root.title("Unisci MP3 (senza ffmpeg)")
-root.geometry("600x400")
+root.geometry("600x440")
 
 tk.Button(root, text="Seleziona MP3", command=select_mp3_files).pack(pady=5)
 
@@ -60,6 +66,9 @@ output_entry = tk.Entry(root, width=60)
 output_entry.pack(pady=5)
 tk.Button(root, text="Scegli percorso", command=choose_output_file).pack(pady=5)
 
+chapters_var = tk.BooleanVar(value=True)
+tk.Checkbutton(root, text="Un capitolo per ogni file (ID3 CHAP)", variable=chapters_var).pack(pady=5)
+
 tk.Button(root, text="Unisci MP3", command=concatenate_mp3_files, bg="#4CAF50", fg="white").pack(pady=10)
 
 status_label = tk.Label(root, text="")
@@ -0,0 +1,128 @@
+import os
+import posixpath
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from lxml import etree
+
+CONTAINER_PATH = "META-INF/container.xml"
+DOCX_DOCUMENT_PATH = "word/document.xml"
+HTML_MEDIA_TYPES = ("application/xhtml+xml", "text/html")
+# documenti letti in anticipo rispetto a quello in attesa di essere restituito
+PREFETCH_PER_WORKER = 2
+
+_CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+_OPF_NS = "{http://www.idpf.org/2007/opf}"
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_TEXT_TAGS = {f"{_W_NS}t": None, f"{_W_NS}tab": "\t", f"{_W_NS}br": "\n", f"{_W_NS}cr": "\n"}
+
+
+def epub_spine(archive):
+    """Percorsi nello zip dei documenti XHTML in ordine di lettura (spine dell'OPF)."""
+    try:
+        container = etree.fromstring(archive.read(CONTAINER_PATH))
+        rootfile = container.find(f".//{_CONTAINER_NS}rootfile")
+        opf_path = rootfile.get("full-path")
+        opf = etree.fromstring(archive.read(opf_path))
+    except (KeyError, AttributeError, etree.XMLSyntaxError):
+        # OPF mancante o illeggibile: tutti gli (X)HTML in ordine di nome
+        return sorted(name for name in archive.namelist()
+                      if name.lower().endswith((".xhtml", ".html", ".htm")))
+
+    base = posixpath.dirname(opf_path)
+    manifest = {}
+    for item in opf.iter(f"{_OPF_NS}item"):
+        if item.get("media-type") in HTML_MEDIA_TYPES:
+            manifest[item.get("id")] = posixpath.normpath(posixpath.join(base, unquote(item.get("href", ""))))
+    paths = []
+    for itemref in opf.iter(f"{_OPF_NS}itemref"):
+        path = manifest.get(itemref.get("idref"))
+        if path and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def html_to_text(content):
+    """Testo del body di un documento (X)HTML con spazi normalizzati."""
+    try:
+        root = etree.fromstring(content, etree.HTMLParser(recover=True))
+    except (etree.LxmlError, ValueError):
+        root = None
+    if root is None:
+        # documento che lxml non riesce a leggere: si ripiega sul parser di BeautifulSoup
+        from bs4 import BeautifulSoup
+        text = BeautifulSoup(content, "html.parser").get_text(separator=" ")
+        return " ".join(text.split())
+    etree.strip_elements(root, "script", "style", with_tail=False)
+    body = root.find("body")
+    return " ".join(" ".join((body if body is not None else root).itertext()).split())
+
+
+def _ordered_map(func, items, workers):
+    """Come executor.map, ma con un numero limitato di risultati in memoria."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= workers * PREFETCH_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_epub_texts(file_path, workers=None):
+    """Testi dei documenti dell'EPUB in ordine di spine, convertiti in parallelo.
+
+    lxml rilascia il GIL durante il parsing, quindi i thread lavorano davvero in parallelo.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    with zipfile.ZipFile(file_path) as archive:
+        def convert(path):
+            try:
+                return html_to_text(archive.read(path))
+            except KeyError:
+                return ""
+
+        for text in _ordered_map(convert, epub_spine(archive), workers):
+            if text:
+                yield text
+
+
+def extract_epub_text(file_path, workers=None, separator="\n\n"):
+    return separator.join(iter_epub_texts(file_path, workers))
+
+
+def iter_docx_paragraphs(file_path):
+    """Paragrafi del corpo di un DOCX letti in streaming da word/document.xml.
+
+    Come python-docx considera solo i paragrafi diretti del body (non quelli nelle
+    tabelle); gli elementi già letti vengono liberati man mano.
+    """
+    body_tag = f"{_W_NS}body"
+    paragraph_tag = f"{_W_NS}p"
+    run_tag = f"{_W_NS}r"
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open(DOCX_DOCUMENT_PATH) as f:
+            for _, elem in etree.iterparse(f, events=("end",), tag=(paragraph_tag, f"{_W_NS}tbl")):
+                parent = elem.getparent()
+                if parent is None or parent.tag != body_tag:
+                    continue
+                if elem.tag == paragraph_tag:
+                    parts = []
+                    # solo il contenuto dei run (anche dentro i link): i w:tab di w:pPr/w:tabs
+                    # sono le posizioni delle tabulazioni, non testo
+                    for run in elem.iter(run_tag):
+                        for node in run:
+                            if node.tag in _DOCX_TEXT_TAGS:
+                                parts.append(_DOCX_TEXT_TAGS[node.tag] or node.text or "")
+                    yield "".join(parts)
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+
+def extract_docx_text(file_path):
+    return "\n".join(p for p in iter_docx_paragraphs(file_path) if p.strip())
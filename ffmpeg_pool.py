@@ -0,0 +1,237 @@
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+
+from mp3_tools import probe_mp3
+
+# file di configurazione condiviso da mp3-bitrates-converter.py e audiobook-v9-light.py
+FFMPEG_CONFIG_FILE = "config.txt"
+ENCODER_QUEUE_SIZE = 64
+
+# su Windows evita di aprire una console per ogni processo ffmpeg
+_CREATION_FLAGS = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+
+def read_ffmpeg_config(config_file=FFMPEG_CONFIG_FILE):
+    if os.path.exists(config_file):
+        with open(config_file, "r") as f:
+            path = f.read().strip()
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def write_ffmpeg_config(path, config_file=FFMPEG_CONFIG_FILE):
+    with open(config_file, "w") as f:
+        f.write(path)
+
+
+def build_ffmpeg_command(ffmpeg_path, input_path, output_path, bitrate, progress=False, input_format=None,
+                         quiet=False):
+    command = [ffmpeg_path, "-y"]
+    if progress or quiet:
+        command += ["-nostats", "-loglevel", "error"]
+    if progress:
+        command += ["-progress", "pipe:1"]
+    if input_format:
+        command += ["-f", input_format]
+    command += ["-i", input_path, "-b:a", f"{bitrate}k", output_path]
+    return command
+
+
+class FFmpegJob:
+    def __init__(self, input_path, output_path, bitrate):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.bitrate = bitrate
+        self.duration = None
+        self.progress = 0.0
+        self.error = None
+        self.done = False
+        # secondi di lavoro di ffmpeg, per confrontarli con la durata dell'audio
+        self.elapsed = None
+
+
+class FFmpegPool:
+    """Esegue i job ffmpeg su un numero limitato di processi in parallelo.
+
+    on_progress(job) e on_done(job) vengono chiamati dai thread worker:
+    chi aggiorna una GUI deve riportarli sul thread di Tk.
+    """
+
+    def __init__(self, ffmpeg_path, workers=None, on_progress=None, on_done=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            for process in self._running:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
+
+    def run(self, jobs):
+        """Esegue tutti i job e restituisce quelli falliti; un errore non ferma gli altri."""
+        jobs = list(jobs)
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+        threads = [threading.Thread(target=self._worker, args=(pending,), daemon=True)
+                   for _ in range(min(self.workers, len(jobs)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self._cancelled.is_set():
+            for job in jobs:
+                if not job.done and job.error is None:
+                    job.error = "annullato"
+        return [job for job in jobs if job.error is not None]
+
+    def _worker(self, pending):
+        while not self._cancelled.is_set():
+            try:
+                job = pending.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                self._run_job(job)
+            except Exception as e:
+                job.error = str(e)
+            job.elapsed = time.perf_counter() - start
+            if self.on_done:
+                self.on_done(job)
+
+    def _run_job(self, job):
+        if job.duration is None:
+            try:
+                job.duration = probe_mp3(job.input_path).seconds
+            except (OSError, ValueError):
+                job.duration = None
+        command = build_ffmpeg_command(self.ffmpeg_path, job.input_path, job.output_path,
+                                       job.bitrate, progress=True)
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=stderr, creationflags=_CREATION_FLAGS,
+                                       universal_newlines=True)
+            with self._lock:
+                self._running.add(process)
+            try:
+                if self._cancelled.is_set():
+                    process.terminate()
+                for line in process.stdout:
+                    self._parse_progress(job, line.strip())
+                returncode = process.wait()
+            finally:
+                with self._lock:
+                    self._running.discard(process)
+            if self._cancelled.is_set():
+                job.error = "annullato"
+                return
+            if returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode("utf-8", errors="replace").strip()
+                job.error = message.splitlines()[-1] if message else f"ffmpeg exit code {returncode}"
+                return
+        job.progress = 1.0
+        job.done = True
+
+    def _parse_progress(self, job, line):
+        key, _, value = line.partition("=")
+        if key in ("out_time_us", "out_time_ms") and job.duration:
+            try:
+                job.progress = min(1.0, int(value) / 1e6 / job.duration)
+            except ValueError:
+                return
+        elif key == "progress" and value == "end":
+            job.progress = 1.0
+        else:
+            return
+        if self.on_progress:
+            self.on_progress(job)
+
+
+class FFmpegEncoder:
+    """Processo ffmpeg che ricodifica in output_path l'MP3 scritto sul suo stdin.
+
+    write() accoda i dati a un thread che li passa a ffmpeg, così chi produce l'audio
+    (l'event loop della sintesi) non si blocca sulla pipe finché la coda non è piena.
+    """
+
+    def __init__(self, ffmpeg_path, output_path, bitrate):
+        self.output_path = output_path
+        command = build_ffmpeg_command(ffmpeg_path, "pipe:0", output_path, bitrate,
+                                       input_format="mp3", quiet=True)
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=self._stderr, creationflags=_CREATION_FLAGS)
+        self._queue = queue.Queue(maxsize=ENCODER_QUEUE_SIZE)
+        self._error = None
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def _feed(self):
+        stdin = self._process.stdin
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                stdin.write(data)
+            except OSError as e:
+                self._error = e
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+    def close(self):
+        if self._process is None:
+            return
+        self._queue.put(None)
+        self._feeder.join()
+        returncode = self._process.wait()
+        self._process = None
+        self._stderr.seek(0)
+        message = self._stderr.read().decode("utf-8", errors="replace").strip()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(message.splitlines()[-1] if message else f"ffmpeg exit code {returncode}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except RuntimeError:
+                pass
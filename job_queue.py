@@ -0,0 +1,525 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from chunk_cache import ChunkCache, default_cache_root
+from chunk_planner import plan_chunks
+from ffmpeg_pool import FFmpegJob, FFmpegPool
+from metrics import RunMetrics
+from mp3_tools import concatenate, load_frame_index
+from text_cache import TextCache
+from text_processing import iter_book_text
+from tts_engine import SynthesisEngine
+
+DEFAULT_BUDGET = 8
+DEFAULT_WORKERS = 2
+# chi non rinnova il lease entro questo tempo è considerato morto: il suo lavoro torna in coda
+LEASE_SECONDS = 120
+HEARTBEAT_SECONDS = 30
+POLL_SECONDS = 2.0
+# un chunk che ha fatto morire (o scadere) il suo processo più di tante volte non si ritenta
+MAX_CLAIMS = 3
+
+# stati di un libro: queued -> planning -> ready -> merging -> done (oppure failed, cancelled)
+# stati di un chunk: pending -> running -> done (oppure failed)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    voice TEXT NOT NULL,
+    speed TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    bitrate INTEGER NOT NULL DEFAULT 0,
+    ffmpeg_path TEXT,
+    delete_parts INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    final_path TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    claims INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (book_id, idx)
+);
+CREATE INDEX IF NOT EXISTS chunks_state ON chunks (state, book_id);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def default_queue_path():
+    return os.path.join(default_cache_root(), "jobs.sqlite")
+
+
+def _budget(db):
+    row = db.execute("SELECT value FROM settings WHERE key = 'budget'").fetchone()
+    return int(row[0]) if row else DEFAULT_BUDGET
+
+
+def read_book_text(file_path, cache=None):
+    return "".join(iter_book_text(file_path, cache=cache))
+
+
+class JobQueue:
+    """Coda persistente (SQLite) dei libri da sintetizzare e dei loro chunk.
+
+    La usano insieme più processi: un chunk o un libro preso in carico ha un proprietario e
+    una scadenza (lease) che il proprietario rinnova con heartbeat(); se il processo muore,
+    alla scadenza il lavoro torna disponibile. Il budget limita i chunk in sintesi in tutti i
+    processi insieme e viene diviso tra i libri: prima la priorità più alta, a parità di
+    priorità il libro con meno chunk in sintesi.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_queue_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    @property
+    def budget(self):
+        with self._lock:
+            return _budget(self._db)
+
+    @budget.setter
+    def budget(self, value):
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('budget', ?)", (str(int(value)),))
+
+    def add(self, source_path, output_dir, voice, speed, priority=0, bitrate=0, ffmpeg_path=None,
+            delete_parts=False):
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO books (source_path, output_dir, voice, speed, priority, bitrate, ffmpeg_path, "
+                "delete_parts, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(source_path), os.path.abspath(output_dir), voice, str(speed), priority,
+                 bitrate or 0, ffmpeg_path, int(bool(delete_parts)), now, now))
+            return cursor.lastrowid
+
+    def books(self):
+        """Libri con il numero di chunk per stato, in ordine di esecuzione."""
+        return self._query(
+            "SELECT b.*, "
+            "COALESCE(SUM(c.state = 'done'), 0) AS done, "
+            "COALESCE(SUM(c.state = 'running'), 0) AS running, "
+            "COALESCE(SUM(c.state = 'failed'), 0) AS failed "
+            "FROM books b LEFT JOIN chunks c ON c.book_id = b.id "
+            "GROUP BY b.id ORDER BY b.state IN ('done', 'cancelled'), b.priority DESC, b.id")
+
+    def set_priority(self, book_id, priority):
+        with self._transaction() as db:
+            db.execute("UPDATE books SET priority = ?, updated = ? WHERE id = ?", (priority, time.time(), book_id))
+
+    def cancel(self, book_id):
+        # i chunk già in sintesi finiscono, ma non ne partono altri
+        with self._transaction() as db:
+            db.execute("UPDATE books SET state = 'cancelled', updated = ? WHERE id = ? AND state != 'done'",
+                       (time.time(), book_id))
+
+    def retry(self, book_id):
+        """Rimette in coda i chunk falliti (e il libro, se era fallito o annullato)."""
+        with self._transaction() as db:
+            db.execute("UPDATE chunks SET state = 'pending', worker = NULL, claims = 0, error = NULL "
+                       "WHERE book_id = ? AND state = 'failed'", (book_id,))
+            db.execute("UPDATE books SET state = CASE WHEN chunks > 0 THEN 'ready' ELSE 'queued' END, "
+                       "worker = NULL, error = NULL, updated = ? "
+                       "WHERE id = ? AND state IN ('failed', 'cancelled')", (time.time(), book_id))
+
+    def has_work(self):
+        rows = self._query("SELECT 1 FROM books WHERE state IN ('queued', 'planning', 'ready', 'merging') LIMIT 1")
+        return bool(rows)
+
+    def active_workers(self):
+        rows = self._query("SELECT COUNT(*) AS n FROM workers WHERE seen > ?", (time.time() - LEASE_SECONDS,))
+        return rows[0]["n"]
+
+    def heartbeat(self, worker):
+        """Segnala che worker è vivo e rinnova il lease di tutto ciò che ha in carico."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("INSERT INTO workers (id, started, seen) VALUES (?, ?, ?) "
+                       "ON CONFLICT(id) DO UPDATE SET seen = excluded.seen", (worker, now, now))
+            db.execute("UPDATE chunks SET lease_until = ? WHERE worker = ? AND state = 'running'",
+                       (now + LEASE_SECONDS, worker))
+            db.execute("UPDATE books SET lease_until = ? WHERE worker = ? AND state IN ('planning', 'merging')",
+                       (now + LEASE_SECONDS, worker))
+
+    def release(self, worker):
+        """Restituisce alla coda il lavoro di worker (chiusura ordinata del processo)."""
+        with self._transaction() as db:
+            db.execute("UPDATE chunks SET state = 'pending', worker = NULL, claims = MAX(claims - 1, 0) "
+                       "WHERE worker = ? AND state = 'running'", (worker,))
+            db.execute("UPDATE books SET state = CASE state WHEN 'planning' THEN 'queued' ELSE 'ready' END, "
+                       "worker = NULL WHERE worker = ? AND state IN ('planning', 'merging')", (worker,))
+            db.execute("DELETE FROM workers WHERE id = ?", (worker,))
+
+    def _expire(self, db, now):
+        db.execute("UPDATE chunks SET state = CASE WHEN claims >= ? THEN 'failed' ELSE 'pending' END, "
+                   "error = CASE WHEN claims >= ? THEN 'worker lease expired' ELSE error END, worker = NULL "
+                   "WHERE state = 'running' AND lease_until < ?", (MAX_CLAIMS, MAX_CLAIMS, now))
+        db.execute("UPDATE books SET state = CASE state WHEN 'planning' THEN 'queued' ELSE 'ready' END, "
+                   "worker = NULL WHERE state IN ('planning', 'merging') AND lease_until < ?", (now,))
+
+    def claim_chunk(self, worker):
+        """Prende in carico il prossimo chunk, o None se non ce ne sono o il budget è esaurito."""
+        now = time.time()
+        with self._transaction() as db:
+            self._expire(db, now)
+            running = db.execute("SELECT COUNT(*) FROM chunks WHERE state = 'running'").fetchone()[0]
+            if running >= _budget(db):
+                return None
+            book = db.execute(
+                "SELECT b.id, b.voice, b.speed FROM books b WHERE b.state = 'ready' AND EXISTS "
+                "(SELECT 1 FROM chunks c WHERE c.book_id = b.id AND c.state = 'pending') "
+                "ORDER BY b.priority DESC, "
+                "(SELECT COUNT(*) FROM chunks r WHERE r.book_id = b.id AND r.state = 'running'), b.id "
+                "LIMIT 1").fetchone()
+            if book is None:
+                return None
+            chunk = db.execute("SELECT idx, text, output_path FROM chunks WHERE book_id = ? AND state = 'pending' "
+                               "ORDER BY idx LIMIT 1", (book["id"],)).fetchone()
+            db.execute("UPDATE chunks SET state = 'running', worker = ?, lease_until = ?, claims = claims + 1 "
+                       "WHERE book_id = ? AND idx = ?", (worker, now + LEASE_SECONDS, book["id"], chunk["idx"]))
+            return {"book_id": book["id"], "idx": chunk["idx"], "text": chunk["text"],
+                    "output_path": chunk["output_path"], "voice": book["voice"], "speed": book["speed"]}
+
+    def finish_chunk(self, chunk, worker, error=None):
+        # se il lease è scaduto nel frattempo il chunk è di qualcun altro: l'esito si ignora
+        with self._transaction() as db:
+            db.execute("UPDATE chunks SET state = ?, worker = NULL, error = ? "
+                       "WHERE book_id = ? AND idx = ? AND worker = ? AND state = 'running'",
+                       ("failed" if error else "done", error, chunk["book_id"], chunk["idx"], worker))
+
+    def claim_book(self, worker):
+        """Prende in carico un libro da pianificare ("plan") o da unire ("merge").
+
+        Restituisce (azione, riga del libro) o None. I libri con tutti i chunk terminati
+        ma qualcuno fallito passano a failed.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            self._expire(db, now)
+            open_chunks = "(SELECT 1 FROM chunks c WHERE c.book_id = books.id AND c.state IN ('pending', 'running'))"
+            db.execute(f"UPDATE books SET state = 'failed', error = 'failed chunks', updated = ? "
+                       f"WHERE state = 'ready' AND NOT EXISTS {open_chunks} AND EXISTS "
+                       f"(SELECT 1 FROM chunks c WHERE c.book_id = books.id AND c.state = 'failed')", (now,))
+            book = db.execute(f"SELECT * FROM books WHERE state = 'ready' AND NOT EXISTS {open_chunks} "
+                              f"ORDER BY priority DESC, id LIMIT 1").fetchone()
+            action, state = "merge", "merging"
+            if book is None:
+                book = db.execute("SELECT * FROM books WHERE state = 'queued' ORDER BY priority DESC, id LIMIT 1").fetchone()
+                action, state = "plan", "planning"
+            if book is None:
+                return None
+            db.execute("UPDATE books SET state = ?, worker = ?, lease_until = ?, updated = ? WHERE id = ?",
+                       (state, worker, now + LEASE_SECONDS, now, book["id"]))
+            return action, book
+
+    def set_chunks(self, book_id, worker, chunks, output_paths):
+        with self._transaction() as db:
+            owner = db.execute("SELECT worker, state FROM books WHERE id = ?", (book_id,)).fetchone()
+            if owner is None or owner["worker"] != worker or owner["state"] != "planning":
+                return
+            db.execute("DELETE FROM chunks WHERE book_id = ?", (book_id,))
+            db.executemany("INSERT INTO chunks (book_id, idx, text, output_path) VALUES (?, ?, ?, ?)",
+                           [(book_id, i, text, path) for i, (text, path) in enumerate(zip(chunks, output_paths))])
+            db.execute("UPDATE books SET state = 'ready', chunks = ?, worker = NULL, updated = ? WHERE id = ?",
+                       (len(chunks), time.time(), book_id))
+
+    def finish_book(self, book_id, worker, final_path=None, error=None):
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE books SET state = ?, final_path = ?, error = ?, worker = NULL, updated = ? "
+                                "WHERE id = ? AND worker = ?",
+                                ("failed" if error else "done", final_path, error, time.time(), book_id, worker))
+            if cursor.rowcount and not error:
+                # il testo dei chunk serve solo fino alla fine del libro
+                db.execute("UPDATE chunks SET text = '' WHERE book_id = ?", (book_id,))
+
+    def chunk_paths(self, book_id):
+        return [row["output_path"] for row in
+                self._query("SELECT output_path FROM chunks WHERE book_id = ? ORDER BY idx", (book_id,))]
+
+
+class QueueWorker:
+    """Un processo di lavoro: pianifica i libri in coda, ne sintetizza i chunk e unisce i libri finiti.
+
+    I chunk vengono sintetizzati da `slots` task sullo stesso SynthesisEngine; pianificazione
+    e unione girano in un thread per non fermare le richieste in corso.
+    """
+
+    def __init__(self, queue_path=None, slots=DEFAULT_BUDGET, use_cache=True, exit_when_idle=False):
+        self.queue_path = queue_path
+        self.slots = slots
+        self.use_cache = use_cache
+        self.exit_when_idle = exit_when_idle
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.queue = None
+        self.engine = None
+        # testi già estratti da un'app o da un altro processo della coda
+        self.text_cache = TextCache() if use_cache else None
+        self.metrics = None
+        self._stopping = False
+
+    def run(self):
+        self.queue = JobQueue(self.queue_path)
+        self.engine = SynthesisEngine(self.slots, cache=ChunkCache() if self.use_cache else None)
+        self.metrics = RunMetrics("coda", {"worker": self.worker_id, "slots": self.slots,
+                                           "budget": self.queue.budget})
+        self.engine.metrics = self.metrics
+        try:
+            self.queue.heartbeat(self.worker_id)
+            self.engine.run(self._main())
+        finally:
+            self.queue.release(self.worker_id)
+            self.engine.close()
+            self.metrics.close(engine=self.engine.stats())
+            self.queue.close()
+
+    async def _main(self):
+        tasks = [asyncio.ensure_future(self._heartbeats()), asyncio.ensure_future(self._books())]
+        tasks += [asyncio.ensure_future(self._chunks()) for _ in range(self.slots)]
+        try:
+            await asyncio.gather(*tasks[1:])
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            await asyncio.to_thread(self.queue.heartbeat, self.worker_id)
+
+    async def _chunks(self):
+        while True:
+            chunk = await asyncio.to_thread(self.queue.claim_chunk, self.worker_id)
+            if chunk is None:
+                if self._stopping:
+                    return
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            error = None
+            try:
+                os.makedirs(os.path.dirname(chunk["output_path"]), exist_ok=True)
+                await self.engine.synthesize_chunk(chunk["text"], chunk["output_path"], chunk["voice"], chunk["speed"])
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            await asyncio.to_thread(self.queue.finish_chunk, chunk, self.worker_id, error)
+
+    async def _books(self):
+        while True:
+            claimed = await asyncio.to_thread(self.queue.claim_book, self.worker_id)
+            if claimed is None:
+                if self.exit_when_idle and not await asyncio.to_thread(self.queue.has_work):
+                    self._stopping = True
+                    return
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            action, book = claimed
+            work = self.plan_book if action == "plan" else self.merge_book
+            try:
+                await asyncio.to_thread(work, book)
+            except Exception as e:
+                await asyncio.to_thread(self.queue.finish_book, book["id"], self.worker_id, None,
+                                        str(e) or type(e).__name__)
+
+    def plan_book(self, book):
+        base_name = os.path.splitext(os.path.basename(book["source_path"]))[0]
+        with self.metrics.stage("estrazione", file=base_name) as stage:
+            text = read_book_text(book["source_path"], self.text_cache)
+            stage["chars"] = len(text)
+        with self.metrics.stage("chunking", file=base_name, chars=len(text)) as stage:
+            plan = plan_chunks(text)
+            chunks = plan.chunks()
+            stage.update(requests=plan.request_count, fill=round(plan.fill_ratio, 3))
+        if not chunks:
+            raise ValueError(f"No text in {book['source_path']}")
+        paths = [os.path.join(book["output_dir"], f"{base_name}_part{i}.mp3") for i in range(len(chunks))]
+        self.queue.set_chunks(book["id"], self.worker_id, chunks, paths)
+
+    def merge_book(self, book):
+        base_name = os.path.splitext(os.path.basename(book["source_path"]))[0]
+        part_paths = self.queue.chunk_paths(book["id"])
+        final_path = os.path.join(book["output_dir"], f"{base_name}.mp3")
+        merged_path = os.path.join(book["output_dir"], f"{base_name}_unito.mp3") if book["bitrate"] else final_path
+        with self.metrics.stage("unione", file=base_name, parts=len(part_paths)) as stage:
+            spans = concatenate(part_paths, merged_path, index=not book["bitrate"],
+                                chapters=[f"Parte {i+1}" for i in range(len(part_paths))])
+            stage["audio_seconds"] = round(sum(span.seconds for span in spans), 2)
+        if book["bitrate"]:
+            with self.metrics.stage("compressione", file=base_name, bitrate=book["bitrate"]):
+                job = FFmpegJob(merged_path, final_path, book["bitrate"])
+                failed = FFmpegPool(book["ffmpeg_path"], 1).run([job])
+                if failed:
+                    raise RuntimeError(failed[0].error)
+            os.remove(merged_path)
+            load_frame_index(final_path)
+        if book["delete_parts"]:
+            for path in part_paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.queue.finish_book(book["id"], self.worker_id, final_path)
+
+
+def run_worker(queue_path=None, slots=DEFAULT_BUDGET, use_cache=True, exit_when_idle=False):
+    worker = QueueWorker(queue_path, slots, use_cache, exit_when_idle)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def launch_workers(workers=DEFAULT_WORKERS, budget=None, queue_path=None, use_cache=True):
+    """Avvia `job_queue.py work` staccato da chi lo lancia: continua anche se la finestra si chiude."""
+    command = [sys.executable, os.path.abspath(__file__)]
+    if queue_path:
+        command += ["--queue", queue_path]
+    command += ["work", "--workers", str(workers), "--exit-when-idle"]
+    if budget:
+        command += ["--budget", str(budget)]
+    if not use_cache:
+        command.append("--no-cache")
+    if os.name == "nt":
+        options = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP | getattr(subprocess, "DETACHED_PROCESS", 0)}
+    else:
+        options = {"start_new_session": True}
+    return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)), **options)
+
+
+def print_books(queue):
+    books = queue.books()
+    if not books:
+        print("Coda vuota")
+        return
+    print(f"{'id':>4s} {'prio':>4s} {'stato':10s} {'chunk':>11s} {'errori':>6s}  libro")
+    for b in books:
+        progress = f"{b['done']}/{b['chunks']}" if b["chunks"] else "-"
+        print(f"{b['id']:4d} {b['priority']:4d} {b['state']:10s} {progress:>11s} {b['failed']:6d}  "
+              f"{os.path.basename(b['source_path'])}" + (f"  ({b['error']})" if b["error"] else ""))
+    print(f"Budget: {queue.budget} richieste, processi attivi: {queue.active_workers()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coda persistente di audiolibri da sintetizzare.")
+    parser.add_argument("--queue", help="database della coda (default: jobs.sqlite nella cache)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="mette in coda uno o più libri")
+    add.add_argument("files", nargs="+")
+    add.add_argument("-o", "--output", required=True, help="cartella di output")
+    add.add_argument("--voice", default="it-IT-GiuseppeMultilingualNeural")
+    add.add_argument("--speed", default="1.0")
+    add.add_argument("--priority", type=int, default=0, help="i numeri più alti passano prima")
+    add.add_argument("--bitrate", type=int, default=0, help="comprimi con ffmpeg a questi kbps (0 = no)")
+    add.add_argument("--ffmpeg", help="percorso di ffmpeg (serve con --bitrate)")
+    add.add_argument("--delete-parts", action="store_true")
+
+    commands.add_parser("list", help="stato dei libri in coda")
+
+    work = commands.add_parser("work", help="avvia i processi di lavoro")
+    work.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    work.add_argument("--budget", type=int, help="richieste TTS in volo in totale, tra tutti i processi")
+    work.add_argument("--no-cache", action="store_true")
+    work.add_argument("--exit-when-idle", action="store_true", help="termina quando la coda è vuota")
+
+    for name, help_text in (("retry", "rimette in coda i chunk falliti"), ("cancel", "annulla un libro")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("book_id", type=int)
+    priority = commands.add_parser("priority", help="cambia la priorità di un libro")
+    priority.add_argument("book_id", type=int)
+    priority.add_argument("priority", type=int)
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.queue)
+    if args.command == "add":
+        if args.bitrate and not args.ffmpeg:
+            parser.error("--bitrate richiede --ffmpeg")
+        for path in args.files:
+            book_id = queue.add(path, args.output, args.voice, args.speed, args.priority, args.bitrate,
+                                args.ffmpeg, args.delete_parts)
+            print(f"{book_id}: {path}")
+    elif args.command == "list":
+        print_books(queue)
+    elif args.command == "retry":
+        queue.retry(args.book_id)
+    elif args.command == "cancel":
+        queue.cancel(args.book_id)
+    elif args.command == "priority":
+        queue.set_priority(args.book_id, args.priority)
+    elif args.command == "work":
+        if args.budget:
+            queue.budget = args.budget
+        budget = queue.budget
+        queue.close()
+        # ogni processo può arrivare all'intero budget: il limite globale lo impone la coda
+        processes = [multiprocessing.Process(target=run_worker, args=(args.queue, budget, not args.no_cache,
+                                                                      args.exit_when_idle))
+                     for _ in range(max(1, args.workers))]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
+        return
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from chunk_cache import default_cache_root
+
+
+def default_metrics_dir():
+    return os.environ.get("AUDIOLIBRI_METRICS_DIR") or os.path.join(default_cache_root(), "metrics")
+
+
+def _rates(fields, seconds):
+    """Aggiunge a fields le velocità derivate dai totali presenti."""
+    if seconds <= 0:
+        return fields
+    if fields.get("chars"):
+        fields["chars_per_s"] = round(fields["chars"] / seconds, 1)
+    if fields.get("bytes"):
+        fields["mb_per_s"] = round(fields["bytes"] / 1024 ** 2 / seconds, 3)
+    if fields.get("audio_seconds"):
+        # secondi di audio prodotti per ogni secondo di lavoro
+        fields["audio_per_wall"] = round(fields["audio_seconds"] / seconds, 2)
+    return fields
+
+
+class Throughput:
+    """Velocità e tempo residuo di un lavoro di cui si conosce il totale (chunk, caratteri, byte...).
+
+    total può restare None finché non è noto (es. libro ancora in lettura): intanto niente ETA.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.start = time.perf_counter()
+
+    def update(self, done):
+        self.done = done
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def fraction(self):
+        """Frazione completata (0-1), None se il totale non è noto."""
+        if not self.total:
+            return None
+        return min(1.0, self.done / self.total)
+
+    @property
+    def eta(self):
+        rate = self.rate
+        if self.total is None:
+            return None
+        if not rate or self.done >= self.total:
+            return 0.0 if self.done >= self.total else None
+        return (self.total - self.done) / rate
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class RunMetrics:
+    """Misure di un'esecuzione, scritte una per riga (JSON lines) in un file per run.
+
+    Ogni riga ha "event" (run_start, stage, tts_request, run_end), l'istante "t" e i secondi
+    "elapsed" dall'inizio. Si può usare da più thread.
+    """
+
+    def __init__(self, tool, settings=None, directory=None):
+        directory = directory or default_metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"{tool}-{stamp}-{os.getpid()}.jsonl")
+        self.tool = tool
+        self.start = time.perf_counter()
+        self.totals = {"requests": 0, "failed_requests": 0, "cached_chunks": 0, "chars": 0,
+                       "bytes": 0, "audio_seconds": 0.0}
+        self._latencies = []
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.event("run_start", tool=tool, settings=settings or {})
+
+    def event(self, kind, **fields):
+        record = {"event": kind, "t": round(time.time(), 3),
+                  "elapsed": round(time.perf_counter() - self.start, 3)}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Misura un passo; il blocco può aggiungere a fields chars, bytes, audio_seconds, ecc."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["error"] = str(e)
+            raise
+        finally:
+            self.record_stage(name, time.perf_counter() - start, **fields)
+
+    def record_stage(self, name, seconds, **fields):
+        """Come stage(), per passi misurati altrove (es. i job di FFmpegPool)."""
+        self.event("stage", stage=name, seconds=round(seconds, 3), **_rates(fields, seconds))
+
+    def request(self, chars, nbytes, latency, ok=True, attempt=1, cached=False, error=None):
+        """Una richiesta al servizio TTS (o un chunk preso dalla cache, con cached=True)."""
+        with self._lock:
+            if cached:
+                self.totals["cached_chunks"] += 1
+            else:
+                self.totals["requests"] += 1
+                if ok:
+                    self._latencies.append(latency)
+                else:
+                    self.totals["failed_requests"] += 1
+            if ok:
+                self.totals["chars"] += chars
+                self.totals["bytes"] += nbytes
+        fields = {"chars": chars, "bytes": nbytes, "latency": round(latency, 3), "ok": ok,
+                  "attempt": attempt, "cached": cached}
+        if error is not None:
+            fields["error"] = error
+        self.event("tts_request", **fields)
+
+    def add_audio(self, seconds):
+        with self._lock:
+            self.totals["audio_seconds"] += seconds
+
+    def latency_percentiles(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return {}
+        pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3)
+        return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99)}
+
+    def close(self, **fields):
+        seconds = time.perf_counter() - self.start
+        with self._lock:
+            totals = dict(self.totals)
+        totals["audio_seconds"] = round(totals["audio_seconds"], 2)
+        totals = _rates(totals, seconds)
+        totals["latency"] = self.latency_percentiles()
+        self.event("run_end", seconds=round(seconds, 3), totals=totals, **fields)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_run(path):
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    start = next((r for r in records if r["event"] == "run_start"), {})
+    end = next((r for r in records if r["event"] == "run_end"), {})
+    return start, end, records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Confronta le esecuzioni registrate (voce, chunk, parallelismo).")
+    parser.add_argument("files", nargs="*", help="file .jsonl (default: tutti quelli della cartella metriche)")
+    parser.add_argument("--dir", default=default_metrics_dir())
+    args = parser.parse_args(argv)
+
+    files = args.files or sorted(glob.glob(os.path.join(args.dir, "*.jsonl")))
+    if not files:
+        print("Nessuna esecuzione registrata")
+        return
+    print(f"{'esecuzione':42s} {'voce':34s} {'par.':>4s} {'byte':>5s} {'secondi':>8s} "
+          f"{'car/s':>8s} {'audio/s':>7s} {'errori':>6s} {'p50':>6s}")
+    for path in files:
+        start, end, _ = load_run(path)
+        settings = start.get("settings", {})
+        totals = end.get("totals", {})
+        requests = totals.get("requests", 0)
+        errors = totals.get("failed_requests", 0) / requests if requests else 0.0
+        print(f"{os.path.basename(path)[:42]:42s} {str(settings.get('voice', '-'))[:34]:34s} "
+              f"{str(settings.get('concurrency', '-')):>4s} {str(settings.get('max_bytes', '-')):>5s} "
+              f"{end.get('seconds', 0):8.1f} {totals.get('chars_per_s', 0):8.0f} "
+              f"{totals.get('audio_per_wall', 0):7.1f} {errors:6.0%} "
+              f"{totals.get('latency', {}).get('p50', 0):6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import subprocess
+import threading
 import os
-from pathlib import Path
-
-CONFIG_FILE = "config.txt"
+import time
+from ffmpeg_pool import FFmpegJob, FFmpegPool, read_ffmpeg_config, write_ffmpeg_config
+from metrics import RunMetrics, Throughput, format_eta
+from progress_bus import ProgressBus, ProgressPanel
+from transcode_planner import COPY, SKIP, TRANSCODE, TranscodeManifest, copy_planned, encode_speed, plan_transcodes
 
 class MP3CompressorApp:
     def __init__(self, root):
@@ -14,6 +16,10 @@ class MP3CompressorApp:
         self.file_paths = []
         self.ffmpeg_path = self.load_ffmpeg_path()
         self.output_path = ""
+        self.pool = None
+        # i thread di pianificazione e compressione aggiornano la GUI solo attraverso il bus
+        self.bus = ProgressBus(root)
+        self.bus.start()
 
         # GUI widgets
         self.select_button = tk.Button(root, text="Seleziona MP3", command=self.select_files)
@@ -28,27 +34,36 @@ class MP3CompressorApp:
         self.output_button = tk.Button(root, text="Seleziona cartella di output", command=self.select_output_folder)
         self.output_button.pack(pady=10)
 
+        self.workers_label = tk.Label(root, text="Processi ffmpeg in parallelo:")
+        self.workers_label.pack()
+        self.workers_var = tk.StringVar(value=str(os.cpu_count() or 1))
+        self.workers_entry = tk.Entry(root, textvariable=self.workers_var, width=5)
+        self.workers_entry.pack(pady=5)
+
         self.convert_button = tk.Button(root, text="Comprimi", command=self.compress_files)
-        self.convert_button.pack(pady=20)
+        self.convert_button.pack(pady=(20, 5))
+
+        self.cancel_button = tk.Button(root, text="Annulla", command=self.cancel_compression, state=tk.DISABLED)
+        self.cancel_button.pack(pady=5)
+
+        self.progress = ProgressPanel(root)
+        self.progress.pack(padx=10, pady=2)
+
+        self.status_label = tk.Label(root, text="")
+        self.status_label.pack(pady=5)
 
         self.change_ffmpeg_button = tk.Button(root, text="Cambia percorso ffmpeg.exe", command=self.select_ffmpeg_path)
         self.change_ffmpeg_button.pack(pady=5)
 
     def load_ffmpeg_path(self):
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as f:
-                path = f.read().strip()
-                if os.path.isfile(path):
-                    return path
-        return self.select_ffmpeg_path()
+        return read_ffmpeg_config() or self.select_ffmpeg_path()
 
     def select_ffmpeg_path(self):
         path = filedialog.askopenfilename(title="Seleziona ffmpeg.exe", filetypes=[("ffmpeg.exe", "ffmpeg.exe")])
         if not path:
             messagebox.showerror("Errore", "È necessario selezionare ffmpeg.exe per continuare.")
             self.root.quit()
-        with open(CONFIG_FILE, "w") as f:
-            f.write(path)
+        write_ffmpeg_config(path)
         return path
 
     def select_files(self):
@@ -78,25 +93,160 @@ class MP3CompressorApp:
             messagebox.showerror("Errore", "Inserisci un bitrate valido (>=32).")
             return
 
-        for file in self.file_paths:
-            filename = os.path.basename(file)
-            output_file = os.path.join(self.output_path, filename)
+        try:
+            workers = int(self.workers_var.get())
+            if workers < 1:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Errore", "Inserisci un numero valido di processi (>=1).")
+            return
 
-            command = [
-                self.ffmpeg_path,
-                "-y",
-                "-i", file,
-                "-b:a", f"{bitrate}k",
-                output_file
-            ]
+        self.convert_button.config(state=tk.DISABLED)
+        self.status_label.config(text="Analisi dei file...")
+        file_paths = list(self.file_paths)
+        output_path = self.output_path
 
+        def plan():
+            # solo lettura degli header e, se serve, hash degli input: nessun processo ffmpeg
+            start = time.perf_counter()
             try:
-                subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            except subprocess.CalledProcessError:
-                messagebox.showerror("Errore", f"Errore durante la conversione di {filename}")
+                manifest = TranscodeManifest(output_path)
+                plan = plan_transcodes(file_paths, output_path, bitrate, manifest)
+                speed = encode_speed()
+            except Exception as e:
+                self.bus.call(self.planning_failed, e)
+                return
+            self.bus.call(self.confirm_plan, plan, manifest, workers, speed, time.perf_counter() - start)
+
+        threading.Thread(target=plan, daemon=True).start()
+
+    def planning_failed(self, error):
+        self.convert_button.config(state=tk.NORMAL)
+        self.status_label.config(text="")
+        messagebox.showerror("Errore", f"Errore nell'analisi dei file: {error}")
+
+    def confirm_plan(self, plan, manifest, workers, speed, planning_seconds):
+        """Mostra il lavoro previsto (file, durata dell'audio, tempo stimato) prima di avviarlo."""
+        self.status_label.config(text="")
+        summary = plan.summary(workers, speed)
+        if not plan.by_action(TRANSCODE) and not plan.by_action(COPY):
+            self.convert_button.config(state=tk.NORMAL)
+            messagebox.showinfo("Niente da fare", f"Tutti i file sono già aggiornati.\n\n{summary}")
+            return
+        if not messagebox.askyesno("Piano di compressione", f"{summary}\n\nProcedere?"):
+            self.convert_button.config(state=tk.NORMAL)
+            return
+        self.start_plan(plan, manifest, workers, planning_seconds)
+
+    def start_plan(self, plan, manifest, workers, planning_seconds):
+        bitrate = plan.bitrate
+        copies = []
+        transcodes = []
+        for item in plan.items:
+            if item.action == SKIP:
                 continue
-
-        messagebox.showinfo("Completato", "Compressione completata con successo!")
+            job = FFmpegJob(item.input_path, item.output_path, bitrate)
+            # durata già letta dal planner: il pool non deve rileggere il file
+            job.duration = item.probe.seconds if item.probe else None
+            (copies if item.action == COPY else transcodes).append((item, job))
+        jobs = [job for _, job in copies + transcodes]
+        self.metrics = RunMetrics("compressore", {"bitrate": bitrate, "workers": workers, "files": len(plan.items)})
+        self.metrics.record_stage("pianificazione", planning_seconds, files=len(plan.items),
+                                  transcode=len(transcodes), copy=len(copies),
+                                  skip=len(plan.items) - len(jobs))
+        self.skipped = len(plan.items) - len(jobs)
+        # ETA sulla somma dei progressi dei singoli file
+        self.throughput = Throughput(len(jobs))
+
+        def on_done(job):
+            self.record_job(job)
+            if job.done:
+                try:
+                    manifest.record(job.input_path, job.output_path, bitrate, TRANSCODE)
+                except OSError:
+                    pass
+            self.bus.post("progress", self.show_progress, jobs)
+
+        self.pool = FFmpegPool(
+            self.ffmpeg_path, workers,
+            on_progress=lambda job: self.bus.post("progress", self.show_progress, jobs),
+            on_done=on_done,
+        )
+        self.cancel_button.config(state=tk.NORMAL)
+        self.show_progress(jobs)
+
+        def run():
+            failed = []
+            for item, job in copies:
+                if self.pool.cancelled:
+                    job.error = "annullato"
+                    failed.append(job)
+                    continue
+                start = time.perf_counter()
+                try:
+                    copy_planned(item, bitrate, manifest)
+                    job.progress = 1.0
+                    job.done = True
+                except OSError as e:
+                    job.error = str(e)
+                    failed.append(job)
+                job.elapsed = time.perf_counter() - start
+                self.record_job(job, "copia")
+                self.bus.post("progress", self.show_progress, jobs)
+            failed += self.pool.run([job for _, job in transcodes])
+            try:
+                manifest.save()
+            except OSError as e:
+                # i file sono comunque stati creati: alla prossima esecuzione verranno rifatti
+                self.bus.call(messagebox.showerror, "Errore", f"Errore nel salvataggio di {manifest.path}: {e}")
+            self.bus.call(self.compression_finished, jobs, failed)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def record_job(self, job, stage="compressione"):
+        fields = {"file": os.path.basename(job.input_path), "ok": job.done}
+        if job.error:
+            fields["error"] = job.error
+        if job.done:
+            fields["bytes"] = os.path.getsize(job.output_path)
+            if job.duration:
+                fields["audio_seconds"] = round(job.duration, 2)
+                self.metrics.add_audio(job.duration)
+        self.metrics.record_stage(stage, job.elapsed or 0.0, **fields)
+
+    def show_progress(self, jobs):
+        finished = sum(1 for job in jobs if job.done or job.error)
+        running = [job for job in jobs if not job.done and not job.error and job.progress > 0]
+        self.throughput.update(sum(1 if job.done or job.error else job.progress for job in jobs))
+        # secondi di audio elaborati per secondo, copie comprese
+        audio = sum((job.duration or 0.0) * (1 if job.done else job.progress) for job in jobs)
+        speed = audio / self.throughput.elapsed if self.throughput.elapsed > 0 else 0.0
+        text = f"Completati {finished}/{len(jobs)} - {speed:.0f}x il tempo reale - ETA {format_eta(self.throughput.eta)}"
+        if running:
+            text += "\n" + "\n".join(f"{os.path.basename(job.input_path)}: {job.progress:.0%}" for job in running[:5])
+        self.progress.show(self.throughput.fraction, text)
+
+    def cancel_compression(self):
+        if self.pool is not None:
+            self.pool.cancel()
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def compression_finished(self, jobs, failed):
+        self.convert_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.show_progress(jobs)
+        cancelled = self.pool.cancelled
+        self.pool = None
+        self.metrics.close(failed=len(failed), cancelled=cancelled, skipped=self.skipped)
+        if failed:
+            details = "\n".join(f"{os.path.basename(job.input_path)}: {job.error}" for job in failed[:20])
+            if len(failed) > 20:
+                details += f"\n... e altri {len(failed) - 20}"
+            title = "Annullato" if cancelled else "Errore"
+            messagebox.showerror(title, f"Conversione non riuscita per {len(failed)} file su {len(jobs)}:\n\n{details}")
+        else:
+            skipped = f" ({self.skipped} file già aggiornati)" if self.skipped else ""
+            messagebox.showinfo("Completato", f"Compressione completata con successo!{skipped}")
 
 if __name__ == "__main__":
     root = tk.Tk()
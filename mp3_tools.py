@@ -0,0 +1,962 @@
+import bisect
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from functools import lru_cache
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# ogni quanti frame FrameIndex salva offset e posizione assoluti
+INDEX_CHECKPOINT = 256
+INDEX_SUFFIX = ".idx"
+_INDEX_MAGIC = b"MP3IDX1\0"
+_INDEX_HEADER = struct.Struct("<8sqqIqqqqq")
+
+# (versione, layer) -> bitrate in kbps per indice; versione 3 = MPEG1, layer 1 = Layer III
+_BITRATES_V1 = {
+    3: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+}
+_BITRATES_V2 = {
+    3: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    1: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+# bit dell'header che non influenzano lunghezza e formato del frame
+_HEADER_KEY_MASK = 0xFFFFFFC0
+# versione, layer, frequenza e modo canale: ciò che deve coincidere tra frame compatibili
+_FORMAT_MASK = 0xFFFE0CC0
+
+
+class FrameHeader:
+    __slots__ = ("raw", "version", "layer", "bitrate", "sample_rate", "padding",
+                 "channel_mode", "length", "samples")
+
+    def __init__(self, raw, version, layer, bitrate, sample_rate, padding, channel_mode, length, samples):
+        self.raw = raw
+        self.version = version
+        self.layer = layer
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.padding = padding
+        self.channel_mode = channel_mode
+        self.length = length
+        self.samples = samples
+
+    @property
+    def mono(self):
+        return self.channel_mode == 3
+
+    @property
+    def side_info_size(self):
+        if self.layer != 1:
+            return 0
+        if self.version == 3:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+    @property
+    def duration(self):
+        return self.samples / self.sample_rate
+
+
+@lru_cache(maxsize=4096)
+def _parse_header_key(key):
+    if key >> 21 != 0x7FF:
+        return None
+    version = (key >> 19) & 3
+    layer = (key >> 17) & 3
+    bitrate_index = (key >> 12) & 15
+    rate_index = (key >> 10) & 3
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    table = _BITRATES_V1 if version == 3 else _BITRATES_V2
+    bitrate = table[layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (key >> 9) & 1
+    channel_mode = (key >> 6) & 3
+    if layer == 3:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 1152 if version == 3 else 576
+        length = (144 if version == 3 else 72) * bitrate // sample_rate + padding
+    return FrameHeader(key, version, layer, bitrate, sample_rate, padding, channel_mode, length, samples)
+
+
+def parse_frame_header(data, offset=0):
+    """FrameHeader per i 4 byte in data[offset:], o None se non è un header MPEG valido."""
+    if len(data) - offset < 4:
+        return None
+    return _parse_header_key(int.from_bytes(data[offset:offset + 4], "big") & _HEADER_KEY_MASK)
+
+
+def id3v2_size(data, offset=0):
+    """Lunghezza del tag ID3v2 che inizia in offset (0 se assente)."""
+    head = data[offset:offset + 10]
+    if len(head) < 10 or head[:3] != b"ID3" or head[3] == 0xFF or any(b & 0x80 for b in head[6:10]):
+        return 0
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+
+def _trailing_tags_start(mm, end):
+    """Toglie da end i tag in coda (ID3v1, APEv2, Lyrics3 non gestito)."""
+    while True:
+        if end >= 128 and mm[end - 128:end - 125] == b"TAG":
+            end -= 128
+            continue
+        if end >= 32 and mm[end - 32:end - 24] == b"APETAGEX":
+            size, flags = struct.unpack("<II", mm[end - 20:end - 12])
+            end -= size + (32 if flags & 0x80000000 else 0)
+            continue
+        return max(end, 0)
+
+
+def _find_sync(mm, pos, end):
+    """Primo offset >= pos con due header validi consecutivi, -1 se non c'è."""
+    while pos + 4 <= end:
+        pos = mm.find(b"\xff", pos, end)
+        if pos < 0 or pos + 4 > end:
+            return -1
+        header = parse_frame_header(mm, pos)
+        if header is not None:
+            nxt = pos + header.length
+            if nxt + 4 > end or nxt == end:
+                return pos
+            following = parse_frame_header(mm, nxt)
+            if following is not None and (following.raw & _FORMAT_MASK) == (header.raw & _FORMAT_MASK):
+                return pos
+        pos += 1
+    return -1
+
+
+def _info_tag_offset(header):
+    return 4 + header.side_info_size
+
+
+def _read_info_tag(mm, pos, header):
+    """Se il frame in pos è un frame Xing/Info/VBRI restituisce (tipo, lame_ext o None)."""
+    tag_pos = pos + _info_tag_offset(header)
+    tag = mm[tag_pos:tag_pos + 4]
+    if tag in (b"Xing", b"Info"):
+        flags = int.from_bytes(mm[tag_pos + 4:tag_pos + 8], "big")
+        ext = tag_pos + 8
+        ext += 4 if flags & 1 else 0
+        ext += 4 if flags & 2 else 0
+        ext += 100 if flags & 4 else 0
+        ext += 4 if flags & 8 else 0
+        lame = bytes(mm[ext:ext + 36])
+        if len(lame) == 36 and ext + 36 <= pos + header.length and lame[:4] in (b"LAME", b"Lavf", b"Lavc", b"GOGO"):
+            return tag, lame
+        return tag, None
+    if mm[pos + 36:pos + 40] == b"VBRI":
+        return b"VBRI", None
+    return None
+
+
+def _info_frame_count(mm, pos, header):
+    """Numero di frame dichiarato dal frame Xing/Info/VBRI in pos, None se manca."""
+    tag_pos = pos + _info_tag_offset(header)
+    if mm[tag_pos:tag_pos + 4] in (b"Xing", b"Info"):
+        if int.from_bytes(mm[tag_pos + 4:tag_pos + 8], "big") & 1:
+            return int.from_bytes(mm[tag_pos + 8:tag_pos + 12], "big")
+        return None
+    if mm[pos + 36:pos + 40] == b"VBRI":
+        return int.from_bytes(mm[pos + 50:pos + 54], "big")
+    return None
+
+
+class AudioSpan:
+    """Regione audio di un file MP3, senza tag e senza frame Xing/Info/VBRI."""
+
+    def __init__(self, path, start, end, frames, seconds, first_header, cbr, points,
+                 id3v2=(0, 0), lame=None, index=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.frames = frames
+        self.seconds = seconds
+        self.first_header = first_header
+        self.cbr = cbr
+        # coppie (secondi, offset relativo a start) per interpolare la posizione
+        self.points = points
+        self.id3v2 = id3v2
+        self.lame = lame
+        # FrameIndex della regione, solo se richiesto alla scansione
+        self.index = index
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+    @property
+    def delay(self):
+        if self.lame is None:
+            return 0
+        return (self.lame[21] << 4) | (self.lame[22] >> 4)
+
+    @property
+    def padding(self):
+        if self.lame is None:
+            return 0
+        return ((self.lame[22] & 0x0F) << 8) | self.lame[23]
+
+    def offset_at(self, seconds):
+        return _interpolate_offset(self.points, seconds)
+
+
+def _interpolate_offset(points, seconds):
+    i = bisect.bisect_right(points, (seconds, float("inf"))) - 1
+    if i < 0:
+        return 0
+    if i >= len(points) - 1:
+        return points[-1][1]
+    (t0, o0), (t1, o1) = points[i], points[i + 1]
+    if t1 <= t0:
+        return o0
+    return int(o0 + (o1 - o0) * (seconds - t0) / (t1 - t0))
+
+
+def _cbr_frames(mm, pos, end, header):
+    """Numero di frame se la regione è CBR a passo fisso (verifica a campione), altrimenti None."""
+    span = end - pos
+    if header.padding or span % header.length:
+        return None
+    frames = span // header.length
+    probes = {frames - 1}
+    probes.update(range(0, frames, max(1, frames // 64)))
+    for k in probes:
+        offset = pos + k * header.length
+        if int.from_bytes(mm[offset:offset + 4], "big") & _HEADER_KEY_MASK != header.raw:
+            return None
+    return frames
+
+
+def _walk_frames(mm, pos, end, header, index=None):
+    """Scorre i frame tra pos ed end; con index (un FrameIndex) ve li aggiunge nello stesso passaggio."""
+    frames = 0
+    seconds = 0.0
+    start = pos
+    every = max(1, (end - pos) // max(header.length, 1) // 200)
+    points = [(0.0, 0)]
+    bitrates = set()
+    last_end = pos
+    lengths = array("I")
+    samples = array("H")
+    rate = index.sample_rate if index is not None else None
+    while pos + 4 <= end:
+        h = _parse_header_key(int.from_bytes(mm[pos:pos + 4], "big") & _HEADER_KEY_MASK)
+        if h is None:
+            nxt = _find_sync(mm, pos + 1, end)
+            if nxt < 0:
+                break
+            if index is not None:
+                # byte spuri: restano nello stream, attribuiti al frame precedente
+                if lengths:
+                    lengths[-1] += nxt - pos
+                else:
+                    index.pad(nxt - pos)
+            pos = nxt
+            continue
+        if pos + h.length > end:
+            break
+        frames += 1
+        seconds += h.samples / h.sample_rate
+        bitrates.add(h.bitrate)
+        if index is not None:
+            lengths.append(h.length)
+            samples.append(h.samples if h.sample_rate == rate else round(h.samples * rate / h.sample_rate))
+        pos += h.length
+        last_end = pos
+        if frames % every == 0:
+            points.append((seconds, pos - start))
+    if points[-1][1] != last_end - start:
+        points.append((seconds, last_end - start))
+    if index is not None:
+        index.extend_frames(lengths, samples)
+    return frames, seconds, last_end, points, len(bitrates) <= 1
+
+
+class FrameIndex:
+    """Offset e istante di ogni frame di uno stream MP3, in forma compatta.
+
+    Per ogni frame si tengono solo lunghezza (4 byte) e campioni (2 byte); ogni
+    INDEX_CHECKPOINT frame anche offset e campioni dall'inizio, così la posizione di un
+    frame si ricava sommando al più INDEX_CHECKPOINT - 1 valori. Gli offset sono nel file
+    (start è il primo frame audio), i tempi in campioni a sample_rate.
+    """
+
+    def __init__(self, sample_rate, start=0):
+        self.sample_rate = sample_rate
+        self.start = start
+        self.size = 0
+        self.total_samples = 0
+        self.lengths = array("I")
+        self.samples = array("H")
+        self._offsets = array("q")
+        self._positions = array("q")
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def end(self):
+        return self.start + self.size
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate
+
+    def append(self, length, samples):
+        if len(self.lengths) % INDEX_CHECKPOINT == 0:
+            self._offsets.append(self.size)
+            self._positions.append(self.total_samples)
+        self.lengths.append(length)
+        self.samples.append(samples)
+        self.size += length
+        self.total_samples += samples
+
+    def extend(self, length, samples, count):
+        """Aggiunge count frame uguali (una regione CBR) senza scorrerli uno a uno."""
+        first = len(self.lengths)
+        for i in range(-(-first // INDEX_CHECKPOINT) * INDEX_CHECKPOINT, first + count, INDEX_CHECKPOINT):
+            self._offsets.append(self.size + (i - first) * length)
+            self._positions.append(self.total_samples + (i - first) * samples)
+        self.lengths.extend(array("I", [length]) * count)
+        self.samples.extend(array("H", [samples]) * count)
+        self.size += length * count
+        self.total_samples += samples * count
+
+    def extend_frames(self, lengths, samples):
+        """Aggiunge i frame con le lunghezze e i campioni dati (array "I" e "H")."""
+        first = len(self.lengths)
+        done = 0
+        size, total = self.size, self.total_samples
+        for i in range(-(-first // INDEX_CHECKPOINT) * INDEX_CHECKPOINT - first, len(lengths), INDEX_CHECKPOINT):
+            size += sum(lengths[done:i])
+            total += sum(samples[done:i])
+            done = i
+            self._offsets.append(size)
+            self._positions.append(total)
+        self.lengths.extend(lengths)
+        self.samples.extend(samples)
+        self.size += sum(lengths)
+        self.total_samples += sum(samples)
+
+    def extend_index(self, other):
+        """Aggiunge i frame di other (l'indice di un altro stream) dopo quelli già presenti."""
+        samples = other.samples
+        if other.sample_rate != self.sample_rate:
+            samples = array("H", (round(n * self.sample_rate / other.sample_rate) for n in samples))
+        self.extend_frames(other.lengths, samples)
+
+    def pad(self, nbytes):
+        """Byte spuri dopo l'ultimo frame: restano nello stream, attribuiti a quel frame."""
+        if not self.lengths:
+            self.start += nbytes
+            return
+        self.lengths[-1] += nbytes
+        self.size += nbytes
+
+    def offset(self, i):
+        """Offset nel file del frame i (len(self) = fine dell'audio)."""
+        if i >= len(self.lengths):
+            return self.end
+        block = i // INDEX_CHECKPOINT
+        return self.start + self._offsets[block] + sum(self.lengths[block * INDEX_CHECKPOINT:i])
+
+    def position(self, i):
+        """Campioni prima del frame i."""
+        if i >= len(self.samples):
+            return self.total_samples
+        block = i // INDEX_CHECKPOINT
+        return self._positions[block] + sum(self.samples[block * INDEX_CHECKPOINT:i])
+
+    def time(self, i):
+        return self.position(i) / self.sample_rate
+
+    def frame_at(self, seconds):
+        """Indice del frame che contiene l'istante seconds."""
+        if not self.lengths:
+            return 0
+        target = seconds * self.sample_rate
+        block = max(0, bisect.bisect_right(self._positions, target) - 1)
+        i = block * INDEX_CHECKPOINT
+        position = self._positions[block]
+        last = min(len(self.samples), i + INDEX_CHECKPOINT) - 1
+        while i < last and position + self.samples[i] <= target:
+            position += self.samples[i]
+            i += 1
+        return i
+
+    def offset_at(self, seconds):
+        return self.offset(self.frame_at(seconds))
+
+    def save(self, path, mp3_path):
+        """Scrive l'indice in path, legato a dimensione e data di modifica di mp3_path."""
+        st = os.stat(mp3_path)
+        header = _INDEX_HEADER.pack(_INDEX_MAGIC, st.st_size, st.st_mtime_ns, self.sample_rate,
+                                    len(self.lengths), len(self._offsets), self.start, self.size,
+                                    self.total_samples)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                for values in (self.lengths, self.samples, self._offsets, self._positions):
+                    if sys.byteorder == "big":
+                        values = array(values.typecode, values)
+                        values.byteswap()
+                    values.tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path, mp3_path):
+        """Indice salvato in path, o None se manca, non è valido o mp3_path è cambiato."""
+        try:
+            st = os.stat(mp3_path)
+            with open(path, "rb") as f:
+                fields = _INDEX_HEADER.unpack(f.read(_INDEX_HEADER.size))
+                magic, size, mtime_ns, sample_rate, frames, checkpoints, start, audio_size, total = fields
+                if magic != _INDEX_MAGIC or size != st.st_size or mtime_ns != st.st_mtime_ns:
+                    return None
+                index = cls(sample_rate, start)
+                for values, count in ((index.lengths, frames), (index.samples, frames),
+                                      (index._offsets, checkpoints), (index._positions, checkpoints)):
+                    values.fromfile(f, count)
+                    if sys.byteorder == "big":
+                        values.byteswap()
+        except (OSError, EOFError, struct.error):
+            return None
+        index.size = audio_size
+        index.total_samples = total
+        return index
+
+
+def index_path_for(mp3_path):
+    return mp3_path + INDEX_SUFFIX
+
+
+def build_frame_index(path):
+    """FrameIndex di path, leggendo solo gli header dei frame."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"Empty MP3 file: {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _scan(mm, path, size, index=True).index
+
+
+def load_frame_index(path, save=True):
+    """Indice di path dal file affiancato (path + INDEX_SUFFIX) se aggiornato, altrimenti
+    lo ricostruisce e (con save) lo salva."""
+    index = FrameIndex.load(index_path_for(path), path)
+    if index is None:
+        index = build_frame_index(path)
+        if save:
+            index.save(index_path_for(path), path)
+    return index
+
+
+def scan_mp3(path, index=False):
+    """Analizza gli header dei frame di path senza decodificare l'audio; con index
+    costruisce nello stesso passaggio il FrameIndex della regione (span.index)."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"Empty MP3 file: {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _scan(mm, path, size, index)
+
+
+def _scan(mm, path, size, index=False):
+    pos = 0
+    tag_len = id3v2_size(mm, 0)
+    while tag_len:
+        pos += tag_len
+        tag_len = id3v2_size(mm, pos)
+    id3v2 = (0, pos)
+    end = _trailing_tags_start(mm, size)
+
+    pos = _find_sync(mm, pos, end)
+    if pos < 0:
+        raise ValueError(f"No MP3 frames found in {path}")
+    header = parse_frame_header(mm, pos)
+    lame = None
+    info = _read_info_tag(mm, pos, header)
+    if info is not None:
+        lame = info[1]
+        pos += header.length
+        nxt = _find_sync(mm, pos, end)
+        if nxt < 0:
+            return AudioSpan(path, pos, pos, 0, 0.0, header, True, [(0.0, 0)], id3v2, lame,
+                             FrameIndex(header.sample_rate, pos) if index else None)
+        pos = nxt
+        header = parse_frame_header(mm, pos)
+
+    frame_index = FrameIndex(header.sample_rate, pos) if index else None
+    frames = _cbr_frames(mm, pos, end, header)
+    if frames is not None:
+        seconds = frames * header.duration
+        if frame_index is not None:
+            frame_index.extend(header.length, header.samples, frames)
+        return AudioSpan(path, pos, end, frames, seconds, header, True,
+                         [(0.0, 0), (seconds, end - pos)], id3v2, lame, frame_index)
+    frames, seconds, audio_end, points, cbr = _walk_frames(mm, pos, end, header, frame_index)
+    return AudioSpan(path, pos, audio_end, frames, seconds, header, cbr, points, id3v2, lame, frame_index)
+
+
+class Mp3Probe:
+    """Formato e durata di un MP3 (bitrate medio in bit/s), letti dagli header senza decodificare."""
+
+    def __init__(self, path, bitrate, sample_rate, channels, seconds, vbr):
+        self.path = path
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.seconds = seconds
+        self.vbr = vbr
+
+    @property
+    def kbps(self):
+        return self.bitrate / 1000
+
+
+def probe_mp3(path):
+    """Bitrate, frequenza, canali e durata di path, senza ffmpeg.
+
+    Se il frame Xing/Info/VBRI dichiara il numero di frame basta leggere l'inizio del file;
+    altrimenti si usa scan_mp3 (CBR verificato a campione o lettura degli header dei frame).
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"Empty MP3 file: {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            tag_len = id3v2_size(mm, 0)
+            while tag_len:
+                pos += tag_len
+                tag_len = id3v2_size(mm, pos)
+            end = _trailing_tags_start(mm, size)
+            pos = _find_sync(mm, pos, end)
+            if pos < 0:
+                raise ValueError(f"No MP3 frames found in {path}")
+            header = parse_frame_header(mm, pos)
+            info = _read_info_tag(mm, pos, header)
+            frames = _info_frame_count(mm, pos, header) if info is not None else None
+            audio = _find_sync(mm, pos + header.length, end) if frames else -1
+            if audio >= 0:
+                first = parse_frame_header(mm, audio)
+                seconds = frames * first.duration
+                vbr = info[0] != b"Info"
+                bitrate = (end - audio) * 8 / seconds if vbr and seconds else first.bitrate
+                return Mp3Probe(path, bitrate, first.sample_rate, 1 if first.mono else 2, seconds, vbr)
+            span = _scan(mm, path, size)
+    first = span.first_header
+    bitrate = first.bitrate if span.cbr or not span.seconds else span.size * 8 / span.seconds
+    return Mp3Probe(path, bitrate, first.sample_rate, 1 if first.mono else 2, span.seconds, not span.cbr)
+
+
+def _crc16(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def build_info_frame(template, frames, audio_bytes, seconds, offset_at, vbr, lame=None,
+                     delay=0, padding=0):
+    """Frame Xing/Info (con estensione LAME se fornita) per uno stream di frames frame.
+
+    template è l'header del primo frame audio; offset_at(secondi) restituisce l'offset
+    del frame corrispondente rispetto al primo byte audio (dopo questo frame).
+    """
+    side = template.side_info_size
+    needed = 4 + side + 120 + (36 if lame is not None else 0)
+    base = template.raw & ~(0xF << 12) & ~0x0200 | 0x10000  # niente padding, niente CRC
+    header = None
+    for index in range(1, 15):
+        header = _parse_header_key((base | (index << 12)) & _HEADER_KEY_MASK)
+        if header is not None and header.length >= needed:
+            break
+    if header is None or header.length < needed:
+        raise ValueError("No bitrate can hold the Xing header for this stream")
+
+    total = header.length + audio_bytes
+    toc = bytearray(100)
+    for i in range(100):
+        position = header.length + offset_at(seconds * i / 100) if seconds else header.length
+        toc[i] = min(255, position * 256 // max(total, 1))
+
+    frame = bytearray(header.length)
+    frame[0:4] = (header.raw | (template.raw & 0x3F)).to_bytes(4, "big")
+    tag = 4 + side
+    frame[tag:tag + 4] = b"Xing" if vbr else b"Info"
+    struct.pack_into(">III", frame, tag + 4, 0x0F, frames, total)
+    frame[tag + 16:tag + 116] = toc
+    struct.pack_into(">I", frame, tag + 116, 0)
+    if lame is not None:
+        ext = tag + 120
+        frame[ext:ext + 36] = lame
+        frame[ext + 21] = (delay >> 4) & 0xFF
+        frame[ext + 22] = ((delay & 0x0F) << 4) | ((padding >> 8) & 0x0F)
+        frame[ext + 23] = padding & 0xFF
+        struct.pack_into(">I", frame, ext + 28, total)
+        # il CRC della musica richiederebbe di rileggere tutto l'audio: lasciato a zero
+        struct.pack_into(">H", frame, ext + 32, 0)
+        struct.pack_into(">H", frame, ext + 34, _crc16(frame[:ext + 34]))
+    return bytes(frame)
+
+
+_kernel_copy = {"copy_file_range": hasattr(os, "copy_file_range"), "sendfile": hasattr(os, "sendfile")}
+
+
+def _copy_range(src, dst, offset, count):
+    """Copia count byte da src[offset:] alla posizione corrente di dst, lato kernel se possibile."""
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    if _kernel_copy["copy_file_range"]:
+        try:
+            while count > 0:
+                n = os.copy_file_range(src_fd, dst_fd, min(count, 1 << 30), offset)
+                if n == 0:
+                    break
+                offset += n
+                count -= n
+            if count == 0:
+                return
+        except OSError:
+            _kernel_copy["copy_file_range"] = False
+    if _kernel_copy["sendfile"]:
+        try:
+            while count > 0:
+                n = os.sendfile(dst_fd, src_fd, offset, min(count, 1 << 30))
+                if n == 0:
+                    break
+                offset += n
+                count -= n
+            if count == 0:
+                return
+        except OSError:
+            _kernel_copy["sendfile"] = False
+    buffer = bytearray(min(COPY_BUFFER_SIZE, max(count, 1)))
+    view = memoryview(buffer)
+    src.seek(offset)
+    while count > 0:
+        n = src.readinto(view[:min(count, len(buffer))])
+        if not n:
+            raise IOError(f"Unexpected end of file in {src.name}")
+        dst.write(view[:n])
+        count -= n
+
+
+def _syncsafe(value):
+    return bytes(((value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F))
+
+
+def _id3_frame(frame_id, body, version):
+    size = _syncsafe(len(body)) if version == 4 else struct.pack(">I", len(body))
+    return frame_id + size + b"\0\0" + body
+
+
+def _id3_text(text, version):
+    if version == 4:
+        return b"\x03" + text.encode("utf-8")
+    return b"\x01" + text.encode("utf-16")
+
+
+def _id3_frames(tag):
+    """(versione, frame grezzi) di un tag ID3v2.3/2.4, senza CHAP e CTOC; None se non gestito."""
+    if len(tag) < 10 or tag[3] not in (3, 4) or tag[5] & 0xC0:
+        return None
+    version = tag[3]
+    end = min(len(tag), id3v2_size(tag))
+    frames = []
+    pos = 10
+    while pos + 10 <= end and tag[pos] != 0:
+        raw = tag[pos + 4:pos + 8]
+        if version == 4:
+            size = (raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]
+        else:
+            size = int.from_bytes(raw, "big")
+        if tag[pos:pos + 4] not in (b"CHAP", b"CTOC"):
+            frames.append(bytes(tag[pos:pos + 10 + size]))
+        pos += 10 + size
+    return version, frames
+
+
+def build_chapter_tag(chapters, base_tag=b"", audio_offset=0):
+    """Tag ID3v2 con un indice CTOC e un frame CHAP per capitolo.
+
+    chapters contiene (titolo, inizio_ms, fine_ms, inizio, fine) con gli offset in byte
+    relativi alla fine del tag; audio_offset è quanto c'è tra tag e audio (es. il frame
+    Xing). I frame di base_tag (ID3v2.3 o 2.4) vengono mantenuti, tranne CHAP e CTOC;
+    un tag di altra versione viene sostituito.
+    """
+    version, frames = _id3_frames(base_tag) or (3, [])
+
+    def body(tag_length):
+        parts = list(frames)
+        ids = [f"ch{i}".encode("ascii") for i in range(len(chapters))]
+        for element_id, (title, start_ms, end_ms, start, end) in zip(ids, chapters):
+            base = tag_length + audio_offset
+            parts.append(_id3_frame(b"CHAP", element_id + b"\0" + struct.pack(
+                ">IIII", start_ms, end_ms, base + start, base + end) +
+                _id3_frame(b"TIT2", _id3_text(title, version), version), version))
+        # CTOC elenca al più 255 elementi: oltre, un indice di primo livello con sotto-indici
+        groups = [ids[i:i + 255] for i in range(0, len(ids), 255)]
+        if len(groups) > 1:
+            children = [f"toc{i}".encode("ascii") for i in range(len(groups))]
+            for child, group in zip(children, groups):
+                parts.append(_id3_frame(b"CTOC", child + b"\0\x01" + bytes([len(group)]) +
+                                        b"".join(c + b"\0" for c in group), version))
+            groups = [children]
+        parts.append(_id3_frame(b"CTOC", b"toc\0\x03" + bytes([len(groups[0])]) +
+                                b"".join(c + b"\0" for c in groups[0]), version))
+        return b"".join(parts)
+
+    length = 10 + len(body(0))
+    return b"ID3" + bytes((version, 0, 0)) + _syncsafe(length - 10) + body(length)
+
+
+def concatenate(paths, output_path, progress=None, chapters=None, index=False):
+    """Unisce i file MP3 in output_path in streaming, con un solo header Xing/Info corretto.
+
+    I tag ID3/APE e i frame Xing interni vengono scartati; resta solo il tag ID3v2 del
+    primo file. progress(i, total) viene chiamato dopo ogni file copiato.
+    chapters (un titolo per file) aggiunge al tag ID3v2 un capitolo CHAP per ogni file;
+    con index si salva accanto a output_path il FrameIndex del risultato.
+    Restituisce la lista degli AudioSpan dei file uniti.
+    """
+    spans = [scan_mp3(p, index) for p in paths]
+    spans_with_audio = [s for s in spans if s.frames]
+    if not spans_with_audio:
+        raise ValueError("No MP3 audio to concatenate")
+
+    first = spans_with_audio[0]
+    frames = sum(s.frames for s in spans)
+    seconds = sum(s.seconds for s in spans)
+    audio_bytes = sum(s.size for s in spans)
+    fmt = first.first_header.raw & _FORMAT_MASK
+    vbr = not all(s.cbr and (s.first_header.raw & _FORMAT_MASK) == fmt and
+                  s.first_header.bitrate == first.first_header.bitrate for s in spans_with_audio)
+
+    # inizio di ogni file nel risultato: (byte, secondi) dall'inizio dell'audio
+    bounds = []
+    audio_offset = elapsed = 0
+    for s in spans:
+        bounds.append((audio_offset, elapsed))
+        audio_offset += s.size
+        elapsed += s.seconds
+    bounds.append((audio_offset, elapsed))
+    if index:
+        # indice dei frame del risultato, unendo quelli costruiti durante la scansione:
+        # TOC esatta anche per l'audio VBR e file .idx
+        frame_index = FrameIndex(first.first_header.sample_rate)
+        for s in spans:
+            if s.index.start > s.start:
+                frame_index.pad(s.index.start - s.start)
+            frame_index.extend_index(s.index)
+            s.index = None
+        offset_at = frame_index.offset_at
+    else:
+        # senza .idx basta interpolare tra i punti raccolti dalla scansione di ogni file
+        starts = [elapsed for _, elapsed in bounds[:-1]]
+
+        def offset_at(t):
+            i = max(0, bisect.bisect_right(starts, t) - 1)
+            return bounds[i][0] + spans[i].offset_at(t - starts[i])
+
+    lame = first.lame
+    last = spans_with_audio[-1]
+    info_frame = build_info_frame(first.first_header, frames, audio_bytes, seconds, offset_at, vbr,
+                                  lame=lame, delay=first.delay,
+                                  padding=last.padding if last.lame is not None else 0)
+
+    tag = b""
+    tag_start, tag_end = spans[0].id3v2
+    if tag_end > tag_start:
+        with open(spans[0].path, "rb") as src:
+            src.seek(tag_start)
+            tag = src.read(tag_end - tag_start)
+    if chapters is not None:
+        to_ms = lambda t: round(t * 1000)
+        marks = [(title, to_ms(bounds[i][1]), to_ms(bounds[i + 1][1]), bounds[i][0], bounds[i + 1][0])
+                 for i, (title, s) in enumerate(zip(chapters, spans)) if s.frames]
+        tag = build_chapter_tag(marks, tag[:id3v2_size(tag)], len(info_frame))
+
+    with open(output_path, "wb", buffering=0) as out:
+        out.write(tag)
+        out.write(info_frame)
+        for i, s in enumerate(spans):
+            if s.size:
+                with open(s.path, "rb") as src:
+                    _copy_range(src, out, s.start, s.size)
+            if progress:
+                progress(i, len(spans))
+    if index:
+        frame_index.start = len(tag) + len(info_frame)
+        frame_index.save(index_path_for(output_path), output_path)
+    return spans
+
+
+class Mp3StreamWriter:
+    """Scrive in fileobj lo stream MP3 ricevuto a pezzi, un segmento per chunk.
+
+    All'inizio di ogni segmento scarta tag ID3 e frame Xing/Info; a close() scrive
+    un header Xing/Info corretto nello spazio riservato all'inizio (se fileobj è seekable).
+    Se fileobj non è seekable (es. una pipe) ogni segmento viene scritto solo quando è
+    completo, così abort_segment() non lascia audio parziale nello stream.
+    """
+
+    POINT_EVERY = 1000
+
+    def __init__(self, fileobj, write_info=True):
+        self.fileobj = fileobj
+        self.seekable = fileobj.seekable()
+        self.write_info = write_info and self.seekable
+        self.frames = 0
+        self.seconds = 0.0
+        self.audio_bytes = 0
+        self.template = None
+        self.lame = None
+        self.vbr = False
+        self.points = [(0.0, 0)]
+        self._info_offset = None
+        self._info_length = 0
+        self._pending = bytearray()
+        self._segment_start = True
+        self._mark = None
+        self.begin_segment()
+
+    def begin_segment(self):
+        self._pending.clear()
+        self._segment_start = True
+        self._mark = (self.frames, self.seconds, self.audio_bytes, len(self.points),
+                      self.template, self.lame, self.vbr, self._info_offset, self._info_length,
+                      self.fileobj.tell() if self.seekable else None)
+
+    def feed(self, data):
+        self._pending += data
+        if self.seekable:
+            self._drain(final=False)
+
+    def end_segment(self):
+        self._drain(final=True)
+        self._pending.clear()
+
+    def abort_segment(self):
+        """Annulla quanto scritto dall'ultimo begin_segment."""
+        (self.frames, self.seconds, self.audio_bytes, points, self.template, self.lame, self.vbr,
+         self._info_offset, self._info_length, position) = self._mark
+        del self.points[points:]
+        self._pending.clear()
+        if position is not None:
+            self.fileobj.seek(position)
+            self.fileobj.truncate()
+
+    def close(self):
+        self.end_segment()
+        if self._info_offset is None or not self.frames:
+            return
+        if self.points[-1][1] != self.audio_bytes:
+            self.points.append((self.seconds, self.audio_bytes))
+        frame = build_info_frame(self.template, self.frames, self.audio_bytes, self.seconds,
+                                 lambda t: _interpolate_offset(self.points, t), self.vbr, lame=self.lame)
+        end = self.fileobj.tell()
+        self.fileobj.seek(self._info_offset)
+        self.fileobj.write(frame)
+        self.fileobj.seek(end)
+
+    def _skip_segment_header(self, buf, final):
+        """Posizione del primo frame audio del segmento, None se servono altri dati."""
+        pos = 0
+        while True:
+            if len(buf) - pos < 10 and not final:
+                return None
+            tag = id3v2_size(buf, pos)
+            if not tag:
+                break
+            if len(buf) < pos + tag and not final:
+                return None
+            pos += tag
+        if len(buf) - pos < 4096 and not final:
+            return None
+        start = _find_sync(buf, pos, len(buf))
+        if start < 0:
+            return len(buf)
+        header = parse_frame_header(buf, start)
+        if len(buf) < start + header.length and not final:
+            return None
+        info = _read_info_tag(buf, start, header)
+        if info is not None:
+            if self.template is None and info[1] is not None:
+                self.lame = info[1]
+            start += header.length
+        return start
+
+    def _drain(self, final):
+        buf = self._pending
+        pos = 0
+        if self._segment_start:
+            pos = self._skip_segment_header(buf, final)
+            if pos is None:
+                return
+            self._segment_start = False
+        n = len(buf)
+        run_start = pos
+        while pos + 4 <= n:
+            header = parse_frame_header(buf, pos)
+            if header is None:
+                # byte spuri: si scartano fino al prossimo frame valido
+                self._write(buf, run_start, pos)
+                nxt = _find_sync(buf, pos + 1, n)
+                if nxt < 0:
+                    pos = run_start = n if final else max(pos, n - 3)
+                    break
+                pos = run_start = nxt
+                continue
+            if pos + header.length > n:
+                break
+            if self.template is None:
+                self._start_stream(header)
+            elif (header.raw & _FORMAT_MASK) != (self.template.raw & _FORMAT_MASK) or \
+                    header.bitrate != self.template.bitrate:
+                self.vbr = True
+            self.frames += 1
+            self.seconds += header.samples / header.sample_rate
+            pos += header.length
+            self.audio_bytes += header.length
+            if self.frames % self.POINT_EVERY == 0:
+                self.points.append((self.seconds, self.audio_bytes))
+        self._write(buf, run_start, pos)
+        del buf[:pos]
+
+    def _start_stream(self, header):
+        self.template = header
+        if self.write_info:
+            self._info_offset = self.fileobj.tell()
+            placeholder = build_info_frame(header, 0, 0, 0.0, lambda t: 0, False, lame=self.lame)
+            self._info_length = len(placeholder)
+            self.fileobj.write(placeholder)
+
+    def _write(self, buf, start, end):
+        if end > start:
+            self.fileobj.write(memoryview(buf)[start:end])
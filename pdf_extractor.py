@@ -0,0 +1,148 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfplumber
+import PyPDF2
+
+# sotto questa soglia avviare i processi costa più di quanto si guadagna
+MIN_PARALLEL_PAGES = 16
+MIN_SHARD_PAGES = 8
+# più shard che processi, così un gruppo di pagine lente non blocca gli altri
+SHARDS_PER_WORKER = 4
+# in lettura progressiva: intervalli piccoli e pochi in anticipo, la memoria resta limitata
+STREAM_SHARD_PAGES = 32
+STREAM_PREFETCH_PER_WORKER = 2
+
+
+def count_pages(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return len(PyPDF2.PdfReader(f).pages)
+    except Exception:
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+
+
+def _page_texts(pages, start, stop):
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def extract_page_range(file_path, start=0, stop=None):
+    """Testo delle pagine [start, stop): pdfplumber, con PyPDF2 di riserva per l'intervallo."""
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            return _page_texts(pdf.pages, start, stop)
+    except Exception:
+        with open(file_path, 'rb') as f:
+            return _page_texts(PyPDF2.PdfReader(f).pages, start, stop)
+
+
+def iter_page_range(file_path, start=0, stop=None):
+    """Come extract_page_range, ma una pagina alla volta; se pdfplumber si ferma a metà,
+    PyPDF2 riprende dalla pagina successiva all'ultima letta."""
+    done = start
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            pages = pdf.pages
+            for i in range(start, len(pages) if stop is None else min(stop, len(pages))):
+                page = pages[i]
+                text = page.extract_text() or ""
+                # pdfplumber tiene in cache gli oggetti di ogni pagina letta
+                close = getattr(page, "close", None)
+                if close is not None:
+                    close()
+                done = i + 1
+                yield text
+            return
+    except Exception:
+        pass
+    with open(file_path, 'rb') as f:
+        pages = PyPDF2.PdfReader(f).pages
+        for i in range(done, len(pages) if stop is None else min(stop, len(pages))):
+            yield pages[i].extract_text() or ""
+
+
+def _extract_shard(args):
+    return extract_page_range(*args)
+
+
+def plan_shards(page_count, workers, max_size=None):
+    size = max(MIN_SHARD_PAGES, -(-page_count // (workers * SHARDS_PER_WORKER)))
+    if max_size:
+        size = min(size, max(MIN_SHARD_PAGES, max_size))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def extract_pdf_pages(file_path, workers=None):
+    """Lista dei testi delle pagine, estratti in parallelo da più processi.
+
+    Le pagine vengono divise in intervalli contigui; ogni processo apre il PDF per conto
+    suo e restituisce le pagine del proprio intervallo, che vengono rimesse in ordine.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    try:
+        page_count = count_pages(file_path)
+    except Exception:
+        page_count = 0
+    if workers == 1 or page_count < MIN_PARALLEL_PAGES:
+        return extract_page_range(file_path)
+
+    shards = plan_shards(page_count, workers)
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+            results = executor.map(_extract_shard, [(file_path, start, stop) for start, stop in shards])
+            pages = []
+            for shard_pages in results:
+                pages.extend(shard_pages)
+            return pages
+    except (BrokenProcessPool, OSError):
+        # processi non disponibili (es. ambiente ristretto): estrazione nel processo corrente
+        return extract_page_range(file_path)
+
+
+def iter_pdf_pages(file_path, workers=None):
+    """Testi delle pagine in ordine, restituiti appena pronti.
+
+    Come extract_pdf_pages divide il lavoro tra più processi, ma con intervalli piccoli e
+    solo pochi in lavorazione alla volta: la prima pagina arriva subito e la memoria usata
+    non cresce con la lunghezza del libro.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    try:
+        page_count = count_pages(file_path)
+    except Exception:
+        page_count = 0
+    if workers == 1 or page_count < MIN_PARALLEL_PAGES:
+        yield from iter_page_range(file_path)
+        return
+
+    shards = plan_shards(page_count, workers, STREAM_SHARD_PAGES)
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+            pending = deque()
+            try:
+                for start, stop in shards:
+                    pending.append(executor.submit(_extract_shard, (file_path, start, stop)))
+                    if len(pending) < workers * STREAM_PREFETCH_PER_WORKER:
+                        continue
+                    for text in pending.popleft().result():
+                        done += 1
+                        yield text
+                while pending:
+                    for text in pending.popleft().result():
+                        done += 1
+                        yield text
+            finally:
+                # lettura interrotta: gli intervalli non ancora iniziati non servono più
+                for future in pending:
+                    future.cancel()
+    except (BrokenProcessPool, OSError):
+        yield from iter_page_range(file_path, done)
+
+
+def extract_pdf_text(file_path, workers=None, separator="\n\n"):
+    return separator.join(extract_pdf_pages(file_path, workers))
@@ -0,0 +1,94 @@
+import queue
+from tkinter import ttk
+
+# ogni quanti millisecondi la GUI applica gli eventi arrivati (10 aggiornamenti al secondo)
+FRAME_INTERVAL = 100
+# passi della barra di avanzamento
+BAR_STEPS = 1000
+
+
+class ProgressBus:
+    """Eventi dai thread di lavoro alla GUI di Tk.
+
+    I worker chiamano post() e call() da qualsiasi thread: mettono solo l'evento in una
+    coda, che il thread di Tk svuota ogni interval ms con root.after. Degli eventi post()
+    con la stessa key arrivati nello stesso intervallo viene eseguito solo l'ultimo, così
+    la GUI fa al più un aggiornamento per key per intervallo, comunque vadano veloci i
+    worker. Gli eventi call() (errori, fine del lavoro) vengono eseguiti tutti, in ordine.
+    """
+
+    def __init__(self, root, interval=FRAME_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._queue = queue.SimpleQueue()
+        self._after = None
+        # eventi ricevuti ed eseguiti, per vedere quanto lavoro risparmia la coalescenza
+        self.posted = 0
+        self.dispatched = 0
+
+    def post(self, key, func, *args, **kwargs):
+        """Esegue func(*args, **kwargs) sul thread di Tk; sostituisce un evento con la stessa key in attesa."""
+        self._queue.put((key, func, args, kwargs))
+
+    def call(self, func, *args, **kwargs):
+        """Esegue func(*args, **kwargs) sul thread di Tk, senza coalescenza."""
+        self._queue.put((None, func, args, kwargs))
+
+    def start(self):
+        """Avvia lo svuotamento periodico della coda; va chiamato dal thread di Tk."""
+        if self._after is None:
+            self._after = self.root.after(self.interval, self._drain)
+
+    def stop(self):
+        if self._after is not None:
+            self.root.after_cancel(self._after)
+            self._after = None
+
+    def _drain(self):
+        events = []
+        latest = {}
+        while True:
+            try:
+                key, func, args, kwargs = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self.posted += 1
+            if key is not None:
+                # l'evento più recente prende il posto del precedente, dopo quelli arrivati nel mezzo
+                if key in latest:
+                    events[latest[key]] = None
+                latest[key] = len(events)
+            events.append((func, args, kwargs))
+        try:
+            for event in events:
+                if event is not None:
+                    func, args, kwargs = event
+                    self.dispatched += 1
+                    func(*args, **kwargs)
+        finally:
+            self._after = self.root.after(self.interval, self._drain)
+
+
+class ProgressPanel:
+    """Barra di avanzamento con sotto una riga di testo (velocità, ETA...)."""
+
+    def __init__(self, parent, length=400):
+        self.bar = ttk.Progressbar(parent, length=length, maximum=BAR_STEPS, mode="determinate")
+        self.label = ttk.Label(parent, text="")
+
+    def pack(self, **kwargs):
+        self.bar.pack(**kwargs)
+        self.label.pack(**kwargs)
+
+    def show(self, fraction, text=""):
+        """fraction tra 0 e 1; None se il totale non è ancora noto (la barra si muove avanti e indietro)."""
+        if fraction is None:
+            self.bar.config(mode="indeterminate")
+            self.bar.step(BAR_STEPS // 50)
+        else:
+            self.bar.config(mode="determinate", value=BAR_STEPS * min(1.0, max(0.0, fraction)))
+        self.label.config(text=text)
+
+    def reset(self, text=""):
+        self.bar.config(mode="determinate", value=0)
+        self.label.config(text=text)
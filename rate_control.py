@@ -0,0 +1,107 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+# esiti recenti su cui si calcola il tasso di errore
+ERROR_WINDOW = 100
+
+
+class RetryPolicy:
+    """Numero massimo di tentativi per chunk e attesa tra un tentativo e l'altro.
+
+    L'attesa è un backoff esponenziale con jitter pieno: casuale tra 0 e
+    base_delay * 2^(tentativo - 1), al massimo max_delay.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter:
+    """Limite alle richieste in volo regolato in stile AIMD.
+
+    Ogni successo alza il limite di 1/limite (circa +1 per ogni giro di richieste riuscite);
+    un errore o un timeout lo moltiplica per `decrease`. Come in TCP, gli errori di richieste
+    partite prima dell'ultima riduzione non lo riducono ancora: una raffica di errori dovuta
+    allo stesso rallentamento conta una volta sola.
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(self.max_limit)
+        self.decrease = decrease
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.retries = 0
+        self._recent = deque(maxlen=ERROR_WINDOW)
+        self._last_decrease = None
+        self._changed = None
+        self._loop = None
+
+    def set_max(self, max_limit):
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.limit, self.max_limit)
+
+    def _condition(self):
+        # la Condition appartiene all'event loop: va ricreata se il motore ne avvia uno nuovo
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def acquire(self):
+        """Attende un posto libero; restituisce l'istante di partenza da passare a release()."""
+        changed = self._condition()
+        async with changed:
+            await changed.wait_for(lambda: self.in_flight < max(self.min_limit, int(self.limit)))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started, ok, timeout=False):
+        self.in_flight -= 1
+        self._recent.append(ok)
+        if ok:
+            self.successes += 1
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            self.failures += 1
+            if timeout:
+                self.timeouts += 1
+            if self._last_decrease is None or started >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = time.monotonic()
+        changed = self._condition()
+        async with changed:
+            changed.notify_all()
+
+    @property
+    def error_rate(self):
+        if not self._recent:
+            return 0.0
+        return self._recent.count(False) / len(self._recent)
+
+    def stats(self):
+        return {
+            "concurrency": max(self.min_limit, int(self.limit)),
+            "max_concurrency": self.max_limit,
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "error_rate": self.error_rate,
+        }
@@ -0,0 +1,550 @@
+import argparse
+import glob
+import json
+import os
+import secrets
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from book_splitter import split_file_into_shards
+from chunk_cache import ChunkCache
+from chunk_planner import plan_chunks
+from metrics import RunMetrics, Throughput, default_metrics_dir, format_eta, load_run
+from mp3_tools import concatenate, scan_mp3
+from text_processing import SPEECH_CHARS_PER_SECOND
+from tts_engine import DEFAULT_CONCURRENCY, SynthesisEngine
+
+MANIFEST_SUFFIX = "_shards.json"
+DEFAULT_PORT = 8765
+DEFAULT_VOICE = "it-IT-GiuseppeMultilingualNeural"
+# i worker locali ricevono il token da qui, non dalla riga di comando
+TOKEN_ENV = "AUDIOLIBRI_SHARD_TOKEN"
+# un worker che non si fa sentire per tanto tempo è considerato perso: la sua parte torna disponibile
+LEASE_SECONDS = 600
+HEARTBEAT_SECONDS = 30
+# attesa di un worker quando tutte le parti rimaste sono già in lavorazione da altri
+POLL_SECONDS = 5.0
+# una parte fallita (o il cui worker è sparito) più di tante volte non si ritenta
+MAX_ATTEMPTS = 3
+# esecuzioni precedenti usate per stimare quanto legge veloce una voce
+SPEECH_HISTORY = 20
+MAX_HEADER_SIZE = 64 * 1024
+TRANSFER_BLOCK_SIZE = 1024 * 1024
+
+
+def speech_rate(voice, directory=None, history=SPEECH_HISTORY):
+    """Caratteri al secondo letti da voice a velocità 1.0 nelle ultime sintesi registrate
+    (app, pipeline e nodi di rendering); SPEECH_CHARS_PER_SECOND se non ce ne sono."""
+    directory = directory or default_metrics_dir()
+    files = []
+    for tool in ("audiobook", "pipeline", "nodo"):
+        files += glob.glob(os.path.join(directory, f"{tool}-*.jsonl"))
+    files.sort(key=lambda path: os.path.basename(path).split("-", 1)[1])
+    chars = seconds = 0.0
+    for path in files[-history:]:
+        try:
+            start, _, records = load_run(path)
+        except (OSError, ValueError):
+            continue
+        settings = start.get("settings") or {}
+        for r in records:
+            if r.get("stage") != "sintesi" or not r.get("chars") or not r.get("audio_seconds"):
+                continue
+            if r.get("voice", settings.get("voice")) != voice:
+                continue
+            try:
+                speed = float(r.get("speed", settings.get("speed")) or 1.0)
+            except ValueError:
+                continue
+            chars += r["chars"]
+            # a velocità 2.0 lo stesso testo dura la metà
+            seconds += r["audio_seconds"] * speed
+    return chars / seconds if chars and seconds else SPEECH_CHARS_PER_SECOND
+
+
+class ShardManifest:
+    """Un libro diviso in parti di durata simile, con la voce e la velocità con cui leggerlo.
+
+    Sta in un file JSON accanto ai testi delle parti e registra anche l'audio già ricevuto:
+    un coordinatore riavviato riparte dalle sole parti mancanti.
+    """
+
+    def __init__(self, path, source, voice, speed, chars_per_second, shards):
+        self.path = path
+        self.source = source
+        self.voice = voice
+        self.speed = speed
+        self.chars_per_second = chars_per_second
+        # per parte: "text" (nome del file), "chars", "seconds" stimati, poi "audio" e "audio_size"
+        self.shards = shards
+
+    @property
+    def directory(self):
+        return os.path.dirname(os.path.abspath(self.path))
+
+    @property
+    def base_name(self):
+        return os.path.basename(self.path)[:-len(MANIFEST_SUFFIX)]
+
+    @property
+    def seconds(self):
+        return sum(shard["seconds"] for shard in self.shards)
+
+    def text_path(self, index):
+        return os.path.join(self.directory, self.shards[index]["text"])
+
+    def audio_path(self, index):
+        return os.path.join(self.directory, f"{self.base_name}_part{index+1}.mp3")
+
+    def done(self, index):
+        shard = self.shards[index]
+        try:
+            return bool(shard.get("audio")) and os.path.getsize(self.audio_path(index)) == shard.get("audio_size")
+        except OSError:
+            return False
+
+    def record_audio(self, index):
+        self.shards[index]["audio"] = os.path.basename(self.audio_path(index))
+        self.shards[index]["audio_size"] = os.path.getsize(self.audio_path(index))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(path, data["source"], data["voice"], data["speed"], data["chars_per_second"], data["shards"])
+
+    def save(self):
+        data = {"source": self.source, "voice": self.voice, "speed": self.speed,
+                "chars_per_second": self.chars_per_second, "shards": self.shards}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def summary(self):
+        lines = [f"{len(self.shards)} parti per {self.voice} a velocità {self.speed} "
+                 f"({self.chars_per_second:.1f} caratteri/s), {format_eta(self.seconds)} di audio stimato"]
+        for i, shard in enumerate(self.shards):
+            lines.append(f"  {shard['text']}: {shard['chars']} caratteri, {format_eta(shard['seconds'])}"
+                         + (" (audio pronto)" if self.done(i) else ""))
+        return "\n".join(lines)
+
+
+def write_shards(file_path, output_dir, num_parts, voice=DEFAULT_VOICE, speed="1.0", chars_per_second=None,
+                 base_name=None):
+    """Divide il libro in num_parts parti di durata stimata simile e ne scrive il manifest."""
+    if base_name is None:
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+    chars_per_second = chars_per_second or speech_rate(voice)
+    shards = split_file_into_shards(file_path, num_parts, output_dir, base_name, chars_per_second, speed)
+    if not any(s.chars for s in shards):
+        # libro vuoto o di soli spazi: nessuna parte da distribuire
+        for s in shards:
+            os.remove(s.path)
+        raise ValueError(f"No text in {file_path}")
+    manifest = ShardManifest(os.path.join(output_dir, base_name + MANIFEST_SUFFIX), os.path.abspath(file_path),
+                             voice, speed, chars_per_second,
+                             [{"text": os.path.basename(s.path), "chars": s.chars, "seconds": round(s.seconds, 1)}
+                              for s in shards])
+    manifest.save()
+    return manifest
+
+
+# protocollo: ogni messaggio è una riga JSON, seguita da "size" byte di dati se il campo c'è
+
+def _send(sock, header, payload=None):
+    if payload is None:
+        payload = b""
+    else:
+        header = dict(header, size=len(payload))
+    sock.sendall(json.dumps(header).encode("utf-8") + b"\n" + payload)
+
+
+def _send_file(sock, header, path):
+    with open(path, "rb") as f:
+        sock.sendall(json.dumps(dict(header, size=os.fstat(f.fileno()).st_size)).encode("utf-8") + b"\n")
+        sock.sendfile(f)
+
+
+def _receive(rfile):
+    """Prossimo messaggio, None se l'altra parte ha chiuso la connessione."""
+    line = rfile.readline(MAX_HEADER_SIZE)
+    if not line:
+        return None
+    if not line.endswith(b"\n"):
+        raise ValueError("Message header too long")
+    return json.loads(line)
+
+
+def _receive_payload(rfile, size):
+    data = rfile.read(size)
+    if len(data) != size:
+        raise ConnectionError("Connection closed during transfer")
+    return data
+
+
+def _receive_file(rfile, size, path):
+    """Scrive in path i size byte che seguono, passando da un file temporaneo."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while size > 0:
+                block = rfile.read(min(size, TRANSFER_BLOCK_SIZE))
+                if not block:
+                    raise ConnectionError("Connection closed during transfer")
+                f.write(block)
+                size -= len(block)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    # il coordinatore riavviato può riusare subito la porta
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ShardCoordinator:
+    """Distribuisce le parti di un ShardManifest ai worker collegati via TCP e ne raccoglie l'audio.
+
+    Le parti più lunghe partono per prime, così nessun worker ne inizia una lunga quando
+    gli altri hanno quasi finito. Una parte torna disponibile se il suo worker si scollega,
+    tace per LEASE_SECONDS o segnala un errore, fino a MAX_ATTEMPTS volte. Ogni worker deve
+    presentare il token, generato a caso se non indicato.
+    """
+
+    def __init__(self, manifest, host="127.0.0.1", port=DEFAULT_PORT, token=None, log=print):
+        self.manifest = manifest
+        self.token = token or secrets.token_hex(16)
+        self.log = log
+        pending = [i for i in range(len(manifest.shards)) if not manifest.done(i)]
+        # pop() dà la parte più lunga rimasta
+        self._pending = sorted(pending, key=lambda i: manifest.shards[i]["seconds"])
+        self._running = {}
+        self._attempts = Counter()
+        # secondi stimati di audio già sintetizzati nelle parti in corso, dagli heartbeat
+        self._partial = {}
+        self.failed = {}
+        self._changed = threading.Condition()
+        self.throughput = Throughput(sum(manifest.shards[i]["seconds"] for i in pending))
+
+        coordinator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                coordinator._handle(self.request, self.client_address)
+
+        self.server = _Server((host, port), Handler)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    @property
+    def finished(self):
+        return not self._pending and not self._running
+
+    def _next(self, worker):
+        with self._changed:
+            if self._pending:
+                index = self._pending.pop()
+                self._running[index] = worker
+                return index
+            return None
+
+    def _settle(self, index, error=None):
+        """Chiude la lavorazione di una parte: completata, o di nuovo disponibile se restano tentativi."""
+        with self._changed:
+            self._running.pop(index, None)
+            self._partial.pop(index, None)
+            if error is None:
+                self.throughput.update(self.throughput.done + self.manifest.shards[index]["seconds"])
+            else:
+                self._attempts[index] += 1
+                if self._attempts[index] >= MAX_ATTEMPTS:
+                    self.failed[index] = error
+                else:
+                    # ritentata per ultima: intanto le altre vanno avanti
+                    self._pending.insert(0, index)
+            self._changed.notify_all()
+
+    def _handle(self, sock, address):
+        sock.settimeout(LEASE_SECONDS)
+        rfile = sock.makefile("rb")
+        worker = f"{address[0]}:{address[1]}"
+        index = None
+        try:
+            hello = _receive(rfile)
+            if not hello or not secrets.compare_digest(str(hello.get("token", "")), self.token):
+                _send(sock, {"op": "error", "error": "invalid token"})
+                return
+            worker = hello.get("worker") or worker
+            self.log(f"worker collegato: {worker}")
+            while True:
+                message = _receive(rfile)
+                if message is None:
+                    return
+                op = message.get("op")
+                if op == "alive":
+                    if index is not None:
+                        self._partial[index] = message.get("fraction", 0.0) * self.manifest.shards[index]["seconds"]
+                elif op == "next":
+                    index = self._next(worker)
+                    if index is not None:
+                        with open(self.manifest.text_path(index), "rb") as f:
+                            text = f.read()
+                        self.log(f"parte {index+1} a {worker}")
+                        _send(sock, {"op": "shard", "index": index, "voice": self.manifest.voice,
+                                     "speed": self.manifest.speed}, text)
+                    elif self.finished:
+                        _send(sock, {"op": "done"})
+                        return
+                    else:
+                        _send(sock, {"op": "wait", "seconds": POLL_SECONDS})
+                elif op == "result" and index is not None and message.get("index") == index:
+                    _receive_file(rfile, message["size"], self.manifest.audio_path(index))
+                    with self._changed:
+                        self.manifest.record_audio(index)
+                        self.manifest.save()
+                    self._settle(index)
+                    self.log(f"parte {index+1} ricevuta da {worker}")
+                    index = None
+                    _send(sock, {"op": "ok"})
+                elif op == "failed" and index is not None and message.get("index") == index:
+                    self.log(f"parte {index+1} fallita su {worker}: {message.get('error')}")
+                    self._settle(index, message.get("error") or "unknown error")
+                    index = None
+                    _send(sock, {"op": "ok"})
+                else:
+                    raise ValueError(f"Unexpected message: {op}")
+        except (OSError, ValueError) as e:
+            self.log(f"worker {worker}: {e}")
+        finally:
+            if index is not None:
+                self.log(f"parte {index+1} di nuovo disponibile: {worker} non risponde")
+                self._settle(index, f"worker {worker} lost")
+            rfile.close()
+
+    def _status(self):
+        with self._changed:
+            partial = sum(self._partial.values())
+            done = self.throughput.done
+            running = len(self._running)
+        fraction = (done + partial) / self.throughput.total if self.throughput.total else 1.0
+        eta = (self.throughput.total - done - partial) / ((done + partial) / self.throughput.elapsed) \
+            if done + partial else None
+        return (f"{len(self.manifest.shards) - len(self._pending) - running - len(self.failed)}/"
+                f"{len(self.manifest.shards)} parti pronte, {running} in lavorazione, "
+                f"{fraction:.0%} - ETA {format_eta(eta)}")
+
+    def serve(self):
+        """Attende che tutte le parti siano pronte (o fallite definitivamente); restituisce le fallite."""
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with self._changed:
+                while not self.finished:
+                    self._changed.wait(HEARTBEAT_SECONDS)
+                    if not self.finished:
+                        self.log(self._status())
+        finally:
+            # i worker ancora collegati ricevono "done" alla prossima richiesta
+            self.server.shutdown()
+            self.server.server_close()
+        return self.failed
+
+    def assemble(self, output_path):
+        """Unisce l'audio delle parti, in ordine, in output_path (un capitolo per parte)."""
+        paths = [self.manifest.audio_path(i) for i in range(len(self.manifest.shards))]
+        spans = concatenate(paths, output_path, index=True,
+                            chapters=[f"Parte {i+1}" for i in range(len(paths))])
+        return sum(span.seconds for span in spans)
+
+
+class ShardWorker:
+    """Un nodo di rendering: chiede parti al coordinatore, le sintetizza e gli rimanda l'MP3."""
+
+    def __init__(self, host, port=DEFAULT_PORT, token=None, concurrency=DEFAULT_CONCURRENCY, use_cache=True,
+                 log=print):
+        self.host = host
+        self.port = port
+        self.token = token or os.environ.get(TOKEN_ENV, "")
+        self.concurrency = concurrency
+        self.use_cache = use_cache
+        self.log = log
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.rendered = 0
+        self._send_lock = threading.Lock()
+
+    def _send(self, sock, header, payload=None):
+        with self._send_lock:
+            _send(sock, header, payload)
+
+    def run(self):
+        engine = SynthesisEngine(self.concurrency, cache=ChunkCache() if self.use_cache else None)
+        metrics = RunMetrics("nodo", {"worker": self.worker_id, "coordinator": f"{self.host}:{self.port}",
+                                      "concurrency": self.concurrency})
+        engine.metrics = metrics
+        try:
+            with socket.create_connection((self.host, self.port)) as sock, \
+                    tempfile.TemporaryDirectory(prefix="nodo_") as work_dir:
+                rfile = sock.makefile("rb")
+                self._send(sock, {"op": "hello", "token": self.token, "worker": self.worker_id})
+                while True:
+                    self._send(sock, {"op": "next"})
+                    reply = _receive(rfile)
+                    if reply is None or reply["op"] == "done":
+                        return self.rendered
+                    if reply["op"] == "error":
+                        raise RuntimeError(reply["error"])
+                    if reply["op"] == "wait":
+                        time.sleep(reply.get("seconds", POLL_SECONDS))
+                        continue
+                    text = _receive_payload(rfile, reply["size"]).decode("utf-8")
+                    self._render(sock, rfile, engine, metrics, reply, text, work_dir)
+        finally:
+            engine.close()
+            metrics.close(engine=engine.stats(), shards=self.rendered)
+
+    def _render(self, sock, rfile, engine, metrics, shard, text, work_dir):
+        index = shard["index"]
+        chunks = plan_chunks(text).chunks()
+        audio_path = os.path.join(work_dir, f"parte{index}.mp3")
+        self.log(f"parte {index+1}: {len(chunks)} chunk")
+        done = [0]
+        stop = threading.Event()
+
+        def heartbeats():
+            # anche durante i tentativi più lunghi il coordinatore sa che la parte è viva
+            while not stop.wait(HEARTBEAT_SECONDS):
+                self._send(sock, {"op": "alive", "index": index, "fraction": done[0] / max(1, len(chunks))})
+
+        def on_progress(i, completed, total):
+            done[0] = completed
+
+        thread = threading.Thread(target=heartbeats, daemon=True)
+        thread.start()
+        try:
+            with metrics.stage("sintesi", shard=index, voice=shard["voice"], speed=shard["speed"],
+                               chars=len(text)) as stage:
+                engine.synthesize_to_file(chunks, audio_path, shard["voice"], shard["speed"], progress=on_progress)
+                seconds = scan_mp3(audio_path).seconds
+                stage["audio_seconds"] = round(seconds, 2)
+                metrics.add_audio(seconds)
+        except Exception as e:
+            stop.set()
+            thread.join()
+            self._send(sock, {"op": "failed", "index": index, "error": str(e) or type(e).__name__})
+            _receive(rfile)
+            return
+        stop.set()
+        thread.join()
+        with self._send_lock:
+            _send_file(sock, {"op": "result", "index": index, "audio_seconds": round(seconds, 2)}, audio_path)
+        if _receive(rfile) is None:
+            raise ConnectionError("Coordinator closed the connection")
+        os.remove(audio_path)
+        self.rendered += 1
+        self.log(f"parte {index+1} inviata ({format_eta(seconds)} di audio)")
+
+
+def launch_local_workers(count, port, token, concurrency=DEFAULT_CONCURRENCY, use_cache=True):
+    """Avvia count processi `shard_coordinator.py work` collegati al coordinatore su questa macchina."""
+    command = [sys.executable, os.path.abspath(__file__), "work", "--host", "127.0.0.1", "--port", str(port),
+               "--concurrency", str(concurrency)]
+    if not use_cache:
+        command.append("--no-cache")
+    env = dict(os.environ, **{TOKEN_ENV: token})
+    return [subprocess.Popen(command, stdin=subprocess.DEVNULL, env=env,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+            for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Divide un libro in parti di durata simile e le fa sintetizzare da più processi o macchine.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split = commands.add_parser("split", help="divide un file di testo e scrive il manifest delle parti")
+    split.add_argument("file")
+    split.add_argument("-o", "--output", help="cartella delle parti (default: <nome>_split accanto al file)")
+    split.add_argument("--parts", type=int, default=8)
+    split.add_argument("--voice", default=DEFAULT_VOICE)
+    split.add_argument("--speed", default="1.0")
+    split.add_argument("--chars-per-second", type=float,
+                       help="velocità di lettura della voce (default: misurata nelle esecuzioni precedenti)")
+
+    serve = commands.add_parser("serve", help="distribuisce le parti ai worker e unisce l'audio")
+    serve.add_argument("manifest", help=f"file *{MANIFEST_SUFFIX} scritto da split")
+    serve.add_argument("-o", "--output", help="MP3 finale (default: <nome>.mp3 accanto al manifest)")
+    serve.add_argument("--host", default="127.0.0.1", help="0.0.0.0 per accettare worker da altre macchine")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--token", help="token che i worker devono presentare (default: generato)")
+    serve.add_argument("--local-workers", type=int, default=1, help="worker da avviare su questa macchina")
+    serve.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="richieste TTS per worker locale")
+    serve.add_argument("--no-cache", action="store_true")
+
+    work = commands.add_parser("work", help="sintetizza le parti assegnate da un coordinatore")
+    work.add_argument("--host", required=True)
+    work.add_argument("--port", type=int, default=DEFAULT_PORT)
+    work.add_argument("--token", help=f"token del coordinatore (default: variabile {TOKEN_ENV})")
+    work.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    work.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "split":
+        base_name = os.path.splitext(os.path.basename(args.file))[0]
+        output_dir = args.output or os.path.join(os.path.dirname(os.path.abspath(args.file)), f"{base_name}_split")
+        manifest = write_shards(args.file, output_dir, args.parts, args.voice, args.speed, args.chars_per_second)
+        print(manifest.summary())
+        print(f"Manifest: {manifest.path}")
+    elif args.command == "serve":
+        manifest = ShardManifest.load(args.manifest)
+        output_path = args.output or os.path.join(manifest.directory, f"{manifest.base_name}.mp3")
+        coordinator = ShardCoordinator(manifest, args.host, args.port, args.token)
+        print(manifest.summary())
+        print(f"In ascolto su {coordinator.address[0]}:{coordinator.address[1]}, token: {coordinator.token}")
+        workers = launch_local_workers(args.local_workers, coordinator.address[1], coordinator.token,
+                                       args.concurrency, not args.no_cache) if not coordinator.finished else []
+        try:
+            failed = coordinator.serve()
+        finally:
+            for process in workers:
+                try:
+                    process.wait(HEARTBEAT_SECONDS)
+                except subprocess.TimeoutExpired:
+                    process.terminate()
+        if failed:
+            for index, error in sorted(failed.items()):
+                print(f"ERRORE parte {index+1}: {error}")
+            sys.exit(1)
+        seconds = coordinator.assemble(output_path)
+        print(f"Creato: {output_path} ({format_eta(seconds)} di audio)")
+    elif args.command == "work":
+        try:
+            rendered = ShardWorker(args.host, args.port, args.token, args.concurrency, not args.no_cache).run()
+        except KeyboardInterrupt:
+            return
+        print(f"{rendered} parti sintetizzate")
+
+
+if __name__ == "__main__":
+    main()
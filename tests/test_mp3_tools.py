@@ -0,0 +1,163 @@
+import io
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from fake_edge_tts import FRAME, FRAME_SECONDS
+from mp3_tools import (FrameIndex, Mp3StreamWriter, build_frame_index, concatenate, id3v2_size,
+                       index_path_for, load_frame_index, parse_frame_header, scan_mp3)
+
+# stesso formato di FRAME (MPEG-2 Layer III, 24 kHz, mono) ma a 64 kbps: 192 byte
+FRAME_64K = bytes([0xFF, 0xF3, 0x84, 0xC4]) + bytes(188)
+
+
+def write_mp3(path, frames):
+    with open(path, "wb") as f:
+        f.write(b"".join(frames))
+    return str(path)
+
+
+def read_info(data):
+    """(tipo, frame, byte, toc, lunghezza del frame) dall'header Xing/Info dopo il tag ID3v2."""
+    pos = id3v2_size(data)
+    header = parse_frame_header(data, pos)
+    tag = pos + 4 + header.side_info_size
+    flags, frames, size = struct.unpack_from(">III", data, tag + 4)
+    assert flags & 0x07 == 0x07
+    return data[tag:tag + 4], frames, size, list(data[tag + 16:tag + 116]), header.length
+
+
+def read_chapters(data):
+    """{id: (inizio_ms, fine_ms, inizio, fine)} dai frame CHAP di un tag ID3v2.3."""
+    assert data[:3] == b"ID3" and data[3] == 3
+    end = id3v2_size(data)
+    chapters = {}
+    pos = 10
+    while pos + 10 <= end and data[pos] != 0:
+        size = int.from_bytes(data[pos + 4:pos + 8], "big")
+        if data[pos:pos + 4] == b"CHAP":
+            body = data[pos + 10:pos + 10 + size]
+            element_id, rest = body.split(b"\0", 1)
+            chapters[element_id.decode("ascii")] = struct.unpack_from(">IIII", rest)
+        pos += 10 + size
+    return chapters
+
+
+@pytest.fixture
+def parts(tmp_path):
+    counts = (100, 250, 50)
+    return [write_mp3(tmp_path / f"parte{i}.mp3", [FRAME] * n) for i, n in enumerate(counts)], counts
+
+
+@pytest.mark.parametrize("index", [False, True])
+def test_concatenate_writes_info_header(tmp_path, parts, index):
+    paths, counts = parts
+    output = str(tmp_path / "libro.mp3")
+    concatenate(paths, output, index=index)
+    with open(output, "rb") as f:
+        data = f.read()
+
+    kind, frames, size, toc, info_length = read_info(data)
+    assert kind == b"Info"
+    assert frames == sum(counts)
+    assert size == len(data) - id3v2_size(data) == info_length + sum(counts) * len(FRAME)
+    assert toc == sorted(toc)
+    assert toc[0] < toc[-1] < 256
+
+
+def test_concatenate_vbr_toc(tmp_path):
+    frames = [FRAME if i % 3 else FRAME_64K for i in range(650)]
+    paths = [write_mp3(tmp_path / "a.mp3", frames[:200]), write_mp3(tmp_path / "b.mp3", frames[200:])]
+    output = str(tmp_path / "libro.mp3")
+    concatenate(paths, output, index=True)
+    with open(output, "rb") as f:
+        data = f.read()
+
+    kind, count, size, toc, info_length = read_info(data)
+    assert kind == b"Xing"
+    assert count == len(frames)
+    assert size == info_length + sum(len(frame) for frame in frames)
+    assert toc == sorted(toc)
+    # la voce i punta al frame che contiene l'istante i% (a metà di un frame per i dispari)
+    for i in range(1, 100, 2):
+        frame = len(frames) * i // 100
+        expected = (info_length + sum(len(f) for f in frames[:frame])) * 256 // size
+        assert toc[i] == expected, i
+
+
+@pytest.mark.parametrize("index", [False, True])
+def test_concatenate_chapters(tmp_path, parts, index):
+    paths, counts = parts
+    output = str(tmp_path / "libro.mp3")
+    concatenate(paths, output, chapters=["Uno", "Due", "Tre"], index=index)
+    with open(output, "rb") as f:
+        data = f.read()
+
+    chapters = read_chapters(data)
+    assert sorted(chapters) == ["ch0", "ch1", "ch2"]
+    audio_start = id3v2_size(data) + read_info(data)[4]
+    start_frame = 0
+    for i, n in enumerate(counts):
+        start_ms, end_ms, start, end = chapters[f"ch{i}"]
+        assert start_ms == round(start_frame * FRAME_SECONDS * 1000)
+        assert end_ms == round((start_frame + n) * FRAME_SECONDS * 1000)
+        assert start == audio_start + start_frame * len(FRAME)
+        assert end == audio_start + (start_frame + n) * len(FRAME)
+        assert data[start:start + 4] == FRAME[:4]
+        start_frame += n
+    assert end == len(data)
+
+
+def test_frame_index_round_trip(tmp_path, parts):
+    paths, counts = parts
+    output = str(tmp_path / "libro.mp3")
+    concatenate(paths, output, index=True)
+
+    built = build_frame_index(output)
+    loaded = FrameIndex.load(index_path_for(output), output)
+    assert loaded is not None
+    for name in ("sample_rate", "start", "size", "total_samples", "lengths", "samples", "_offsets", "_positions"):
+        assert getattr(loaded, name) == getattr(built, name), name
+    assert len(loaded) == sum(counts)
+    assert loaded.end == os.path.getsize(output)
+    assert loaded.offset(counts[0]) == loaded.start + counts[0] * len(FRAME)
+    assert loaded.frame_at(counts[0] * FRAME_SECONDS + FRAME_SECONDS / 2) == counts[0]
+
+
+def test_frame_index_stale_after_change(tmp_path):
+    path = write_mp3(tmp_path / "a.mp3", [FRAME_64K, FRAME] * 50)
+    index = load_frame_index(path)
+    assert FrameIndex.load(index_path_for(path), path).lengths == index.lengths
+    with open(path, "ab") as f:
+        f.write(FRAME)
+    assert FrameIndex.load(index_path_for(path), path) is None
+    assert len(load_frame_index(path)) == 101
+
+
+def test_stream_writer_segments(tmp_path):
+    out = io.BytesIO()
+    writer = Mp3StreamWriter(out)
+    segment = b"".join([FRAME] * 30)
+    for _ in range(2):
+        writer.begin_segment()
+        for i in range(0, len(segment), 1000):
+            writer.feed(segment[i:i + 1000])
+        writer.end_segment()
+    # un segmento interrotto a metà non lascia audio
+    writer.begin_segment()
+    writer.feed(segment[:len(segment) // 2])
+    writer.abort_segment()
+    writer.close()
+
+    data = out.getvalue()
+    kind, frames, size, toc, info_length = read_info(data)
+    assert kind == b"Info"
+    assert frames == writer.frames == 60
+    assert size == len(data) == info_length + 60 * len(FRAME)
+    assert toc == sorted(toc)
+    assert scan_mp3(write_mp3(tmp_path / "stream.mp3", [data])).frames == 60
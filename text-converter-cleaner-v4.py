@@ -1,156 +1,20 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, ttk
 import os
-import re
-import warnings
-import pdfplumber
-import PyPDF2
-import docx
-from ebooklib import epub
-from bs4 import BeautifulSoup
-
-class DocumentProcessor:
-    def __init__(self):
-        warnings.filterwarnings("ignore", category=UserWarning, module='bs4')
-
-    def extract_text(self, file_path):
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-        ext = os.path.splitext(file_path)[1].lower()
-        if ext == '.pdf':
-            return self.extract_from_pdf(file_path)
-        elif ext == '.epub':
-            return self.extract_from_epub(file_path)
-        elif ext == '.docx':
-            return self.extract_from_docx(file_path)
-        elif ext == '.txt':
-            return self.extract_from_txt(file_path)
-        else:
-            raise ValueError(f"Unsupported file format: {ext}")
-
-    def extract_from_pdf(self, file_path):
-        text = ""
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text += (page.extract_text() or "") + "\n\n"
-        except Exception:
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text += (page.extract_text() or "") + "\n\n"
-        return text.strip()
-
-    def extract_from_epub(self, file_path):
-        book = epub.read_epub(file_path)
-        text = ""
-        for item in book.get_items():
-            if item.get_type() == 9:  # ITEM_DOCUMENT
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                txt = soup.get_text(separator=' ')
-                text += re.sub(r'\s+', ' ', txt).strip() + "\n\n"
-        return text.strip()
-
-    def extract_from_docx(self, file_path):
-        doc = docx.Document(file_path)
-        return "\n".join(p.text for p in doc.paragraphs if p.text.strip())
-
-    def extract_from_txt(self, file_path):
-        encodings = ['utf-8', 'latin-1', 'cp1252']
-        for enc in encodings:
-            try:
-                with open(file_path, 'r', encoding=enc) as f:
-                    return f.read()
-            except UnicodeDecodeError:
-                continue
-        with open(file_path, 'rb') as f:
-            return f.read().decode('utf-8', errors='replace')
-
-
-class TextCleaner:
-    def clean_text(self, text):
-        text = re.sub(r'-\s*\n', '', text)
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'\n{2,}', '\n\n', text)
-        text = self._join_broken_lines(text)
-        text = self._fix_punctuation(text)
-        text = self._handle_special_chars(text)
-        text = re.sub(r' +', ' ', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        return text.strip()
-
-    def _join_broken_lines(self, text):
-        lines = text.splitlines()
-        result = []
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if not line:
-                result.append('')
-                i += 1
-                continue
-            if i == len(lines) - 1 or re.search(r'[.!?:"»]$', line):
-                result.append(line)
-            else:
-                next_line = lines[i + 1].strip()
-                if next_line and (next_line[0].islower() or next_line[0] in ',:;)]}'):
-                    result.append(f"{line} {next_line}")
-                    i += 1
-                else:
-                    result.append(line)
-            i += 1
-        return '\n'.join(result)
-
-    def _fix_punctuation(self, text):
-        text = re.sub(r'\.([»”"])', r'\1.', text)
-        text = re.sub(r'([.!?:;,])([^\s»""])(?!\d)', r'\1 \2', text)
-        text = re.sub(r'(\s)([.!?:;,])', r'\2', text)
-        text = re.sub(r'([«""])\s+', r'\1', text)
-        text = re.sub(r'\s+([»""])', r'\1', text)
-        text = re.sub(r'\.\s*\.\s*\.', '...', text)
-        return text
-
-    def _handle_special_chars(self, text):
-        text = re.sub(r'[—–]', '-', text)
-        text = re.sub(r'^[\s•\-*]+', '', text, flags=re.MULTILINE)
-        text = re.sub(r'-{2,}', '-', text)
-        return text
-
-    def join_paragraphs(self, text, min_length=40):
-        paragraphs = text.split('\n\n')
-        result = []
-        i = 0
-        while i < len(paragraphs):
-            current = paragraphs[i].strip()
-            if not current:
-                i += 1
-                continue
-            if len(current) < min_length and i < len(paragraphs) - 1:
-                is_heading = current.endswith(':') or current.isupper()
-                if not is_heading:
-                    next_para = paragraphs[i + 1].strip()
-                    if next_para:
-                        result.append(f"{current} {next_para}")
-                        i += 2
-                        continue
-            result.append(current)
-            i += 1
-        return '\n\n'.join(result)
-
-    def remove_page_numbers(self, text):
-        text = re.sub(r'^\s*\d+\s*$', '', text, flags=re.MULTILINE)
-        text = re.sub(r'^\s*Page \d+ of \d+\s*$', '', text, flags=re.MULTILINE)
-        text = re.sub(r'^\s*\d+\s*\|\s*Page\s*$', '', text, flags=re.MULTILINE)
-        return re.sub(r'\n{3,}', '\n\n', text)
-
+import threading
+from batch_cleaner import FILE_TIMEOUT, CleanerPool, CleanJob
+from metrics import RunMetrics, Throughput, format_eta
+from progress_bus import ProgressBus, ProgressPanel
 
 class TextCleanerApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Pulizia Testo da Documenti Multipli")
         self.geometry("900x600")
-        self.processor = DocumentProcessor()
-        self.cleaner = TextCleaner()
+        self.pool = None
+        # i thread del pool aggiornano la GUI solo attraverso il bus
+        self.bus = ProgressBus(self)
+        self.bus.start()
         self._build_ui()
 
     def _build_ui(self):
@@ -160,7 +24,13 @@ class TextCleanerApp(tk.Tk):
         button_frame = ttk.Frame(frame)
         button_frame.pack(fill=tk.X)
 
-        ttk.Button(button_frame, text="Carica Documenti", command=self.load_documents).pack(side=tk.LEFT, padx=5)
+        self.load_button = ttk.Button(button_frame, text="Carica Documenti", command=self.load_documents)
+        self.load_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Annulla", command=self.cancel_cleaning, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        self.progress = ProgressPanel(frame, length=600)
+        self.progress.pack(pady=2)
 
         self.text_area = scrolledtext.ScrolledText(frame, wrap=tk.WORD, font=("Segoe UI", 11))
         self.text_area.pack(fill=tk.BOTH, expand=True, pady=10)
@@ -174,34 +44,64 @@ class TextCleanerApp(tk.Tk):
             return
 
         self.text_area.delete(1.0, tk.END)
-        success = []
-        errors = []
-
-        for path in paths:
-            try:
-                text = self.processor.extract_text(path)
-                text = self.cleaner.clean_text(text)
-                text = self.cleaner.join_paragraphs(text)
-                text = self.cleaner.remove_page_numbers(text)
-
-                dir_name = os.path.dirname(path)
-                base_name = os.path.splitext(os.path.basename(path))[0]
-                cleaned_path = os.path.join(dir_name, f"{base_name}-cleaned.txt")
-                with open(cleaned_path, "w", encoding="utf-8") as f:
-                    f.write(text.strip())
-
-                success.append(os.path.basename(cleaned_path))
-            except Exception as e:
-                errors.append(f"{os.path.basename(path)}: {str(e)}")
-
-        if success:
-            self.text_area.insert(tk.END, f"Documenti puliti:\n" + "\n".join(success) + "\n\n")
-        if errors:
-            self.text_area.insert(tk.END, f"Errori:\n" + "\n".join(errors))
-
-        messagebox.showinfo("Completato", f"Elaborazione completata.\n\n"
-                                          f"Puliti: {len(success)} file\n"
-                                          f"Con errori: {len(errors)} file")
+        self.text_area.insert(tk.END, f"Pulizia di {len(paths)} documenti...\n\n")
+        self.success = 0
+        self.throughput = Throughput(len(paths))
+        self.progress.reset()
+        self.metrics = RunMetrics("pulizia", {"files": len(paths), "workers": min(len(paths), os.cpu_count() or 1),
+                                              "timeout": FILE_TIMEOUT})
+        self.pool = CleanerPool(timeout=FILE_TIMEOUT,
+                                on_done=lambda job: self.bus.call(self.document_done, job))
+        self.load_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        jobs = [CleanJob(path) for path in paths]
+
+        def run():
+            failed = self.pool.run(jobs)
+            self.bus.call(self.cleaning_finished, jobs, failed)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def document_done(self, job):
+        name = os.path.basename(job.input_path)
+        if job.done:
+            r = job.result
+            self.metrics.record_stage("estrazione", r["extraction_seconds"], file=name, chars=r["chars"],
+                                      header_chars=r["header_chars"], header_seconds=round(r["header_seconds"], 1),
+                                      cached=r["cached"])
+            self.metrics.record_stage("pulizia", r["cleaning_seconds"], file=name, chars=r["chars"])
+            self.success += 1
+            line = (f"{os.path.basename(job.output_path)} ({r['cleaned_chars']} caratteri, {job.elapsed:.1f}s"
+                    + (", dalla cache)" if r["cached"] else ")"))
+            if r["header_summary"]:
+                line += f"\n    {r['header_summary']}"
+        else:
+            self.metrics.record_stage("pulizia", job.elapsed or 0.0, file=name, error=job.error)
+            line = f"Errore - {name}: {job.error}"
+        self.text_area.insert(tk.END, line + "\n")
+        self.text_area.see(tk.END)
+        self.throughput.update(self.throughput.done + 1)
+        self.progress.show(self.throughput.fraction,
+                           f"Documenti {self.throughput.done}/{self.throughput.total} - "
+                           f"{self.throughput.rate * 60:.1f} al minuto - ETA {format_eta(self.throughput.eta)}")
+
+    def cancel_cleaning(self):
+        if self.pool is not None:
+            self.pool.cancel()
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def cleaning_finished(self, jobs, failed):
+        cancelled = self.pool.cancelled
+        self.pool = None
+        self.metrics.close(failed=len(failed), cancelled=cancelled)
+        self.load_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        skipped = sum(1 for job in failed if job.error == "annullato")
+        message = f"Puliti: {self.success} file\nCon errori: {len(failed) - skipped} file"
+        if cancelled:
+            messagebox.showinfo("Annullato", f"Elaborazione annullata.\n\n{message}\nAnnullati: {skipped} file")
+        else:
+            messagebox.showinfo("Completato", f"Elaborazione completata.\n\n{message}")
 
 if __name__ == "__main__":
     TextCleanerApp().mainloop()
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from chunk_cache import CacheDirectory, cache_main, file_hash
+
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+# sottocartella con l'impronta (hash, dimensione, mtime) di ogni documento già letto
+FINGERPRINTS_DIR = "files"
+
+
+class TextCache(CacheDirectory):
+    """Cache su disco dei testi estratti dai documenti e di quelli già puliti.
+
+    Una voce è indirizzata per hash del contenuto del documento, tipo di testo e impostazioni
+    (versione dell'estrattore, del filtro delle intestazioni, della pulizia): rinominare o
+    spostare un libro non la invalida, cambiarne il contenuto o le impostazioni sì. L'hash
+    di un documento viene ricalcolato solo se ne cambiano dimensione o mtime.
+
+    Ogni voce è un file JSON lines: una riga di informazioni, poi una riga per pezzo di testo
+    (pagina, capitolo...), che si può rileggere a pezzi come l'estrattore. Come per la
+    ChunkCache la recency LRU è la mtime dei file e prune() elimina i più vecchi. Si può usare
+    da più thread e processi: ogni file viene sostituito per intero.
+    """
+
+    SUFFIX = ".jsonl"
+    NAME = "texts"
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        os.makedirs(os.path.join(self.directory, FINGERPRINTS_DIR), exist_ok=True)
+
+    def fingerprint(self, path):
+        """sha256 del contenuto di path, ripreso dall'impronta salvata se il file non è cambiato."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        record_path = os.path.join(self.directory, FINGERPRINTS_DIR,
+                                   hashlib.sha256(path.encode("utf-8")).hexdigest()[:40] + ".json")
+        try:
+            with open(record_path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if record["size"] == st.st_size and record["mtime_ns"] == st.st_mtime_ns:
+                # per prune(max_age): impronta di un documento ancora in uso
+                os.utime(record_path)
+                return record["sha256"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        sha256 = file_hash(path)
+        self._write(record_path, json.dumps({"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                             "sha256": sha256}))
+        return sha256
+
+    def key(self, path, kind, **settings):
+        """Chiave del testo di tipo kind (es. "estratto", "pulito") di path con queste impostazioni."""
+        fields = {"sha256": self.fingerprint(path), "format": os.path.splitext(path)[1].lower(),
+                  "kind": kind, "settings": settings}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """(info, pezzi) della voce, None se non c'è; i pezzi vengono letti man mano."""
+        path = self.path_for(key)
+        try:
+            f = open(path, "r", encoding="utf-8")
+        except OSError:
+            return None
+        try:
+            info = json.loads(f.readline())
+        except ValueError:
+            f.close()
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        def pieces():
+            with f:
+                for line in f:
+                    yield json.loads(line)
+
+        return info, pieces()
+
+    def get_text(self, key):
+        """(testo, info) della voce, None se non c'è."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        info, pieces = entry
+        try:
+            return "".join(pieces), info
+        except ValueError:
+            self._remove(self.path_for(key))
+            return None
+
+    def store(self, key, pieces, **info):
+        """Restituisce i pezzi di pieces man mano che arrivano e intanto li salva sotto key.
+
+        La voce viene registrata solo se pieces arriva alla fine: un documento letto a metà
+        (errore, lettura interrotta) non resta in cache. Un errore di scrittura della cache
+        non interrompe la lettura.
+        """
+        f = tmp_path = None
+        try:
+            try:
+                tmp_path = self.reserve(key)
+                f = open(tmp_path, "w", encoding="utf-8")
+                f.write(json.dumps(info, ensure_ascii=False) + "\n")
+            except OSError:
+                f = self._discard(f, tmp_path)
+            for piece in pieces:
+                if f is not None:
+                    try:
+                        f.write(json.dumps(piece, ensure_ascii=False) + "\n")
+                    except OSError:
+                        f = self._discard(f, tmp_path)
+                yield piece
+            if f is not None:
+                try:
+                    f.close()
+                    os.replace(tmp_path, self.path_for(key))
+                except OSError:
+                    self._remove(tmp_path)
+                f = None
+        finally:
+            self._discard(f, tmp_path)
+
+    def put_text(self, key, text, **info):
+        for _ in self.store(key, [text], **info):
+            pass
+
+    def _discard(self, f, tmp_path):
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+            self._remove(tmp_path)
+        return None
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove(tmp_path)
+
+    def prune(self, max_bytes=None, max_age=None):
+        """Come CacheDirectory.prune; con max_age elimina anche le impronte dei documenti non
+        più letti da allora."""
+        result = super().prune(max_bytes, max_age)
+        if max_age is not None:
+            self._remove_fingerprints(time.time() - max_age)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._remove_fingerprints()
+        return result
+
+    def _remove_fingerprints(self, cutoff=None):
+        for entry in os.scandir(os.path.join(self.directory, FINGERPRINTS_DIR)):
+            if cutoff is None or entry.stat().st_mtime < cutoff:
+                self._remove(entry.path)
+
+
+def main(argv=None):
+    cache_main(TextCache, "Ispeziona e pulisce la cache dei testi estratti e puliti.", argv, DEFAULT_MAX_BYTES)
+
+
+if __name__ == "__main__":
+    main()
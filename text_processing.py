@@ -0,0 +1,379 @@
+import importlib
+import os
+import re
+import threading
+import time
+import warnings
+from collections import Counter, deque
+
+# moduli degli estrattori per estensione: vengono importati solo quando servono
+EXTRACTOR_MODULES = {'.pdf': 'pdf_extractor', '.epub': 'ebook_extractor', '.docx': 'ebook_extractor'}
+# da aumentare quando cambia il testo estratto da PDF, EPUB o DOCX: invalida la cache dei testi
+EXTRACTOR_VERSION = 2
+# caratteri letti alla volta dai file di testo
+TEXT_BLOCK_SIZE = 1024 * 1024
+# caratteri letti al secondo dalla sintesi a velocità 1.0, se non ci sono misure per la voce
+SPEECH_CHARS_PER_SECOND = 15.0
+
+
+def preload_extractors(paths):
+    """Importa in background gli estrattori per i file selezionati, prima che servano."""
+    modules = {EXTRACTOR_MODULES.get(os.path.splitext(p)[1].lower()) for p in paths} - {None}
+
+    def load():
+        for module in sorted(modules):
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                # l'errore verrà mostrato quando il file viene davvero letto
+                pass
+
+    if modules:
+        threading.Thread(target=load, daemon=True).start()
+
+
+_DIGITS_RE = re.compile(r'\d+')
+
+
+class RunningHeaderFilter:
+    """Toglie dalle pagine di un PDF le intestazioni e i piè di pagina ripetuti: titolo,
+    autore, capitolo corrente, numeri di pagina.
+
+    Di ogni pagina si guardano solo le prime e le ultime edge_lines righe non vuote (meno
+    nelle pagine brevi, così che ne resti almeno una nel mezzo). Una
+    riga è ripetuta se lo stesso testo, in cima o in fondo, compare in almeno min_repeats
+    pagine entro window pagine prima o dopo; la prima pagina di una serie la tiene (può
+    essere il titolo del capitolo). Le righe che differiscono solo per i numeri (numeri di
+    pagina) si tolgono se compaiono in gran parte delle pagine vicine. Le pagine passano
+    una volta sola e in memoria ce ne sono al più 2 * window + 1.
+    """
+
+    # frazione delle pagine vicine in cui deve comparire una riga numerata
+    NUMBERED_DENSITY = 0.4
+
+    def __init__(self, window=8, min_repeats=3, edge_lines=2):
+        self.window = window
+        self.min_repeats = min_repeats
+        self.edge_lines = edge_lines
+        self.pages = 0
+        self.removed_lines = 0
+        self.removed_chars = 0
+
+    def settings(self):
+        """Parametri che decidono cosa viene tolto (per la cache dei testi puliti)."""
+        return {"window": self.window, "min_repeats": self.min_repeats, "edge_lines": self.edge_lines,
+                "numbered_density": self.NUMBERED_DENSITY}
+
+    def counts(self):
+        return {"pages": self.pages, "removed_lines": self.removed_lines, "removed_chars": self.removed_chars}
+
+    def restore(self, counts):
+        """Riprende i conteggi di una lettura precedente dello stesso documento (testo dalla cache)."""
+        self.pages = counts["pages"]
+        self.removed_lines = counts["removed_lines"]
+        self.removed_chars = counts["removed_chars"]
+
+    @property
+    def saved_seconds(self):
+        """Secondi di audio stimati per il testo tolto."""
+        return self.removed_chars / SPEECH_CHARS_PER_SECOND
+
+    def summary(self):
+        return (f"{self.removed_lines} righe ripetute tolte da {self.pages} pagine: {self.removed_chars} caratteri, "
+                f"circa {self.saved_seconds / 60:.0f} minuti di audio")
+
+    def _edges(self, page):
+        lines = page.split('\n')
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        # almeno una riga in mezzo resta sempre: le pagine brevi non sono fatte solo di intestazioni
+        edge = min(self.edge_lines, (len(filled) - 1) // 2)
+        edges = {}
+        if not edge:
+            return lines, edges
+        for side, indexes in (('fondo', filled[-edge:]), ('cima', filled[:edge])):
+            for i in indexes:
+                text = ' '.join(lines[i].split())
+                edges[i] = ((side, text), (side, _DIGITS_RE.sub('#', text)))
+        return lines, edges
+
+    def filter(self, pages):
+        """Restituisce le pagine senza le righe ripetute, nello stesso ordine."""
+        past = deque()
+        ahead = deque()
+        past_counts = Counter()
+        counts = Counter()
+
+        def count(keys, counter, step):
+            for key in keys:
+                counter[key] += step
+                if not counter[key]:
+                    del counter[key]
+
+        def emit():
+            lines, edges = ahead.popleft()
+            keys = {key for pair in edges.values() for key in pair}
+            nearby = len(past) + len(ahead) + 1
+            drop = set()
+            for i, (exact, numbered) in edges.items():
+                if counts[exact] >= self.min_repeats and past_counts[exact]:
+                    drop.add(i)
+                elif (numbered != exact and counts[exact] == 1 and counts[numbered] >= self.min_repeats
+                      and counts[numbered] >= self.NUMBERED_DENSITY * nearby):
+                    drop.add(i)
+            for i in drop:
+                self.removed_lines += 1
+                self.removed_chars += len(lines[i].strip())
+            past.append(keys)
+            count(keys, past_counts, 1)
+            if len(past) > self.window:
+                old = past.popleft()
+                count(old, past_counts, -1)
+                count(old, counts, -1)
+            if not drop:
+                return '\n'.join(lines)
+            return '\n'.join(line for i, line in enumerate(lines) if i not in drop)
+
+        for page in pages:
+            self.pages += 1
+            lines, edges = self._edges(page)
+            count({key for pair in edges.values() for key in pair}, counts, 1)
+            ahead.append((lines, edges))
+            if len(ahead) > self.window:
+                yield emit()
+        while ahead:
+            yield emit()
+
+
+def iter_source_pieces(file_path, pdf_workers=None, cache=None, stream=True):
+    """Testo di un PDF, EPUB o DOCX come esce dall'estrattore: pagine del PDF (intestazioni
+    comprese), documenti dell'EPUB, paragrafi non vuoti del DOCX.
+
+    Con stream le pagine dei PDF arrivano appena lette, altrimenti tutte insieme (estrazione
+    più veloce). Con cache (un TextCache) un documento già letto non viene riaperto: i pezzi
+    arrivano dalla cache; altrimenti vengono salvati man mano.
+    """
+    if cache is not None:
+        key = cache.key(file_path, "estratto", extractor=EXTRACTOR_VERSION)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[1]
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.pdf':
+        from pdf_extractor import extract_pdf_pages, iter_pdf_pages
+        pieces = iter_pdf_pages(file_path, pdf_workers) if stream else extract_pdf_pages(file_path, pdf_workers)
+    elif ext == '.epub':
+        from ebook_extractor import iter_epub_texts
+        pieces = iter_epub_texts(file_path)
+    elif ext == '.docx':
+        from ebook_extractor import iter_docx_paragraphs
+        pieces = (p for p in iter_docx_paragraphs(file_path) if p.strip())
+    else:
+        raise ValueError(f"Unsupported file format: {ext}")
+    if cache is not None:
+        pieces = cache.store(key, pieces, source=os.path.abspath(file_path))
+    return pieces
+
+
+def iter_book_text(file_path, pdf_workers=None, header_filter=None, cache=None):
+    """Testo di un libro da sintetizzare, a pezzi: pagine del PDF, documenti dell'EPUB,
+    paragrafi del DOCX (ognuno seguito da "\\n") o blocchi di un file di testo UTF-8.
+
+    I pezzi vengono letti solo quando richiesti; uniti danno il testo completo del libro.
+    Dalle pagine dei PDF si tolgono intestazioni e piè di pagina ripetuti; con header_filter
+    (un RunningHeaderFilter) si può poi sapere quanto testo è stato tolto. Con cache (un
+    TextCache) PDF, EPUB e DOCX già letti non vengono riaperti.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in EXTRACTOR_MODULES:
+        pieces = iter_source_pieces(file_path, pdf_workers, cache)
+        if ext == '.pdf':
+            pieces = (header_filter or RunningHeaderFilter()).filter(pieces)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield from iter(lambda: f.read(TEXT_BLOCK_SIZE), '')
+        return
+    for piece in pieces:
+        yield piece + "\n"
+
+
+class DocumentProcessor:
+    def __init__(self, pdf_workers=None, strip_headers=True, cache=None):
+        # processi usati per estrarre i PDF (None = uno per core)
+        self.pdf_workers = pdf_workers
+        # togliere dai PDF intestazioni e piè di pagina ripetuti su ogni pagina
+        self.strip_headers = strip_headers
+        # TextCache dei testi estratti e puliti (None = ogni documento viene riletto)
+        self.cache = cache
+        warnings.filterwarnings("ignore", category=UserWarning, module='bs4')
+
+    def extract_text(self, file_path, header_filter=None):
+        """Testo del documento; header_filter (RunningHeaderFilter) raccoglie quanto è stato
+        tolto dalle pagine dei PDF."""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext == '.pdf':
+            return self.extract_from_pdf(file_path, header_filter)
+        elif ext == '.epub':
+            return self.extract_from_epub(file_path)
+        elif ext == '.docx':
+            return self.extract_from_docx(file_path)
+        elif ext == '.txt':
+            return self.extract_from_txt(file_path)
+        else:
+            raise ValueError(f"Unsupported file format: {ext}")
+
+    def extract_clean_text(self, file_path, cleaner, header_filter=None):
+        """Testo del documento pulito con cleaner.clean_book, e le misure {"chars" (estratti),
+        "extraction_seconds", "cleaning_seconds", "cached"}.
+
+        Con la cache un documento già pulito con le stesse impostazioni (estrattore, filtro
+        delle intestazioni, versione di TextCleaner) non viene né letto né ripulito;
+        header_filter riceve comunque i conteggi della prima lettura.
+        """
+        header_filter = header_filter or RunningHeaderFilter()
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(file_path, "pulito", extractor=EXTRACTOR_VERSION, cleaner=cleaner.VERSION,
+                                 headers=header_filter.settings() if self.strip_headers else None)
+            cached = self.cache.get_text(key)
+            if cached is not None:
+                text, info = cached
+                header_filter.restore(info["headers"])
+                return text, {"chars": info["chars"], "extraction_seconds": time.perf_counter() - start,
+                              "cleaning_seconds": 0.0, "cached": True}
+        text = self.extract_text(file_path, header_filter)
+        extraction = time.perf_counter() - start
+        chars = len(text)
+        start = time.perf_counter()
+        text = cleaner.clean_book(text)
+        cleaning = time.perf_counter() - start
+        if key is not None:
+            self.cache.put_text(key, text, source=os.path.abspath(file_path), chars=chars,
+                                headers=header_filter.counts())
+        return text, {"chars": chars, "extraction_seconds": extraction, "cleaning_seconds": cleaning,
+                      "cached": False}
+
+    def extract_from_pdf(self, file_path, header_filter=None):
+        pages = iter_source_pieces(file_path, self.pdf_workers, self.cache, stream=False)
+        if self.strip_headers:
+            pages = (header_filter or RunningHeaderFilter()).filter(pages)
+        return "\n\n".join(pages).strip()
+
+    def extract_from_epub(self, file_path):
+        return "\n\n".join(iter_source_pieces(file_path, cache=self.cache)).strip()
+
+    def extract_from_docx(self, file_path):
+        return "\n".join(iter_source_pieces(file_path, cache=self.cache))
+
+    def extract_from_txt(self, file_path):
+        encodings = ['utf-8', 'latin-1', 'cp1252']
+        for enc in encodings:
+            try:
+                with open(file_path, 'r', encoding=enc) as f:
+                    return f.read()
+            except UnicodeDecodeError:
+                continue
+        with open(file_path, 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+
+
+def _char_ranges(predicate, limit=0x10000):
+    ranges = []
+    start = None
+    for cp in range(limit + 1):
+        if cp < limit and predicate(chr(cp)):
+            if start is None:
+                start = cp
+        elif start is not None:
+            ranges.append(chr(start) if cp - 1 == start else f"{chr(start)}-{chr(cp - 1)}")
+            start = None
+    return ''.join(ranges)
+
+
+_LOWER = _char_ranges(str.islower)
+
+# I pattern iniziano tutti con un carattere raro ('\n', '-', '.') così la ricerca
+# salta il resto del testo; gli spazi vengono normalizzati riga per riga in C.
+_HYPHEN_BREAK_RE = re.compile(r'-\n(?!\n)')
+_PAGE_NUMBER_RE = re.compile(r'\n[ \t]*(?:\d+|Page \d+ of \d+|\d+[ \t]*\|[ \t]*Page)[ \t]*(?=\n|\Z)')
+_BROKEN_LINE_RE = re.compile(rf'\n(?<=[^.!?:"»\n]\n)(?=[{_LOWER},:;)\]}}])')
+_PERIOD_QUOTE_RE = re.compile(r'\.([»”"])')
+_SPACE_AFTER_PUNCT_RE = re.compile(r'([.!?:;,])([^\s»"])(?!\d)')
+_ELLIPSIS_RE = re.compile(r'\. ?\. ?\.')
+_BULLETS_RE = re.compile(r'\n[•*-][ •*-]*')
+_DASH_RUN_RE = re.compile(r'--+')
+# '\n\n\n+' e non '\n{3,}': con il prefisso letterale la ricerca è molto più veloce
+_BLANK_LINES_RE = re.compile(r'\n\n\n+')
+_SPACE_BEFORE_RE = re.compile(r' (?=[.!?:;,»"])')
+
+
+class TextCleaner:
+    """Pulizia del testo in pochi passaggi con pattern precompilati.
+
+    Righe e paragrafi (righe vuote) vengono mantenuti: le righe spezzate vengono
+    unite solo quando la riga successiva continua la frase.
+    """
+
+    # da aumentare quando cambia il testo prodotto: invalida i testi puliti nella cache
+    VERSION = 1
+
+    def clean_book(self, text):
+        """Tutti i passaggi, come li usano la pulizia dei documenti e la pipeline."""
+        text = self.clean_text(text)
+        text = self.join_paragraphs(text)
+        return self.remove_page_numbers(text).strip()
+
+    def clean_text(self, text):
+        # spazi multipli, tab, \r e spazi ai bordi delle righe in un solo passaggio
+        text = '\n'.join([' '.join(line.split()) for line in text.split('\n')])
+        text = _HYPHEN_BREAK_RE.sub('', text)
+        # i numeri di pagina isolati impedirebbero di unire le righe spezzate
+        text = _PAGE_NUMBER_RE.sub('', '\n' + text)
+        text = _BLANK_LINES_RE.sub('\n\n', text)
+        text = self._join_broken_lines(text)
+        text = self._fix_punctuation(text)
+        text = self._handle_special_chars(text)
+        text = _BLANK_LINES_RE.sub('\n\n', text)
+        return text.strip()
+
+    def _join_broken_lines(self, text):
+        return _BROKEN_LINE_RE.sub(' ', text)
+
+    def _fix_punctuation(self, text):
+        text = _PERIOD_QUOTE_RE.sub(r'\1.', text)
+        text = _SPACE_AFTER_PUNCT_RE.sub(r'\1 \2', text)
+        text = _SPACE_BEFORE_RE.sub('', text)
+        text = text.replace('« ', '«').replace('" ', '"')
+        return _ELLIPSIS_RE.sub('...', text)
+
+    def _handle_special_chars(self, text):
+        text = text.replace('—', '-').replace('–', '-')
+        text = _BULLETS_RE.sub('\n', '\n' + text)
+        return _DASH_RUN_RE.sub('-', text)[1:]
+
+    def join_paragraphs(self, text, min_length=40):
+        paragraphs = text.split('\n\n')
+        result = []
+        i = 0
+        while i < len(paragraphs):
+            current = paragraphs[i].strip()
+            if not current:
+                i += 1
+                continue
+            if len(current) < min_length and i < len(paragraphs) - 1:
+                is_heading = current.endswith(':') or current.isupper()
+                if not is_heading:
+                    next_para = paragraphs[i + 1].strip()
+                    if next_para:
+                        result.append(f"{current} {next_para}")
+                        i += 2
+                        continue
+            result.append(current)
+            i += 1
+        return '\n\n'.join(result)
+
+    def remove_page_numbers(self, text):
+        text = _PAGE_NUMBER_RE.sub('\n', '\n' + text)[1:]
+        return _BLANK_LINES_RE.sub('\n\n', text)
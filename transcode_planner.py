@@ -0,0 +1,223 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from chunk_cache import file_hash
+from metrics import default_metrics_dir, format_eta, load_run
+from mp3_tools import probe_mp3
+
+MANIFEST_NAME = ".compressione.json"
+# secondi di audio ricodificati da un processo ffmpeg per secondo, se non ci sono misure
+DEFAULT_ENCODE_SPEED = 60.0
+# byte al secondo per le copie senza ricodifica
+COPY_SPEED = 200 * 1024 ** 2
+# esecuzioni precedenti del compressore usate per stimare la velocità di ffmpeg
+SPEED_HISTORY = 20
+
+SKIP = "salta"
+COPY = "copia"
+TRANSCODE = "ricodifica"
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class TranscodeManifest:
+    """Registro dei file prodotti in una cartella di output, per non rifarli.
+
+    Per ogni output salva hash, dimensione e mtime dell'input, il bitrate richiesto e
+    dimensione e mtime dell'output. Se l'input ha ancora la stessa dimensione e mtime
+    l'hash non viene ricalcolato. Si può aggiornare da più thread.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)["files"]
+            if isinstance(entries, dict):
+                self.entries = entries
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def input_hash(self, input_path, entry=None):
+        """Hash dell'input, ripreso da entry se l'input non è cambiato."""
+        size, mtime = _stat(input_path)
+        if entry and entry.get("input_size") == size and entry.get("input_mtime_ns") == mtime:
+            return entry["sha256"]
+        return file_hash(input_path)
+
+    def is_current(self, input_path, output_path, bitrate):
+        """True se output_path è stato prodotto da questo stesso input con questo bitrate."""
+        with self._lock:
+            entry = self.entries.get(os.path.basename(output_path))
+        if not entry or entry.get("bitrate") != bitrate:
+            return False
+        try:
+            if _stat(output_path) != (entry.get("output_size"), entry.get("output_mtime_ns")):
+                return False
+            return self.input_hash(input_path, entry) == entry.get("sha256")
+        except OSError:
+            return False
+
+    def record(self, input_path, output_path, bitrate, action, sha256=None):
+        input_size, input_mtime = _stat(input_path)
+        output_size, output_mtime = _stat(output_path)
+        entry = {"input": os.path.abspath(input_path), "sha256": sha256 or file_hash(input_path),
+                 "input_size": input_size, "input_mtime_ns": input_mtime, "bitrate": bitrate,
+                 "action": action, "output_size": output_size, "output_mtime_ns": output_mtime}
+        with self._lock:
+            self.entries[os.path.basename(output_path)] = entry
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {"files": dict(self.entries)}
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class PlannedFile:
+    def __init__(self, input_path, output_path, action, reason, probe=None):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.action = action
+        self.reason = reason
+        # Mp3Probe dell'input, None se non è stato possibile leggerlo
+        self.probe = probe
+
+    @property
+    def seconds(self):
+        return self.probe.seconds if self.probe else 0.0
+
+
+class TranscodePlan:
+    """Cosa fare per ogni file: saltarlo, copiarlo così com'è o ricodificarlo con ffmpeg."""
+
+    def __init__(self, items, bitrate):
+        self.items = items
+        self.bitrate = bitrate
+
+    def by_action(self, action):
+        return [item for item in self.items if item.action == action]
+
+    def seconds(self, action):
+        return sum(item.seconds for item in self.by_action(action))
+
+    def estimate(self, workers, speed=DEFAULT_ENCODE_SPEED):
+        """Secondi stimati per eseguire il piano con workers processi ffmpeg."""
+        transcode = [item.seconds for item in self.by_action(TRANSCODE)]
+        # nessun file può finire prima della propria ricodifica, anche con molti processi
+        encode = max(sum(transcode) / max(1, min(workers, len(transcode) or 1)), max(transcode, default=0.0))
+        copy_bytes = 0
+        for item in self.by_action(COPY):
+            try:
+                copy_bytes += os.path.getsize(item.input_path)
+            except OSError:
+                pass
+        return encode / speed + copy_bytes / COPY_SPEED
+
+    def summary(self, workers, speed=DEFAULT_ENCODE_SPEED):
+        lines = []
+        for action, label in ((TRANSCODE, "da ricodificare"), (COPY, "da copiare (già entro il bitrate)"),
+                              (SKIP, "già aggiornati")):
+            items = self.by_action(action)
+            if items:
+                lines.append(f"{len(items)} file {label}, {format_eta(self.seconds(action))} di audio")
+        lines.append(f"Tempo stimato: {format_eta(self.estimate(workers, speed))}")
+        return "\n".join(lines)
+
+
+def plan_transcodes(input_paths, output_dir, bitrate, manifest=None):
+    """Decide per ogni MP3 se serve ffmpeg, leggendo solo gli header (nessun processo avviato).
+
+    bitrate è in kbps. Un input già entro il bitrate viene copiato (o lasciato dov'è se
+    l'output coincide), un output già prodotto dallo stesso input e bitrate viene saltato.
+    """
+    manifest = manifest or TranscodeManifest(output_dir)
+    items = []
+    for input_path in input_paths:
+        output_path = os.path.join(output_dir, os.path.basename(input_path))
+        try:
+            probe = probe_mp3(input_path)
+        except (OSError, ValueError):
+            # ffmpeg potrebbe comunque riuscire a leggerlo
+            if manifest.is_current(input_path, output_path, bitrate):
+                items.append(PlannedFile(input_path, output_path, SKIP, "già compresso"))
+            else:
+                items.append(PlannedFile(input_path, output_path, TRANSCODE, "formato non riconosciuto"))
+            continue
+        same = os.path.abspath(input_path) == os.path.abspath(output_path)
+        if probe.kbps <= bitrate + 0.5:
+            if same:
+                items.append(PlannedFile(input_path, output_path, SKIP, "già entro il bitrate", probe))
+            elif manifest.is_current(input_path, output_path, bitrate):
+                items.append(PlannedFile(input_path, output_path, SKIP, "copia già aggiornata", probe))
+            else:
+                items.append(PlannedFile(input_path, output_path, COPY, f"{probe.kbps:.0f} kbps", probe))
+        elif not same and manifest.is_current(input_path, output_path, bitrate):
+            items.append(PlannedFile(input_path, output_path, SKIP, "già compresso", probe))
+        else:
+            items.append(PlannedFile(input_path, output_path, TRANSCODE,
+                                     f"{probe.kbps:.0f} -> {bitrate} kbps", probe))
+    return TranscodePlan(items, bitrate)
+
+
+def copy_planned(item, bitrate, manifest):
+    """Esegue un elemento COPY (copia lato kernel dove possibile) e lo registra nel manifest."""
+    sha256 = manifest.input_hash(item.input_path)
+    shutil.copyfile(item.input_path, item.output_path)
+    manifest.record(item.input_path, item.output_path, bitrate, COPY, sha256)
+
+
+def encode_speed(directory=None, history=SPEED_HISTORY):
+    """Velocità media di ffmpeg (secondi di audio per secondo, per processo) nelle ultime
+    esecuzioni del compressore; DEFAULT_ENCODE_SPEED se non ce ne sono."""
+    files = sorted(glob.glob(os.path.join(directory or default_metrics_dir(), "compressore-*.jsonl")))
+    audio = seconds = 0.0
+    for path in files[-history:]:
+        try:
+            _, _, records = load_run(path)
+        except (OSError, ValueError):
+            continue
+        for r in records:
+            if r.get("stage") == "compressione" and r.get("ok") and r.get("audio_seconds") and r.get("seconds"):
+                audio += r["audio_seconds"]
+                seconds += r["seconds"]
+    return audio / seconds if audio and seconds else DEFAULT_ENCODE_SPEED
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mostra cosa farebbe il compressore MP3, senza avviare ffmpeg.")
+    parser.add_argument("files", nargs="+", help="file MP3 da comprimere")
+    parser.add_argument("-o", "--output", required=True, help="cartella di output")
+    parser.add_argument("--bitrate", type=int, default=32, help="bitrate in kbps")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processi ffmpeg in parallelo")
+    args = parser.parse_args(argv)
+
+    plan = plan_transcodes(args.files, args.output, args.bitrate)
+    for item in plan.items:
+        print(f"{item.action:10s} {os.path.basename(item.input_path)}  ({item.reason})")
+    print(plan.summary(args.workers, encode_speed()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+from chunk_planner import DEFAULT_MAX_BYTES, plan_chunks
+from mp3_tools import Mp3StreamWriter
+from rate_control import AdaptiveLimiter, RetryPolicy
+
+DEFAULT_CONCURRENCY = 8
+STREAM_READ_SIZE = 256 * 1024
+# tempo massimo per un singolo tentativo di sintesi di un chunk
+DEFAULT_REQUEST_TIMEOUT = 120
+
+
+def split_text_into_chunks(text, max_bytes=DEFAULT_MAX_BYTES):
+    return plan_chunks(text, max_bytes).chunks()
+
+
+def speed_to_rate(speed):
+    # edge_tts vuole la velocità come variazione percentuale ("+25%", "-50%")
+    percent = round((float(speed) - 1.0) * 100)
+    return f"{percent:+d}%"
+
+
+class SynthesisError(Exception):
+    def __init__(self, index, error, completed, failures=None):
+        super().__init__(f"Chunk {index} failed: {error}")
+        self.index = index
+        self.error = error
+        self.completed = completed
+        # tutti i chunk falliti dopo i tentativi: {indice: errore}
+        self.failures = failures or {index: error}
+
+
+_END = object()
+# chunk letti insieme da un iteratore a ogni passaggio nel thread
+FEED_BATCH = 8
+
+
+class _ChunkFeed:
+    """Consegna ai worker i chunk in ordine, con il loro indice.
+
+    Da una lista li prende direttamente; da un iteratore (es. una ChunkStream che sta
+    ancora estraendo il libro) li legge in un thread, pochi alla volta e solo quando un
+    worker è libero: il loop non si blocca e in memoria restano solo i chunk in lavorazione.
+    Un errore dell'iteratore ferma la consegna e resta in error; total è None finché
+    l'iteratore non è finito.
+    """
+
+    def __init__(self, items, total=None):
+        if total is None and isinstance(items, (list, tuple)):
+            total = len(items)
+        self.total = total
+        self.count = 0
+        self.error = None
+        self._items = iter(items)
+        self._threaded = self.total is None
+        self._ready = deque()
+        self._lock = asyncio.Lock()
+        self._done = False
+
+    def _take(self, count):
+        batch = []
+        try:
+            for item in itertools.islice(self._items, count):
+                batch.append(item)
+        except Exception as e:
+            self.error = e
+        if len(batch) < count:
+            batch.append(_END)
+        return batch
+
+    async def next(self):
+        """(indice, chunk) del prossimo chunk, None quando sono finiti."""
+        async with self._lock:
+            if not self._ready and not self._done:
+                if self._threaded:
+                    self._ready.extend(await asyncio.to_thread(self._take, FEED_BATCH))
+                else:
+                    self._ready.extend(self._take(1))
+            item = self._ready.popleft() if self._ready else _END
+            if item is _END:
+                self._done = True
+                self.total = self.count
+                return None
+            self.count += 1
+            return self.count - 1, item
+
+
+class SynthesisEngine:
+    """Sintetizza i chunk su un unico event loop, con al massimo `concurrency` richieste in volo.
+
+    Le richieste in volo effettive sono decise da un AdaptiveLimiter (calano con errori e
+    timeout, risalgono con i successi); ogni chunk viene ritentato secondo la RetryPolicy.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, cache=None, retry=None,
+                 request_timeout=DEFAULT_REQUEST_TIMEOUT, metrics=None, communicate=None):
+        self.limiter = AdaptiveLimiter(concurrency)
+        self.concurrency = concurrency
+        self.cache = cache
+        self.retry = retry or RetryPolicy()
+        self.request_timeout = request_timeout
+        # RunMetrics (o None): riceve latenza, caratteri e byte di ogni richiesta
+        self.metrics = metrics
+        # factory(text, voice, rate=...) compatibile con edge_tts.Communicate (es. un finto servizio
+        # per i benchmark); None = edge_tts
+        self.communicate = communicate
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, value):
+        self._concurrency = value
+        self.limiter.set_max(value)
+
+    def stats(self):
+        """Richieste in parallelo attuali, errori, timeout e tentativi ripetuti."""
+        return self.limiter.stats()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    def synthesize(self, chunks, output_paths, voice, speed, progress=None):
+        """Crea un mp3 per ogni chunk; progress(index, completed, total) per ogni chunk finito.
+
+        Un chunk che fallisce anche dopo i tentativi non ferma gli altri: alla fine si
+        solleva SynthesisError con tutti i chunk falliti. Con una ChunkCache i chunk già sintetizzati con la stessa voce e velocità
+        vengono ripresi dalla cache senza chiamare il servizio.
+
+        chunks e output_paths possono essere anche iteratori (es. una ChunkStream), letti man
+        mano: in quel caso total è None finché non sono finiti. Restituisce i file creati in ordine.
+        """
+        return self.run(self._synthesize(chunks, output_paths, voice, speed_to_rate(speed), progress))
+
+    async def _synthesize(self, chunks, output_paths, voice, rate, progress):
+        feed = _ChunkFeed(zip(chunks, output_paths),
+                          len(chunks) if isinstance(chunks, (list, tuple)) else None)
+        paths = {}
+        completed = set()
+        failure = []
+
+        async def worker():
+            while True:
+                item = await feed.next()
+                if item is None:
+                    return
+                i, (text, output_path) = item
+                paths[i] = output_path
+                try:
+                    await self._produce_chunk(text, output_path, voice, rate)
+                except Exception as e:
+                    failure.append((i, e))
+                    continue
+                completed.add(i)
+                if progress:
+                    progress(i, len(completed), feed.total)
+
+        await asyncio.gather(*[asyncio.ensure_future(worker()) for _ in range(self._worker_count(feed))])
+        if feed.error is not None:
+            raise feed.error
+        if failure:
+            index, error = min(failure, key=lambda f: f[0])
+            raise SynthesisError(index, error, completed, dict(failure))
+        return [paths[i] for i in range(feed.count)]
+
+    def _worker_count(self, feed):
+        if feed.total is None:
+            return max(1, self.concurrency)
+        return max(1, min(self.concurrency, feed.total))
+
+    def synthesize_to_file(self, chunks, output_path, voice, speed, progress=None):
+        """Come synthesize, ma scrive l'audio di tutti i chunk direttamente in output_path.
+
+        Il chunk in testa viene scritto mentre arriva; quelli completati fuori ordine
+        restano in un buffer di riordino limitato a `concurrency` chunk. Se un chunk fallisce
+        anche dopo i tentativi il file contiene i chunk consecutivi completati prima di esso.
+        """
+        with open(output_path, "wb") as f:
+            self.synthesize_to_stream(chunks, f, voice, speed, progress)
+        return output_path
+
+    def synthesize_to_stream(self, chunks, fileobj, voice, speed, progress=None):
+        """Come synthesize_to_file, ma scrive in un file object (anche non seekable, es. stdin di ffmpeg).
+
+        Restituisce i secondi di audio scritti. Con chunks iteratore la sintesi parte dal primo
+        chunk mentre i successivi vengono ancora letti; se l'iteratore fallisce il suo errore
+        viene rilanciato dopo aver scritto i chunk già letti.
+        """
+        writer = Mp3StreamWriter(fileobj)
+        try:
+            self.run(self._synthesize_stream(chunks, writer, voice, speed_to_rate(speed), progress))
+        finally:
+            writer.close()
+        return writer.seconds
+
+    async def _synthesize_stream(self, chunks, writer, voice, rate, progress):
+        feed = _ChunkFeed(chunks)
+        window = max(1, self.concurrency)
+        head = [0]
+        buffers = {}
+        # completati ma non ancora scritti: quelli già scritti sono tutti prima di head
+        finished = set()
+        failure = []
+        changed = asyncio.Condition()
+
+        async def worker():
+            while True:
+                item = await feed.next()
+                if item is None or failure:
+                    return
+                i, text = item
+                async with changed:
+                    await changed.wait_for(lambda: failure or i < head[0] + window)
+                if failure:
+                    return
+
+                def sink(data, i=i):
+                    if i == head[0]:
+                        writer.feed(data)
+                    else:
+                        buffers.setdefault(i, bytearray()).extend(data)
+
+                def reset(i=i):
+                    # tentativo fallito: si scarta l'audio parziale, ovunque sia finito
+                    if i == head[0]:
+                        writer.abort_segment()
+                        writer.begin_segment()
+                    else:
+                        buffers.pop(i, None)
+
+                try:
+                    await self._chunk_audio(text, voice, rate, sink, reset)
+                except Exception as e:
+                    failure.append((i, e))
+                    buffers.pop(i, None)
+                    async with changed:
+                        changed.notify_all()
+                    return
+                finished.add(i)
+                if progress:
+                    progress(i, head[0] + len(finished), feed.total)
+                async with changed:
+                    while head[0] in finished:
+                        finished.remove(head[0])
+                        writer.end_segment()
+                        head[0] += 1
+                        writer.begin_segment()
+                        data = buffers.pop(head[0], None)
+                        if data:
+                            writer.feed(data)
+                    changed.notify_all()
+
+        await asyncio.gather(*[asyncio.ensure_future(worker()) for _ in range(self._worker_count(feed))])
+        if failure:
+            if head[0] < feed.count:
+                writer.abort_segment()
+            index, error = min(failure, key=lambda f: f[0])
+            raise SynthesisError(index, error, set(range(head[0])))
+        if feed.error is not None:
+            raise feed.error
+
+    def _record(self, chars, nbytes, latency, ok=True, attempt=1, cached=False, error=None):
+        if self.metrics is not None:
+            self.metrics.request(chars, nbytes, latency, ok, attempt, cached,
+                                 None if error is None else (str(error) or type(error).__name__))
+
+    async def _with_retries(self, attempt, reset=None, chars=0):
+        """Esegue attempt() rispettando il limiter; in caso di errore ritenta dopo il backoff.
+
+        attempt() restituisce i byte di audio ricevuti, usati solo per le metriche.
+        """
+        tries = 1
+        while True:
+            started = await self.limiter.acquire()
+            timeout = False
+            try:
+                nbytes = await asyncio.wait_for(attempt(), self.request_timeout)
+            except asyncio.TimeoutError as e:
+                error = e
+                timeout = True
+            except Exception as e:
+                error = e
+            else:
+                await self.limiter.release(started, True)
+                self._record(chars, nbytes or 0, time.monotonic() - started, attempt=tries)
+                return
+            await self.limiter.release(started, False, timeout)
+            self._record(chars, 0, time.monotonic() - started, False, tries, error=error)
+            if reset:
+                reset()
+            if tries >= self.retry.max_attempts:
+                raise error
+            self.limiter.retries += 1
+            await asyncio.sleep(self.retry.delay(tries))
+            tries += 1
+
+    async def _chunk_audio(self, text, voice, rate, sink, reset):
+        """Passa a sink l'audio del chunk: dalla cache se c'è, altrimenti dal servizio."""
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(text, voice, rate)
+            path = self.cache.get(key)
+            if path is not None:
+                start = time.monotonic()
+                size = 0
+                with open(path, "rb") as f:
+                    while True:
+                        data = f.read(STREAM_READ_SIZE)
+                        if not data:
+                            break
+                        size += len(data)
+                        sink(data)
+                self._record(len(text), size, time.monotonic() - start, cached=True)
+                return
+
+        async def attempt():
+            size = 0
+            async for data in self._fetch_audio(text, voice, rate, key):
+                size += len(data)
+                sink(data)
+            return size
+
+        await self._with_retries(attempt, reset, len(text))
+
+    async def _fetch_audio(self, text, voice, rate, key):
+        if key is None:
+            async for data in self._stream_chunk(text, voice, rate):
+                yield data
+            return
+        tmp_path = self.cache.reserve(key)
+        try:
+            with open(tmp_path, "wb") as f:
+                async for data in self._stream_chunk(text, voice, rate):
+                    f.write(data)
+                    yield data
+            self.cache.commit(key, tmp_path)
+        except BaseException:
+            self.cache.discard(tmp_path)
+            raise
+
+    def _communicate(self, text, voice, rate):
+        if self.communicate is not None:
+            return self.communicate(text, voice, rate=rate)
+        import edge_tts
+        return edge_tts.Communicate(text, voice, rate=rate)
+
+    async def _stream_chunk(self, text, voice, rate):
+        communicate = self._communicate(text, voice, rate)
+        async for message in communicate.stream():
+            if message["type"] == "audio":
+                yield message["data"]
+
+    async def synthesize_chunk(self, text, output_path, voice, speed):
+        """Coroutine per un solo chunk, con cache, limiter e tentativi, da eseguire sul loop
+        del motore (run()) insieme ad altro lavoro asincrono, come fa la coda dei lavori."""
+        await self._produce_chunk(text, output_path, voice, speed_to_rate(speed))
+
+    async def _produce_chunk(self, text, output_path, voice, rate):
+        if self.cache is None:
+            async def attempt():
+                await self._synthesize_chunk(text, output_path, voice, rate)
+                return os.path.getsize(output_path)
+
+            await self._with_retries(attempt, chars=len(text))
+            return
+        key = self.cache.key(text, voice, rate)
+        path = self.cache.get(key)
+        if path is None:
+            async def attempt():
+                tmp_path = self.cache.reserve(key)
+                try:
+                    await self._synthesize_chunk(text, tmp_path, voice, rate)
+                    return os.path.getsize(self.cache.commit(key, tmp_path))
+                except BaseException:
+                    self.cache.discard(tmp_path)
+                    raise
+
+            await self._with_retries(attempt, chars=len(text))
+        else:
+            self._record(len(text), os.path.getsize(path), 0.0, cached=True)
+        self.cache.materialize(key, output_path)
+
+    async def _synthesize_chunk(self, text, output_path, voice, rate):
+        communicate = self._communicate(text, voice, rate)
+        await communicate.save(output_path)
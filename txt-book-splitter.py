@@ -1,31 +1,7 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import os
-import re
-
-def split_text_into_parts(text, num_parts):
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-    
-    # Calcolo del numero totale di parole
-    total_words = sum(len(sentence.split()) for sentence in sentences)
-    words_per_part = total_words // num_parts
-
-    parts = []
-    current_part = ""
-    current_word_count = 0
-
-    for sentence in sentences:
-        sentence_word_count = len(sentence.split())
-        if current_word_count + sentence_word_count <= words_per_part or len(parts) == num_parts - 1:
-            current_part += sentence + " "
-            current_word_count += sentence_word_count
-        else:
-            parts.append(current_part.strip())
-            current_part = sentence + " "
-            current_word_count = sentence_word_count
-
-    parts.append(current_part.strip())
-    return parts
+from shard_coordinator import DEFAULT_VOICE, write_shards
 
 def browse_file():
     file_path = filedialog.askopenfilename(filetypes=[("Text files", "*.txt")])
@@ -46,21 +22,19 @@ def start_split():
         messagebox.showerror("Errore", "File non trovato.")
         return
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        text = f.read()
-
-    parts = split_text_into_parts(text, num_parts)
     base_name = os.path.splitext(os.path.basename(file_path))[0]
-
     output_dir = os.path.join(os.path.dirname(file_path), f"{base_name}_split")
-    os.makedirs(output_dir, exist_ok=True)
-
-    for i, part in enumerate(parts):
-        output_path = os.path.join(output_dir, f"{base_name}_part{i+1}.txt")
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(part)
+    voice = entry_voice.get().strip() or DEFAULT_VOICE
+    # parti di durata simile alla velocità di lettura misurata per la voce
+    try:
+        manifest = write_shards(file_path, output_dir, num_parts, voice, speed_combo.get(), base_name=base_name)
+    except ValueError:
+        messagebox.showerror("Errore", "Il file non contiene testo.")
+        return
 
-    messagebox.showinfo("Completato", f"File diviso in {len(parts)} parti in:\n{output_dir}")
+    messagebox.showinfo("Completato", f"File diviso in {len(manifest.shards)} parti in:\n{output_dir}\n\n"
+                        f"{manifest.summary()}\n\nPer sintetizzarle su più processi o computer:\n"
+                        f"python shard_coordinator.py serve \"{manifest.path}\"")
 
 # GUI
 root = tk.Tk()
@@ -75,6 +49,17 @@ tk.Label(root, text="Numero di parti:").grid(row=1, column=0, sticky="e")
 entry_parts = tk.Entry(root, width=10)
 entry_parts.grid(row=1, column=1, sticky="w")
 
-tk.Button(root, text="Dividi", command=start_split).grid(row=2, column=1, pady=10)
+tk.Label(root, text="Voce:").grid(row=2, column=0, sticky="e")
+entry_voice = tk.Entry(root, width=50)
+entry_voice.insert(0, DEFAULT_VOICE)
+entry_voice.grid(row=2, column=1, padx=5)
+
+tk.Label(root, text="Velocità:").grid(row=3, column=0, sticky="e")
+speed_combo = ttk.Combobox(root, state="readonly", width=8,
+                           values=['0.5', '0.75', '1.0', '1.25', '1.5', '1.75', '2.0'])
+speed_combo.current(2)
+speed_combo.grid(row=3, column=1, sticky="w")
+
+tk.Button(root, text="Dividi", command=start_split).grid(row=4, column=1, pady=10)
 
 root.mainloop()
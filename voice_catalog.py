@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from chunk_cache import default_cache_root
+
+# le voci di edge_tts cambiano raramente: una settimana evita quasi tutte le richieste all'avvio
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def voices_by_locale(voices):
+    result = {}
+    for voice in voices:
+        result.setdefault(voice["Locale"], []).append(voice["ShortName"])
+    return result
+
+
+class VoiceCatalog:
+    """Elenco delle voci di edge_tts salvato su disco, usabile subito all'avvio e offline.
+
+    load() legge la copia locale; se è più vecchia di ttl (stale) va aggiornata con refresh(),
+    di solito da un thread in background.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path or os.path.join(default_cache_root(), "voices.json")
+        self.ttl = ttl
+        self.voices = []
+        self.fetched_at = None
+
+    @property
+    def stale(self):
+        return self.fetched_at is None or time.time() - self.fetched_at > self.ttl
+
+    def load(self):
+        """Carica le voci salvate; restituisce False se la copia locale manca o non è valida."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            voices = data["voices"]
+            fetched_at = float(data["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if not isinstance(voices, list) or not voices:
+            return False
+        self.voices = voices
+        self.fetched_at = fetched_at
+        return True
+
+    def save(self, voices):
+        fetched_at = time.time()
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": fetched_at, "voices": voices}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.voices = voices
+        self.fetched_at = fetched_at
+
+    def refresh(self, run=asyncio.run, list_voices=None):
+        """Scarica l'elenco aggiornato e lo salva; run esegue la coroutine (es. SynthesisEngine.run).
+
+        list_voices sostituisce edge_tts.list_voices (es. con un finto servizio).
+        """
+        if list_voices is None:
+            import edge_tts
+            list_voices = edge_tts.list_voices
+        voices = run(list_voices())
+        self.save(voices)
+        return voices